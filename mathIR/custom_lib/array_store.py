@@ -0,0 +1,150 @@
+"""
+File of named flat arrays, mapped read only
+
+Every array is stored as raw native byte order values so a process can mmap the
+file and use the arrays in place.  The pages are clean file backed pages, so
+any number of server worker processes that open the same file share one
+copy of the data in the page cache instead of each holding its own.
+
+File layout (sections 8 byte aligned):
+    - header: magic, version, array count
+    - directory: name length, name, typecode, byte offset, item count per array
+    - array data
+
+array_store.py
+"""
+import mmap
+import os
+import struct
+from array import array
+
+MAGIC = b'MIRA'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+ENTRY = struct.Struct('<H32scQQ')
+ALIGNMENT = 8
+
+
+# ---------------------------------------------------------------------------------
+# write named arrays to one file
+#
+# @input: filename: path of the file to write
+#         arrays: dictionary of name -> array.array (or anything with typecode
+#                 and tobytes(), bytes are stored with typecode 'B')
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_array_store(filename, arrays):
+    names = sorted(arrays.keys())
+    offset = HEADER.size + ENTRY.size * len(names)
+    entries = []
+    for name in names:
+        values = arrays[name]
+        if isinstance(values, (bytes, bytearray)):
+            values = array('B', values)
+        offset += -offset % ALIGNMENT
+        entries.append((name, values, offset))
+        offset += values.itemsize * len(values)
+
+    tmp_name = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_name, 'wb') as out_file:
+        out_file.write(HEADER.pack(MAGIC, VERSION, len(names)))
+        for name, values, offset in entries:
+            encoded = name.encode('utf-8')
+            out_file.write(ENTRY.pack(len(encoded), encoded, values.typecode.encode('ascii'), offset, len(values)))
+        for name, values, offset in entries:
+            out_file.write(b'\0' * (offset - out_file.tell()))
+            out_file.write(values.tobytes())
+    os.replace(tmp_name, filename)
+
+
+class MappedFile:
+    """
+    Pickled as the arguments it was opened with, init_args(), and opened again
+    from them when unpickled, so a mapped file is mapped again instead of
+    being copied into the pickle.  The default is the filename alone.
+    """
+
+    def init_args(self):
+        return (self.filename,)
+
+    def __getstate__(self):
+        return self.init_args()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class ArrayStore(MappedFile):
+    """
+    Read only mapping of an array store file, store[name] is a memoryview of
+    the array cast to its typecode.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d array store' % (filename, VERSION))
+        view = memoryview(self._map)
+        self._arrays = {}
+        for num in range(count):
+            name_length, name, typecode, offset, length = ENTRY.unpack_from(self._map, HEADER.size + num * ENTRY.size)
+            typecode = typecode.decode('ascii')
+            size = array(typecode).itemsize * length
+            self._arrays[name[:name_length].decode('utf-8')] = view[offset:offset + size].cast(typecode)
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def keys(self):
+        return self._arrays.keys()
+
+    def close(self):
+        for values in self._arrays.values():
+            values.release()
+        self._arrays = {}
+        self._map.close()
+        self._file.close()
+
+
+# ---------------------------------------------------------------------------------
+# pack strings into an offsets array and a utf-8 blob, string i is
+# blob[offsets[i]:offsets[i + 1]]
+#
+# @input: strings: list of strings
+#         typecode: of the offsets, 'Q' once the blob may pass 4GB
+# @return: offsets: array of typecode (one more than the number of strings)
+#          blob: bytearray of the encoded strings
+# ---------------------------------------------------------------------------------
+def pack_strings(strings, typecode='I'):
+    offsets = array(typecode, [0])
+    blob = bytearray()
+    for string in strings:
+        blob.extend(string.encode('utf-8'))
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+class StringTable:
+    """
+    List style view of strings packed by pack_strings.
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __getitem__(self, num):
+        return bytes(self._blob[self._offsets[num]:self._offsets[num + 1]]).decode('utf-8')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        for num in range(len(self)):
+            yield self[num]
@@ -0,0 +1,404 @@
+"""
+Compact binary inverted index
+
+Layout of an index file (all integers little endian, sections 8 byte aligned):
+    - header: magic, version, term count, doc count and the offset of each section
+    - term offsets: uint32 offset of each term in the term blob (term count + 1)
+    - term blob: utf-8 terms, sorted by their encoded bytes
+    - term info: idf (float64), doc count (uint32), postings length (uint32)
+      and postings offset (uint64) for each term
+    - postings: for each posting the doc id gap and the term frequency,
+      both varint encoded
+
+The file is opened with mmap so only the pages touched by a query are read,
+a term lookup is a binary search over the lexicon and postings are decoded
+when they are asked for.
+
+binary_index.py
+"""
+import mmap
+import struct
+import os
+import csv
+from array import array
+from math import log
+from .cache import LRUCache
+from .array_store import MappedFile
+
+MAGIC = b'MIRX'
+VERSION = 2
+HEADER = struct.Struct('<4sHHIIQQQQ')
+TERM_INFO = struct.Struct('<dIIQ')
+ALIGNMENT = 8
+POSTINGS_CACHE_SIZE = 2000000
+
+
+class IndexFormatError(ValueError):
+    """
+    An index file in a format this version can not read, the collection has to
+    be indexed again.
+    """
+
+
+# ---------------------------------------------------------------------------------
+# error for a tsv whose doc ids are not doc numbers, index_collection used to
+# write the collection ids ('10-1234') in their place
+#
+# @input: filename: path of the tsv
+# @return: IndexFormatError
+# ---------------------------------------------------------------------------------
+def old_doc_ids(filename):
+    return IndexFormatError('%s does not have numbered doc ids, it was probably written by an older '
+                            'index_collection with collection ids: re-run index_collection' % filename)
+
+
+# ---------------------------------------------------------------------------------
+# encode a non negative integer as a varint, 7 bits per byte, low bits first
+#
+# @input: value: integer to encode
+#         out: bytearray the encoded bytes are appended to
+# @return: None
+# ---------------------------------------------------------------------------------
+def encode_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+# ---------------------------------------------------------------------------------
+# decode a posting list written by encode_postings
+#
+# @input: buf: bytes of the posting list
+# @return: docs: int array of doc ids in increasing order
+#          freqs: int array of the term frequency in each doc
+# ---------------------------------------------------------------------------------
+def decode_postings(buf):
+    docs = array('i')
+    freqs = array('i')
+    doc = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        doc += value
+
+        byte = buf[pos]
+        pos += 1
+        freq = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = buf[pos]
+            pos += 1
+            freq |= (byte & 0x7f) << shift
+            shift += 7
+        docs.append(doc)
+        freqs.append(freq)
+    return docs, freqs
+
+
+# ---------------------------------------------------------------------------------
+# delta + varint encode a posting list
+#
+# @input: postings: list of (doc id, term frequency)
+# @return: bytearray of the encoded list
+# ---------------------------------------------------------------------------------
+def encode_postings(postings):
+    out = bytearray()
+    prev = 0
+    for doc, freq in sorted(postings):
+        encode_varint(doc - prev, out)
+        encode_varint(freq, out)
+        prev = doc
+    return out
+
+
+def _pad(out):
+    out.extend(b'\0' * (-len(out) % ALIGNMENT))
+
+
+def _string_table(strings):
+    offsets = bytearray()
+    blob = bytearray()
+    for s in strings:
+        offsets.extend(struct.pack('<I', len(blob)))
+        blob.extend(s.encode('utf-8'))
+    offsets.extend(struct.pack('<I', len(blob)))
+    return offsets, blob
+
+
+# ---------------------------------------------------------------------------------
+# write a binary index file
+#
+# @input: filename: path of the file to write
+#         index: dictionary of term -> list of (doc id, term frequency)
+#         doc_count: number of docs in the collection
+#         idfs: optional dictionary of term -> idf, computed from doc count if
+#               not given
+#         encode: function encoding one posting list to bytes
+#         magic: file type, read back by the BinaryIndex subclass of that type
+#         version: of the posting format
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_binary_index(filename, index, doc_count, idfs=None, encode=encode_postings, magic=MAGIC,
+                       version=VERSION):
+    terms = sorted(index.keys(), key=lambda t: t.encode('utf-8'))
+
+    term_offsets, term_blob = _string_table(terms)
+    term_info = bytearray()
+    postings_blob = bytearray()
+    for term in terms:
+        postings = index[term]
+        num_docs = len(postings)
+        if idfs is not None:
+            idf = float(idfs[term])
+        else:
+            idf = log(doc_count / num_docs)
+        encoded = encode(postings)
+        term_info.extend(TERM_INFO.pack(idf, num_docs, len(encoded), len(postings_blob)))
+        postings_blob.extend(encoded)
+
+    body = bytearray()
+    sections = []
+    for section in (term_offsets, term_blob, term_info, postings_blob):
+        _pad(body)
+        sections.append(HEADER.size + len(body))
+        body.extend(section)
+    header = HEADER.pack(magic, version, 0, len(terms), doc_count, *sections)
+
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as out_file:
+        out_file.write(header)
+        out_file.write(body)
+    os.replace(tmp_name, filename)
+
+
+# ---------------------------------------------------------------------------------
+# convert a tsv index written by index_collection into a binary index
+#
+# @input: tsv_filename: path of the tsv index
+#         bin_filename: path of the binary index to write
+#         doc_count: number of docs in the collection, one more than the
+#                    largest doc id in the postings if not given
+# @return: None
+# ---------------------------------------------------------------------------------
+def convert_tsv_index(tsv_filename, bin_filename, doc_count=None):
+    index = {}
+    idfs = {}
+    max_doc = -1
+    with open(tsv_filename, 'r', encoding='utf-8', newline='') as index_file:
+        for line in csv.reader(index_file, delimiter='\t'):
+            try:
+                postings = [(int(doc), int(freq)) for doc, freq in
+                            (posting.split(':') for posting in line[3:])]
+            except ValueError as error:
+                raise old_doc_ids(tsv_filename) from error
+            if postings:
+                max_doc = max(max_doc, max(postings)[0])
+            index[line[0]] = postings
+            idfs[line[0]] = float(line[1])
+    if doc_count is None:
+        doc_count = max_doc + 1
+    write_binary_index(bin_filename, index, doc_count, idfs)
+
+
+class TermEntry:
+    """
+    One lexicon entry of a lazily loaded index, read like the dictionaries built
+    by get_index ('idf', 'count', 'docs').  The posting list is only read the
+    first time it is needed.
+    weight is its size in the entry cache, the doc count if not given.
+    """
+    __slots__ = ('_index', 'idf', 'count', 'weight', '_length', '_offset', '_postings', '_docs')
+
+    def __init__(self, index, idf, count, length, offset, weight=None):
+        self._index = index
+        self.idf = idf
+        self.count = count
+        self.weight = count if weight is None else weight
+        self._length = length
+        self._offset = offset
+        self._postings = None
+        self._docs = None
+
+    # -----------------------------------------------------------------------------
+    # doc ordered view of the posting list
+    #
+    # @return: docs: int array of doc ids in increasing order
+    #          freqs: int array of the term frequency in each doc
+    # -----------------------------------------------------------------------------
+    def postings(self):
+        if self._postings is None:
+            self._postings = self._index.read_postings(self._offset, self._length)
+        return self._postings
+
+    # the postings of the allowed docs only, read again on every call, for an
+    # index whose read_postings can skip to them
+    def postings_in(self, allowed):
+        return self._index.read_postings(self._offset, self._length, allowed)
+
+    # by doc view of the posting list, doc id -> term frequency
+    @property
+    def docs(self):
+        if self._docs is None:
+            self._docs = dict(zip(*self.postings()))
+        return self._docs
+
+    def __getitem__(self, key):
+        if key == 'docs':
+            return self.docs
+        elif key == 'idf':
+            return self.idf
+        elif key == 'count':
+            return self.count
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('docs', 'idf', 'count')
+
+
+def entry_weight(entry):
+    return entry.weight
+
+
+class LexiconIndex:
+    """
+    Dictionary style lookups shared by the index readers:
+        term in index, index[term]['docs'|'idf'|'count'], iteration, len
+    Subclasses give the term count and implement term(num), make_entry(num),
+    read_postings(offset, length) and either find(term) or _term_bytes(num)
+    over a lexicon sorted by utf-8 bytes.  Entries that have been
+    looked up, and the postings they decoded, are kept in an LRU cache of at
+    most cache_size postings.
+    """
+    term_count = 0
+
+    def __init__(self, cache_size=POSTINGS_CACHE_SIZE):
+        self._entries = LRUCache(cache_size, entry_weight)
+
+    # the entry cache is not pickled, only its size
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = self._entries.max_weight
+        return state
+
+    def __setstate__(self, state):
+        cache_size = state.pop('_entries')
+        self.__dict__.update(state)
+        self._entries = LRUCache(cache_size, entry_weight)
+
+    def entry(self, num):
+        return self.get(self.term(num))
+
+    # -----------------------------------------------------------------------------
+    # binary search the sorted lexicon for a term
+    #
+    # @input: term: string to look up
+    # @return: term number or -1 if not in the index
+    # -----------------------------------------------------------------------------
+    def find(self, term):
+        key = term.encode('utf-8')
+        low = 0
+        high = self.term_count - 1
+        while low <= high:
+            mid = (low + high) // 2
+            mid_term = self._term_bytes(mid)
+            if mid_term < key:
+                low = mid + 1
+            elif mid_term > key:
+                high = mid - 1
+            else:
+                return mid
+        return -1
+
+    def get(self, term, default=None):
+        entry = self._entries.get(term)
+        if entry is None:
+            num = self.find(term)
+            if num < 0:
+                return default
+            entry = self.make_entry(num)
+            self._entries.put(term, entry)
+        return entry
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return term in self._entries or self.find(term) >= 0
+
+    def __len__(self):
+        return self.term_count
+
+    def __iter__(self):
+        for num in range(self.term_count):
+            yield self.term(num)
+
+    def keys(self):
+        return iter(self)
+
+    # entries from items() skip the cache, a full scan would only evict the
+    # entries the current queries are using
+    def items(self):
+        for num in range(self.term_count):
+            yield self.term(num), self.make_entry(num)
+
+
+class BinaryIndex(MappedFile, LexiconIndex):
+    """
+    Read only view of a binary index file.  Subclasses reading another
+    posting format set magic and version and override read_postings.
+    """
+    magic = MAGIC
+    version = VERSION
+
+    def __init__(self, filename, cache_size=POSTINGS_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _flags, self.term_count, self.doc_count, term_offsets, term_blob,
+         term_info, postings) = HEADER.unpack_from(self._map, 0)
+        if magic != self.magic or version != self.version:
+            raise ValueError('%s is not a version %d %s index' % (filename, self.version, self.magic.decode('ascii')))
+        view = memoryview(self._map)
+        self._term_offsets = view[term_offsets:term_offsets + 4 * (self.term_count + 1)].cast('I')
+        self._term_blob = term_blob
+        self._term_info = term_info
+        self._postings = postings
+
+    def close(self):
+        self._term_offsets.release()
+        self._map.close()
+        self._file.close()
+
+    # the entry cache is not pickled, only its size
+    def init_args(self):
+        return self.filename, self._entries.max_weight
+
+    def _term_bytes(self, num):
+        start = self._term_blob + self._term_offsets[num]
+        end = self._term_blob + self._term_offsets[num + 1]
+        return self._map[start:end]
+
+    def term(self, num):
+        return self._term_bytes(num).decode('utf-8')
+
+    def make_entry(self, num):
+        idf, count, length, offset = TERM_INFO.unpack_from(self._map, self._term_info + num * TERM_INFO.size)
+        return TermEntry(self, idf, count, length, offset)
+
+    def read_postings(self, offset, length):
+        start = self._postings + offset
+        return decode_postings(self._map[start:start + length])
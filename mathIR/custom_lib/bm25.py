@@ -0,0 +1,186 @@
+"""
+Vectorized BM25 scoring
+
+The length normalization K_1 * ((1 - B) + B * dl / avg_dl) of every document
+only depends on the doc table, so a BM25Engine computes it once as a NumPy
+array.  A query scores each term's whole posting list with array operations
+and sums the scores of the docs the lists share, so a query costs about the
+length of its posting lists whatever the size of the collection.  The top k
+documents are picked with argpartition instead of sorting every match.
+
+bm25.py
+"""
+import math
+import weakref
+from collections import namedtuple
+import numpy as np
+from .intersect import locate, EMPTY
+
+# -----
+# BM25 parameters
+# -----
+K_1 = 1.2
+K_2 = 100.0
+B = 0.75
+R = 0
+R_i = 0
+MIN_TERM_WEIGHT = -0.25
+
+
+# ---------------------------------------------------------------------------------
+# read a posting list as arrays from any loaded index entry, a LexiconIndex
+# TermEntry or a get_index dictionary
+#
+# @input: entry: index[term]
+# @return: docs: int64 array of doc ids
+#          freqs: float64 array of the term frequency in each doc
+# ---------------------------------------------------------------------------------
+def get_postings(entry):
+    if hasattr(entry, 'postings'):
+        docs, freqs = entry.postings()
+        return np.asarray(docs, dtype=np.int64), np.asarray(freqs, dtype=np.float64)
+    docs = entry['docs']
+    return (np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+            np.fromiter(docs.values(), dtype=np.float64, count=len(docs)))
+
+
+# posting list of one query term: how often the term is in the query, the
+# number of docs it is in, its idf and its postings as arrays
+TermPostings = namedtuple('TermPostings', 'term count n_i idf docs freqs')
+
+
+def count_terms(terms):
+    term_counts = {}
+    for term in terms:
+        if term in term_counts:
+            term_counts[term] += 1
+        else:
+            term_counts[term] = 1
+    return term_counts
+
+
+# ---------------------------------------------------------------------------------
+# weight of a term from the number of documents it is in
+#
+# @input: n_i: number of docs with the term
+#         n: number of docs in the collection
+# @return: term weight, at least MIN_TERM_WEIGHT
+# ---------------------------------------------------------------------------------
+def term_weight(n_i, n):
+    weight = math.log(((R_i + 0.5) / (R - R_i + 0.5)) / ((n_i - R_i + 0.5) / (n - n_i - R + R_i + 0.5)))
+    return max(weight, MIN_TERM_WEIGHT)
+
+
+def query_term_weight(count):
+    return ((K_2 + 1) * count) / (K_2 + count)
+
+
+# ---------------------------------------------------------------------------------
+# read the posting lists of the query terms once, terms not in the index are
+# left out
+#
+# @input: terms: list of query terms, repeated terms count more
+#         index: frequency index
+# @return: list of TermPostings in query order
+# ---------------------------------------------------------------------------------
+def fetch_postings(terms, index):
+    term_postings = []
+    for term, count in count_terms(terms).items():
+        try:
+            entry = index[term]
+            n_i = float(entry['count'])
+        except KeyError:
+            continue
+        term_postings.append(TermPostings(term, count, n_i, entry['idf'], *get_postings(entry)))
+    return term_postings
+
+
+class BM25Engine:
+    """
+    BM25 over one doc table.
+        doc_k: NumPy array of the length normalization of each doc
+        doc_k_list(): doc_k as a list, for scoring one doc at a time
+        score(terms, index, allowed): matched docs and their scores
+        score_postings(term_postings, allowed): the same from fetch_postings
+        top_k(docs, scores, k): positions of the best k docs, highest score
+            first
+    """
+
+    def __init__(self, doc_index):
+        self.doc_count = len(doc_index)
+        avg_dl = doc_index.avg_dl
+        self.doc_k = K_1 * ((1 - B) + B * (np.asarray(doc_index.words, dtype=np.float64) / avg_dl))
+        self._doc_k_list = None
+
+    def doc_k_list(self):
+        if self._doc_k_list is None:
+            self._doc_k_list = self.doc_k.tolist()
+        return self._doc_k_list
+
+    # -----------------------------------------------------------------------------
+    # score every doc containing a query term
+    #
+    # @input: terms: list of query terms, repeated terms count more
+    #         index: frequency index
+    #         allowed: optional sorted int array of the docs that may be scored
+    # @return: docs: int64 array of the docs containing a query term, in
+    #                increasing order
+    #          scores: float64 array of the score of each doc
+    # -----------------------------------------------------------------------------
+    def score(self, terms, index, allowed=None):
+        return self.score_postings(fetch_postings(terms, index), allowed)
+
+    def score_postings(self, term_postings, allowed=None):
+        doc_parts = []
+        score_parts = []
+        for postings in term_postings:
+            docs = postings.docs
+            freqs = postings.freqs
+            if allowed is not None:
+                keep = locate(allowed, docs)[1]
+                docs = docs[keep]
+                freqs = freqs[keep]
+            weight = term_weight(postings.n_i, self.doc_count) * query_term_weight(postings.count)
+            doc_parts.append(docs)
+            score_parts.append(weight * (K_1 + 1) * freqs / (self.doc_k[docs] + freqs))
+        if not doc_parts:
+            return EMPTY, np.empty(0)
+        docs, slots = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        # bincount adds the terms of a doc in query order, the same sum as
+        # adding one posting list after the other
+        scores = np.bincount(slots, weights=np.concatenate(score_parts), minlength=len(docs))
+        return docs, scores
+
+    # -----------------------------------------------------------------------------
+    # pick the best scoring docs
+    #
+    # @input: docs, scores: from score()
+    #         k: number of docs to keep, None keeps every matched doc
+    # @return: int64 array of positions in docs, highest score first, ties by
+    #          doc id
+    # -----------------------------------------------------------------------------
+    def top_k(self, docs, scores, k=None):
+        positions = np.arange(len(docs))
+        if k is not None and k < len(docs):
+            kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            # docs are in id order, so the docs tied with the k-th best keep the lowest ids
+            better = np.flatnonzero(scores > kth)
+            positions = np.concatenate((better, np.flatnonzero(scores == kth)[:k - len(better)]))
+        return positions[np.lexsort((positions, -scores[positions]))]
+
+
+_engines = weakref.WeakKeyDictionary()
+
+
+# ---------------------------------------------------------------------------------
+# the engine of a doc table, built the first time it is asked for
+#
+# @input: doc_index: DocTable
+# @return: BM25Engine
+# ---------------------------------------------------------------------------------
+def get_engine(doc_index):
+    engine = _engines.get(doc_index)
+    if engine is None:
+        engine = BM25Engine(doc_index)
+        _engines[doc_index] = engine
+    return engine
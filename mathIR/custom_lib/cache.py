@@ -0,0 +1,78 @@
+"""
+Bounded least recently used cache
+
+cache.py
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Dictionary style cache that evicts the least recently used entries once
+    the total weight of its values is over max_weight.  The weight of a value
+    is given by the weigher function, every value weighs 1 if none is given.
+    With a ttl, entries older than ttl seconds are dropped when they are read.
+    hits and misses count the get calls that found / did not find a value.
+    """
+
+    def __init__(self, max_weight, weigher=None, ttl=None):
+        self.max_weight = max_weight
+        self.weight = 0
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._weigher = weigher
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _weigh(self, value):
+        if self._weigher is None:
+            return 1
+        return self._weigher(value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, weight, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                self.weight -= weight
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        weight = self._weigh(value)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self.weight -= self._entries.pop(key)[1]
+            if weight > self.max_weight:
+                return
+            self._entries[key] = (value, weight, expires)
+            self.weight += weight
+            while self.weight > self.max_weight:
+                _, (_, old_weight, _) = self._entries.popitem(last=False)
+                self.weight -= old_weight
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
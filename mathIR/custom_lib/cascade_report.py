@@ -0,0 +1,95 @@
+"""
+Report how many of the relevant documents the cascade's BM25 stage keeps
+
+The cascade only re-ranks the best N BM25 documents, so a relevant document
+BM25 ranks below N can never be returned.  For each N this reports the recall
+of the top N BM25 candidates over the judged queries in the training data
+(lines of query, collection id, relevance written by make_training_data_file)
+and the average time of the whole cascade, to pick CASCADE_DEPTH.
+
+usage:
+    python -m mathIR.custom_lib.cascade_report [<N> ...]
+
+cascade_report.py
+"""
+import sys
+import csv
+import time
+from .utils import get_doc_table, load_index, get_svm_weights, format_text
+from .retrieval_algorithms import get_candidates, query_cascade, TRAINING_DATA_FILE_NAME
+
+DEPTHS = [10, 25, 50, 100, 250, 500, 1000]
+
+
+# ---------------------------------------------------------------------------------
+# read the judged queries
+#
+# @input: doc_index: DocTable to map collection ids to doc ids
+#         filename: training data tsv
+# @return: dictionary of query text -> set of relevant doc ids
+# ---------------------------------------------------------------------------------
+def get_qrels(doc_index, filename=TRAINING_DATA_FILE_NAME):
+    qrels = {}
+    with open(filename, 'r', encoding='utf-8', newline='') as data_file:
+        for line in csv.reader(data_file, delimiter='\t'):
+            if len(line) < 3:
+                continue
+            relevant = qrels.setdefault(line[0], set())
+            if int(line[2].strip()) > 0:
+                try:
+                    relevant.add(doc_index.doc_number(line[1]))
+                except KeyError:
+                    print(line[1], 'not in the doc table')
+    return {query_text: relevant for query_text, relevant in qrels.items() if relevant}
+
+
+# ---------------------------------------------------------------------------------
+# print the recall and cascade time at each depth
+#
+# @input: depths: list of candidate counts
+#         mode: index mode given to load_index
+# @return: dictionary of depth -> (macro recall, micro recall, ms per query)
+# ---------------------------------------------------------------------------------
+def report(depths=DEPTHS, mode='binary'):
+    doc_index = get_doc_table()
+    index = load_index(mode)
+    anchor_index = load_index(mode, anchor=True)
+    svm_weights = get_svm_weights()
+    qrels = get_qrels(doc_index)
+    depths = sorted(depths)
+
+    recalls = {depth: [] for depth in depths}
+    found = {depth: 0 for depth in depths}
+    total = 0
+    for query_text, relevant in qrels.items():
+        candidates = get_candidates(format_text(query_text), index, doc_index, depths[-1])
+        total += len(relevant)
+        for depth in depths:
+            hits = len(relevant.intersection(candidates[:depth]))
+            recalls[depth].append(hits / len(relevant))
+            found[depth] += hits
+
+    print('%d judged queries, %d relevant docs' % (len(qrels), total))
+    print('{:>8} {:>12} {:>12} {:>10}'.format('N', 'recall', 'micro', 'ms/query'))
+    results = {}
+    for depth in depths:
+        t1 = time.perf_counter()
+        for query_text in qrels:
+            query_cascade(format_text(query_text), index, doc_index, anchor_index, svm_weights, depth)
+        ms = (time.perf_counter() - t1) * 1000 / max(len(qrels), 1)
+        macro = sum(recalls[depth]) / max(len(recalls[depth]), 1)
+        micro = found[depth] / max(total, 1)
+        results[depth] = (macro, micro, ms)
+        print('{:>8} {:>12.3f} {:>12.3f} {:>10.1f}'.format(depth, macro, micro, ms))
+    return results
+
+
+def main(args):
+    if args:
+        report([int(depth) for depth in args])
+    else:
+        report()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,204 @@
+"""
+Compressed store of the collection pages with random access
+
+A .tar.bz2 archive is one compressed stream, reading a page from it means
+decompressing everything before it, which is why the pages used to be
+extracted to their own directory.  index_collection copies every page out of
+the archives into a store file instead, gzip compressed in blocks of about
+BLOCK_SIZE bytes (a page larger than that is a block of its own), so getting
+a page is one lookup in the doc table of the store and decompressing one
+block.  The pages last read are kept decompressed in an LRU cache of at most
+cache_size bytes.
+
+A page that is a block of its own, most of the collection, is already a
+gzip file in the store: open_page gives a file object over that part of the
+store file, which a client that accepts gzip is sent as it is.
+
+File layout (integers little endian):
+    - header: magic, version, doc count, block count, offset of the doc table
+    - blocks: the gzip compressed blocks, back to back
+    - doc table (8 byte aligned): uint64 file offset of each block and of the
+      end of the last one, uint32 decompressed size of each block, then for
+      each doc id the uint32 block number, start in the decompressed block
+      and length of its page
+
+doc_store.py
+"""
+import io
+import mmap
+import os
+import struct
+import zlib
+from array import array
+import numpy as np
+from .cache import LRUCache
+from .array_store import MappedFile
+
+MAGIC = b'MIRD'
+VERSION = 2
+HEADER = struct.Struct('<4sHHIIQ')
+ALIGNMENT = 8
+BLOCK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+# zlib window bits for a gzip header and trailer
+GZIP_WBITS = 31
+DOC_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class DocStoreWriter:
+    """
+    Writes a doc store one page at a time, the pages can come in any order.
+        add(page): slot number of the page
+        close(order): write the doc table, order[doc id] is the slot of the
+            page of that doc
+    """
+
+    def __init__(self, filename, block_size=BLOCK_SIZE, level=COMPRESS_LEVEL):
+        self.filename = filename
+        self.block_size = block_size
+        self.level = level
+        self._tmp_name = '%s.%d.tmp' % (filename, os.getpid())
+        self._file = open(self._tmp_name, 'wb')
+        self._file.write(b'\0' * HEADER.size)
+        self._block = bytearray()
+        self._block_offsets = array('Q', [HEADER.size])
+        self._block_sizes = array('I')
+        self._blocks = array('I')
+        self._starts = array('I')
+        self._lengths = array('I')
+
+    def add(self, page):
+        if self._block and len(self._block) + len(page) > self.block_size:
+            self._flush()
+        self._blocks.append(len(self._block_offsets) - 1)
+        self._starts.append(len(self._block))
+        self._lengths.append(len(page))
+        self._block.extend(page)
+        return len(self._lengths) - 1
+
+    def _flush(self):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+        self._file.write(compressor.compress(bytes(self._block)) + compressor.flush())
+        self._block_offsets.append(self._file.tell())
+        self._block_sizes.append(len(self._block))
+        self._block = bytearray()
+
+    def close(self, order=None):
+        if self._block:
+            self._flush()
+        if order is None:
+            order = range(len(self._lengths))
+        doc_blocks = array('I', [self._blocks[slot] for slot in order])
+        doc_starts = array('I', [self._starts[slot] for slot in order])
+        doc_lengths = array('I', [self._lengths[slot] for slot in order])
+        self._file.write(b'\0' * (-self._file.tell() % ALIGNMENT))
+        table_offset = self._file.tell()
+        for values in (self._block_offsets, self._block_sizes, doc_blocks, doc_starts, doc_lengths):
+            self._file.write(values.tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, len(doc_blocks), len(self._block_offsets) - 1, table_offset))
+        self._file.close()
+        os.replace(self._tmp_name, self.filename)
+
+
+class DocStore(MappedFile):
+    """
+    Read only doc store mapped from a file written by DocStoreWriter.
+        store[doc]: bytes of the page of a doc id
+        open_page(doc, compressed): file object of the page, see below
+    """
+
+    def __init__(self, filename, cache_size=DOC_CACHE_SIZE):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, doc_count, block_count, table_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d doc store' % (filename, VERSION))
+        self._block_offsets = np.frombuffer(self._map, dtype=np.uint64, count=block_count + 1, offset=table_offset)
+        offset = table_offset + 8 * (block_count + 1)
+        self._block_sizes = np.frombuffer(self._map, dtype=np.uint32, count=block_count, offset=offset)
+        offset += 4 * block_count
+        self._doc_blocks, self._doc_starts, self._doc_lengths = \
+            [np.frombuffer(self._map, dtype=np.uint32, count=doc_count, offset=offset + 4 * doc_count * num)
+             for num in range(3)]
+        self._pages = LRUCache(cache_size, len)
+
+    # the page cache is not pickled, only its size
+    def init_args(self):
+        return self.filename, self._pages.max_weight
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def __getitem__(self, doc):
+        page = self._pages.get(doc)
+        if page is None:
+            block = int(self._doc_blocks[doc])
+            data = zlib.decompress(self._map[int(self._block_offsets[block]):int(self._block_offsets[block + 1])],
+                                   GZIP_WBITS)
+            start = int(self._doc_starts[doc])
+            page = data[start:start + int(self._doc_lengths[doc])]
+            self._pages.put(doc, page)
+        return page
+
+    # -----------------------------------------------------------------------------
+    # file object to send a page from
+    #
+    # @input: doc: doc id
+    #         compressed: True to get the page gzip compressed if it is stored
+    #                     as a block of its own
+    # @return: file: file object of the page
+    #          length: bytes to read from it
+    #          is_compressed: True if file gives the gzip compressed page
+    # -----------------------------------------------------------------------------
+    def open_page(self, doc, compressed=False):
+        block = int(self._doc_blocks[doc])
+        length = int(self._doc_lengths[doc])
+        if compressed and self._doc_starts[doc] == 0 and self._block_sizes[block] == length:
+            start = int(self._block_offsets[block])
+            stop = int(self._block_offsets[block + 1])
+            return FileRegion(self.filename, start, stop - start), stop - start, True
+        return io.BytesIO(self[doc]), length, False
+
+    def close(self):
+        self._block_offsets = self._block_sizes = self._doc_blocks = self._doc_starts = self._doc_lengths = None
+        self._map.close()
+        self._file.close()
+
+
+class FileRegion(io.RawIOBase):
+    """
+    Read only file object over length bytes of a file from offset.  fileno()
+    is the file, positioned at the start of the region, so a server that sends
+    files with sendfile sends the region from the page cache given its length.
+    """
+
+    def __init__(self, filename, offset, length):
+        super().__init__()
+        self._file = open(filename, 'rb')
+        self._file.seek(offset)
+        self._left = length
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
@@ -0,0 +1,100 @@
+"""
+Columnar document table
+
+One NumPy array per numeric column (word count, link count, page rank) and a
+packed string table per text column (collection id, title, name), all indexed
+by doc id.  The columns are written to an array store file and mapped read
+only, so worker processes share them and a query can work on whole columns
+at once instead of walking one dictionary per document.  The links of each
+document come from the link graph the table is opened with.
+
+doc_table.py
+"""
+from array import array
+import numpy as np
+from .array_store import MappedFile, ArrayStore, StringTable, write_array_store, pack_strings
+
+
+# ---------------------------------------------------------------------------------
+# write a doc table file from the rows built by get_docs_index
+#
+# @input: filename: path of the file to write
+#         doc_index: list of document dictionaries indexed by doc id
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_doc_table(filename, doc_index):
+    arrays = {'words': array('i', [doc['words'] for doc in doc_index]),
+              'links': array('i', [doc['links'] for doc in doc_index]),
+              'page_rank': array('d', [doc['page_rank'] for doc in doc_index])}
+    for column, key in (('ids', 'id'), ('titles', 'title'), ('names', 'name')):
+        offsets, blob = pack_strings([doc[key] for doc in doc_index])
+        arrays[column + '_offsets'] = offsets
+        arrays[column + '_blob'] = blob
+    write_array_store(filename, arrays)
+
+
+class DocTable(MappedFile):
+    """
+    Read only doc table mapped from a file written by write_doc_table.
+        words, links, page_rank: NumPy arrays indexed by doc id
+        ids, titles, names: string tables indexed by doc id
+        doc_id(doc), title(doc), name(doc): one string
+        graph: LinkGraph of the collection
+        links_to(doc), linked_from(doc): doc ids of the links out of / into doc
+    table[doc] gives the old get_docs_index dictionary for one document.
+    """
+
+    def __init__(self, filename, graph):
+        self.filename = filename
+        self.graph = graph
+        self._store = ArrayStore(filename)
+        self.words = np.frombuffer(self._store['words'], dtype=np.int32)
+        self.links = np.frombuffer(self._store['links'], dtype=np.int32)
+        self.page_rank = np.frombuffer(self._store['page_rank'], dtype=np.float64)
+        self.ids = StringTable(self._store['ids_offsets'], self._store['ids_blob'])
+        self.titles = StringTable(self._store['titles_offsets'], self._store['titles_blob'])
+        self.names = StringTable(self._store['names_offsets'], self._store['names_blob'])
+        self.avg_dl = float(self.words.mean()) if len(self.words) else 0.0
+        self._doc_numbers = None
+
+    def init_args(self):
+        return self.filename, self.graph
+
+    def __len__(self):
+        return len(self.words)
+
+    def doc_id(self, doc):
+        return self.ids[doc]
+
+    def title(self, doc):
+        return self.titles[doc]
+
+    def name(self, doc):
+        return self.names[doc]
+
+    def links_to(self, doc):
+        return self.graph.links_to(doc)
+
+    def linked_from(self, doc):
+        return self.graph.linked_from(doc)
+
+    # -----------------------------------------------------------------------------
+    # find the doc id of a collection id ("10-1234")
+    #
+    # @input: collection_id: string id
+    # @return: doc id, KeyError if it is not in the table
+    # -----------------------------------------------------------------------------
+    def doc_number(self, collection_id):
+        if self._doc_numbers is None:
+            self._doc_numbers = {doc_id: num for num, doc_id in enumerate(self.ids)}
+        return self._doc_numbers[collection_id]
+
+    def __getitem__(self, doc):
+        return {'id': self.doc_id(doc),
+                'title': self.title(doc),
+                'name': self.name(doc),
+                'words': int(self.words[doc]),
+                'links': int(self.links[doc]),
+                'links_to': self.links_to(doc),
+                'linked_from': self.linked_from(doc),
+                'page_rank': float(self.page_rank[doc])}
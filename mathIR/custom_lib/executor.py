@@ -0,0 +1,85 @@
+"""
+Run the independent stages of a request on a shared worker pool
+
+A request (rankers, snippet extraction and the file reads behind it) is split
+into named stages.  Stages are run on one bounded thread pool shared by every
+request, the NumPy scoring and the file reads release the GIL so stages of one
+request overlap.  Results are always read back in the order the stages were
+submitted, never in the order they finish, so a request's output does not
+depend on scheduling.  Each stage's wall time is recorded under its name.
+
+A stage must not wait on another stage's future, the waiting is done by the
+request thread, otherwise a full pool could deadlock.
+
+executor.py
+"""
+import os
+import time
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+POOL_SIZE = min(8, (os.cpu_count() or 1) + 2)
+
+_pool = None
+_pool_lock = Lock()
+
+
+# ---------------------------------------------------------------------------------
+# the worker pool shared by every request, started the first time it is asked
+# for so a forked server worker starts its own threads
+#
+# @input: None
+# @return: ThreadPoolExecutor
+# ---------------------------------------------------------------------------------
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='request')
+        return _pool
+
+
+class RequestExecutor:
+    """
+    Stages of one request.
+        submit(stage, fn, *args): Future of fn(*args) run on the pool
+        map(stage, fn, items): [fn(item) for item in items] run on the pool
+        run(stage, fn, *args): fn(*args) run in the calling thread
+        timings: dictionary of stage -> ms, in submission order
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else get_pool()
+        self.timings = {}
+        self._lock = Lock()
+
+    def _timed(self, stage, fn, args, kwargs):
+        t1 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.timings[stage] = (time.perf_counter() - t1) * 1000
+
+    def submit(self, stage, fn, *args, **kwargs):
+        with self._lock:
+            # reserve the stage's place so timings keep the submission order
+            self.timings[stage] = None
+        return self.pool.submit(self._timed, stage, fn, args, kwargs)
+
+    def run(self, stage, fn, *args, **kwargs):
+        with self._lock:
+            self.timings[stage] = None
+        return self._timed(stage, fn, args, kwargs)
+
+    # -----------------------------------------------------------------------------
+    # run fn over items in parallel
+    #
+    # @input: stage: name, item i is timed as stage[i]
+    #         fn: function of one item
+    #         items: list of items
+    # @return: list of the results in items order
+    # -----------------------------------------------------------------------------
+    def map(self, stage, fn, items):
+        futures = [self.submit('%s[%d]' % (stage, num), fn, item) for num, item in enumerate(items)]
+        return [future.result() for future in futures]
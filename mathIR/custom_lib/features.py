@@ -0,0 +1,129 @@
+"""
+Batched learning to rank features
+
+The svm features of a query are built for all the candidate documents at once
+as a NumPy matrix, one row per doc:
+    0: BM25 score of the doc over the anchor text index
+    1: share of the query words in the title, for docs with anchor text matches
+    2: page rank of the doc
+    3: mean log(tf + 1) of the query words in the doc
+    4: mean idf of the query words
+    5: proximity, the number of query words over the smallest window of the
+       doc holding all of them, 0 without a positional index or with one word
+Page rank comes straight from the doc table column and the term features are
+added a posting list at a time, looking each posting up in the sorted doc set,
+so building the rows costs about the postings of the query words plus the
+docs, whatever the size of the collection.  Scoring is one matrix-vector
+product with the svm weights, weights trained before a feature was added
+leave it out.
+
+features.py
+"""
+import weakref
+import numpy as np
+from .bm25 import get_engine, fetch_postings
+from .intersect import locate
+from .positions import min_spans
+
+FEATURE_COUNT = 6
+
+
+def similarity(query_words, doc_title):
+    num_in_title = 0
+    doc_title_words = doc_title.split()
+    for word in query_words:
+        if word in doc_title_words:
+            num_in_title += 1
+    return num_in_title/len(query_words)
+
+
+class FeatureEngine:
+    """
+    Feature matrices over one doc table.
+        features(query_words, doc_ids, index, anchor_index, positions): matrix
+            of doc_ids, term_postings and anchor_bm25 take postings and anchor
+            scores a caller already has
+        score(features, weights): svm score of each row
+    """
+
+    def __init__(self, doc_index):
+        self.doc_index = doc_index
+        self.doc_count = len(doc_index)
+        self.page_rank = np.asarray(doc_index.page_rank, dtype=np.float64)
+        self.bm25 = get_engine(doc_index)
+
+    # -----------------------------------------------------------------------------
+    # build the feature matrix of a query
+    #
+    # @input: query_words: list of query terms
+    #         doc_ids: list or array of the doc ids to build rows for
+    #         index: frequency index
+    #         anchor_index: anchor text frequency index
+    #         term_postings: fetch_postings(query_words, index) if already read
+    #         anchor_bm25: (docs, scores) of query_words over anchor_index for
+    #                      at least doc_ids, if already scored
+    #         positions: PositionalIndex for the proximity feature
+    #         groups: the variants of each query word for the proximity
+    #                 feature, each distinct query word if not given
+    # @return: float64 array of shape (len(doc_ids), FEATURE_COUNT)
+    # -----------------------------------------------------------------------------
+    def features(self, query_words, doc_ids, index, anchor_index, term_postings=None, anchor_bm25=None,
+                 positions=None, groups=None):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        features = np.zeros((len(doc_ids), FEATURE_COUNT))
+        if len(doc_ids) == 0 or not query_words:
+            return features
+        order = np.argsort(doc_ids, kind='stable')
+        sorted_ids = doc_ids[order]
+
+        if anchor_bm25 is None:
+            anchor_bm25 = self.bm25.score(query_words, anchor_index, sorted_ids)
+        anchor_docs, anchor_scores = anchor_bm25
+        slots, found = locate(anchor_docs, doc_ids)
+        features[found, 0] = anchor_scores[slots[found]]
+        matched = np.flatnonzero(found)
+        features[matched, 1] = [similarity(query_words, self.doc_index.title(doc))
+                                for doc in doc_ids[matched].tolist()]
+        features[:, 2] = self.page_rank[doc_ids]
+
+        # summed in sorted doc id order, then put back in doc_ids order
+        log_tf = np.zeros(len(doc_ids))
+        idf_total = 0.0
+        if term_postings is None:
+            term_postings = fetch_postings(query_words, index)
+        for postings in term_postings:
+            slots, found = locate(sorted_ids, postings.docs)
+            log_tf[slots[found]] += postings.count * np.log(postings.freqs[found] + 1)
+            idf_total += postings.count * postings.idf
+        features[order, 3] = log_tf / len(query_words)
+        features[:, 4] = idf_total / len(query_words)
+
+        if groups is None:
+            groups = [[word] for word in dict.fromkeys(query_words)]
+        if positions is not None and len(groups) > 1:
+            docs, spans = min_spans(positions, groups, sorted_ids)
+            slots, found = locate(docs, doc_ids)
+            features[found, 5] = len(groups) / spans[slots[found]]
+        return features
+
+    @staticmethod
+    def score(features, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        return features[:, :len(weights)] @ weights
+
+
+_engines = weakref.WeakKeyDictionary()
+
+
+# ---------------------------------------------------------------------------------
+# the feature engine of a doc table, built the first time it is asked for
+#
+# @input: doc_index: DocTable
+# @return: FeatureEngine
+# ---------------------------------------------------------------------------------
+def get_feature_engine(doc_index):
+    engine = _engines.get(doc_index)
+    if engine is None:
+        engine = FeatureEngine(doc_index)
+        _engines[doc_index] = engine
+    return engine
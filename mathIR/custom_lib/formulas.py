@@ -0,0 +1,183 @@
+"""
+Formula index and sub-expression search
+
+Formulas are kept out of the word index in an index of their own, a binary
+index file (see binary_index.py) whose terms are:
+    - n-grams of 1 to NGRAM canonical LaTeX tokens, from the annotation of
+      each <math> element: spacing and sizing commands and grouping braces
+      are dropped and synonyms like \\dfrac / \\frac or \\le / \\leq share one
+      token, so x^{2} and x^2 give the same n-grams
+    - SUBTREE_PREFIX + hash of every MathML element with children, written
+      as a canonical string of tag names and leaf text, so an expression
+      matches wherever it is a subtree of a formula
+with the count of each term in each doc as postings.
+
+A LaTeX query matches the docs holding every n-gram of its tokens, a MathML
+query the docs holding the subtree of its root, in both cases only the
+posting lists of the query terms are read.  In a search box a formula is put
+between dollar signs, fourier $\\hat{f}(\\xi)$.
+
+formulas.py
+"""
+import re
+import string
+import hashlib
+import numpy as np
+from bs4 import BeautifulSoup, Tag
+from .bm25 import get_postings
+from .intersect import intersect, locate, EMPTY
+
+NGRAM = 3
+SUBTREE_PREFIX = 'tree:'
+TOKEN = re.compile(r'\\[a-zA-Z]+|\\.|\d+(?:\.\d+)?|\S')
+FORMULA = re.compile(r'\$([^$]+)\$')
+IGNORED_TOKENS = {'{', '}', '\\left', '\\right', '\\bigl', '\\bigr', '\\Bigl', '\\Bigr', '\\big', '\\Big',
+                  '\\displaystyle', '\\textstyle', '\\scriptstyle', '\\limits', '\\nolimits',
+                  '\\,', '\\;', '\\:', '\\!', '\\ ', '\\quad', '\\qquad'}
+TOKEN_ALIASES = {'\\dfrac': '\\frac', '\\tfrac': '\\frac', '\\le': '\\leq', '\\ge': '\\geq', '\\ne': '\\neq',
+                 '\\to': '\\rightarrow', '\\gets': '\\leftarrow', '\\land': '\\wedge', '\\lor': '\\vee',
+                 '\\lbrace': '\\{', '\\rbrace': '\\}', '\\vert': '|', '\\lvert': '|', '\\rvert': '|'}
+# MathML elements around a whole formula and the source they carry
+WRAPPERS = {'math', 'semantics'}
+SKIPPED = {'annotation', 'annotation-xml'}
+
+
+# ---------------------------------------------------------------------------------
+# canonical tokens of a LaTeX formula
+#
+# @input: latex: formula string
+# @return: list of token strings
+# ---------------------------------------------------------------------------------
+def formula_tokens(latex):
+    latex = latex.replace('%\n', '')
+    tokens = []
+    for token in TOKEN.findall(latex):
+        if token in IGNORED_TOKENS:
+            continue
+        tokens.append(TOKEN_ALIASES.get(token, token))
+    return tokens
+
+
+# ---------------------------------------------------------------------------------
+# n-gram terms of a token list
+#
+# @input: tokens: from formula_tokens
+#         sizes: n-gram sizes to give
+# @return: list of terms, one per n-gram, repeats kept
+# ---------------------------------------------------------------------------------
+def formula_ngrams(tokens, sizes=range(1, NGRAM + 1)):
+    terms = []
+    for size in sizes:
+        for start in range(len(tokens) - size + 1):
+            terms.append(' '.join(tokens[start:start + size]))
+    return terms
+
+
+def _children(element):
+    return [child for child in element.children if isinstance(child, Tag) and child.name not in SKIPPED]
+
+
+# ---------------------------------------------------------------------------------
+# canonical string of a MathML element, the hash of every element with
+# children is added to hashes
+#
+# @input: element: bs4 Tag
+#         hashes: list the subtree terms are appended to, None to skip them
+# @return: canonical string
+# ---------------------------------------------------------------------------------
+def canonical_subtree(element, hashes=None):
+    children = _children(element)
+    # a wrapper or an mrow around one element is that element
+    while children and len(children) == 1 and (element.name in WRAPPERS or element.name == 'mrow'):
+        element = children[0]
+        children = _children(element)
+    # the elements around a whole formula hold a row of elements
+    name = 'mrow' if element.name in WRAPPERS else element.name
+    if not children:
+        text = element.get_text().translate({ord(c): None for c in string.whitespace})
+        return '(' + name + ' ' + text + ')'
+    canonical = '(' + name + ' ' + ' '.join(canonical_subtree(child, hashes) for child in children) + ')'
+    if hashes is not None:
+        hashes.append(subtree_term(canonical))
+    return canonical
+
+
+def subtree_term(canonical):
+    return SUBTREE_PREFIX + hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# ---------------------------------------------------------------------------------
+# index terms of one <math> element
+#
+# @input: formula: bs4 Tag of the <math> element
+#         latex: its LaTeX annotation, None if it has none
+# @return: list of terms, repeats kept
+# ---------------------------------------------------------------------------------
+def formula_terms(formula, latex=None):
+    terms = []
+    if latex:
+        terms += formula_ngrams(formula_tokens(latex))
+    canonical_subtree(formula, terms)
+    return terms
+
+
+# ---------------------------------------------------------------------------------
+# terms a query formula must match
+#
+# @input: query: LaTeX, or MathML starting with <
+# @return: list of distinct terms, empty if nothing can be matched
+# ---------------------------------------------------------------------------------
+def query_terms(query):
+    query = query.strip()
+    if query.startswith('<'):
+        root = BeautifulSoup(query, 'html.parser').find(True)
+        if root is None:
+            return []
+        hashes = []
+        canonical_subtree(root, hashes)
+        # the root is the last subtree hashed
+        return hashes[-1:]
+    tokens = formula_tokens(query)
+    return list(dict.fromkeys(formula_ngrams(tokens, [min(NGRAM, len(tokens))]))) if tokens else []
+
+
+# ---------------------------------------------------------------------------------
+# split the formulas out of a query
+#
+# @input: query: query string, formulas between dollar signs
+# @return: text: the query without its formulas
+#          formulas: list of formula strings
+# ---------------------------------------------------------------------------------
+def split_formulas(query):
+    formulas = [formula.strip() for formula in FORMULA.findall(query) if formula.strip()]
+    return FORMULA.sub(' ', query), formulas
+
+
+# ---------------------------------------------------------------------------------
+# docs holding a formula and how well they match
+#
+# @input: formula_index: formula index from get_formula_index
+#         formula: LaTeX or MathML query
+#         allowed: optional sorted int array of the docs to look at
+# @return: docs: sorted int64 array of the docs holding every query term
+#          scores: float64 array, the sum over the query terms of
+#                  idf * log(1 + count in the doc)
+# ---------------------------------------------------------------------------------
+def match_formula(formula_index, formula, allowed=None):
+    entries = []
+    for term in query_terms(formula):
+        entry = formula_index.get(term)
+        if entry is None:
+            return EMPTY, np.empty(0)
+        entries.append(entry)
+    if not entries:
+        return EMPTY, np.empty(0)
+    postings = [get_postings(entry) for entry in entries]
+    docs = intersect([np.sort(term_docs) for term_docs, _ in postings])
+    if allowed is not None:
+        docs = docs[locate(allowed, docs)[1]]
+    scores = np.zeros(len(docs))
+    for entry, (term_docs, freqs) in zip(entries, postings):
+        slots, found = locate(docs, term_docs)
+        scores[slots[found]] += entry['idf'] * np.log1p(freqs[found])
+    return docs, scores
@@ -1,26 +1,42 @@
 import os
-import string
 import time
 import csv
 import tarfile
 import math
+from collections import deque
+from multiprocessing import Pool
 
 from bs4 import BeautifulSoup
-from .utils import tokenize_doc, clean_text, format_text
+from .utils import tokenize_doc, clean_text, format_text, rank_pages
 from .porter import PorterStemmer
+from .binary_index import write_binary_index
+from .link_graph import LinkGraph, write_link_graph
+from .positions import write_positional_index
+from .formulas import formula_terms
+from .text_store import text_lines, write_text_store
+from .doc_store import DocStoreWriter
 
 COLLECTION_DIR = "mathIR\static\mathIR\MathTagArticles"
 INDEX_DIR = "mathIR\static\indexTSV"
 DOC_FILE_NAME = "doc_index.tsv"
 INDEX_FILE_NAME = "wiki_index.tsv"
+BINARY_INDEX_FILE_NAME = "wiki_index.bin"
 STEM_FILE_NAME = "wiki_stems.tsv"
-POSITIONAL_INDEX_FILE_NAME = "wiki_positions.tsv"
+POSITIONAL_INDEX_FILE_NAME = "wiki_positions.bin"
 BIGRAM_INDEX_FILE_NAME = "wiki_bigrams.tsv"
 WINDOW_INDEX_FILE_NAME = "wiki_window_index.tsv"
 ANCHOR_TEXT_INDEX_FILE_NAME = 'indices/anchor_text_index.tsv'
-LINKED_FROM_INDEX = 'indices/linked_from_index.tsv'
+ANCHOR_TEXT_BINARY_INDEX_FILE_NAME = 'indices/anchor_text_index.bin'
+LINK_GRAPH_FILE_NAME = 'link_graph.arrays'
+PAGE_RANK_FILE_NAME = 'page_rank_index.tsv'
+FORMULA_INDEX_FILE_NAME = 'formula_index.bin'
+TEXT_STORE_FILE_NAME = 'doc_text.arrays'
+DOC_STORE_FILE_NAME = 'doc_store.bin'
 
 WINDOW_SIZE = 25
+# pages a worker indexes at a time, and batches queued ahead per worker
+BATCH_SIZE = 64
+PENDING_BATCHES = 4
 
 
 # ---------------------------------------------------------------------------------
@@ -51,77 +67,216 @@ def create_stems(freq_index):
                 f.write(line)
 
 
-def index_collection():
+# ---------------------------------------------------------------------------------
+# order collection doc ids ("10-1234") by archive number then offset
+#
+# @input: doc_id: collection doc id
+# @return: tuple to sort on
+# ---------------------------------------------------------------------------------
+def doc_sort_key(doc_id):
+    doc_id = doc_id.split('-')
+    return int(doc_id[0]), int(doc_id[1])
+
+
+# ---------------------------------------------------------------------------------
+# swap the collection doc ids in an index for dense doc ids
+#
+# @input: index: dictionary of term -> list of (collection doc id, frequency
+#                or positions)
+#         doc_numbers: dictionary of collection doc id -> dense doc id
+# @return: dictionary of term -> list of (dense doc id, frequency or positions)
+#          sorted by id
+# ---------------------------------------------------------------------------------
+def renumber_postings(index, doc_numbers):
+    renumbered = {}
+    for key, docs in index.items():
+        renumbered[key] = sorted((doc_numbers[doc], freq) for doc, freq in docs)
+    return renumbered
+
+
+# ---------------------------------------------------------------------------------
+# html pages of the collection archives in batches, archives in name order and
+# pages in archive order so every run reads them in the same order
+#
+# @input: batch_size: pages per batch
+# @return: generator of (archive number, list of (member name, html bytes))
+# ---------------------------------------------------------------------------------
+def read_batches(batch_size=BATCH_SIZE):
+    for filename in sorted(os.listdir(COLLECTION_DIR)):
+        if not filename.endswith(".tar.bz2"):
+            continue
+        dir_name = str(int(filename[7:-8]))
+        with tarfile.open(os.path.join(COLLECTION_DIR, filename), 'r:bz2') as tar:
+            pages = []
+            for file in tar:
+                if not file.name.endswith('.html'):
+                    continue
+                pages.append((file.name, tar.extractfile(file).read()))
+                if len(pages) == batch_size:
+                    yield dir_name, pages
+                    pages = []
+            if pages:
+                yield dir_name, pages
+
+
+# ---------------------------------------------------------------------------------
+# add the terms of one doc to an index
+#
+# @input: index: dictionary of term -> list of (collection doc id, value)
+#         doc_id: collection doc id
+#         doc_terms: dictionary of term -> frequency or positions in the doc
+# @return: None
+# ---------------------------------------------------------------------------------
+def add_postings(index, doc_id, doc_terms):
+    for term in doc_terms:
+        if term not in index:
+            index[term] = []
+        index[term].append((doc_id, doc_terms[term]))
+
+
+# ---------------------------------------------------------------------------------
+# index a batch of pages, run in the worker processes
+#
+# @input: batch: (archive number, list of (member name, html bytes))
+# @return: partial index of the batch, dictionary of
+#              'index', 'positions', 'formulas', 'anchors': term -> list of
+#                  (collection doc id, frequency or positions) in page order
+#              'docs': (doc file line, lines, words on each line) of each page
+# ---------------------------------------------------------------------------------
+def index_batch(batch):
+    dir_name, pages = batch
+    partial = {'index': {}, 'positions': {}, 'formulas': {}, 'anchors': {}, 'docs': []}
+    for name, content in pages:
+        soup = BeautifulSoup(content, 'html.parser')
+
+        doc_id = dir_name + '-' + soup.title['offset']
+        doc_title = name[14:-5].lower()
+        doc_name = clean_text(soup.title.string)
+        doc_index = {}
+        doc_anchor_index = {}
+        doc_formula_index = {}
+        links_out = clean_soup(soup, doc_formula_index, doc_anchor_index)
+        # the words are read line by line so the text store, kept for
+        # the snippets, knows the position each line starts at
+        doc_lines = text_lines(soup.get_text())
+        line_words = [format_text(line) for line in doc_lines]
+        words = [word for line in line_words for word in line]
+
+        tokenize_doc(words, doc_index)
+        doc_positions = {}
+        for position in range(len(words)):
+            if words[position] not in doc_positions:
+                doc_positions[words[position]] = []
+            doc_positions[words[position]].append(position)
+
+        add_postings(partial['index'], doc_id, doc_index)
+        add_postings(partial['positions'], doc_id, doc_positions)
+        add_postings(partial['formulas'], doc_id, doc_formula_index)
+        add_postings(partial['anchors'], doc_id, doc_anchor_index)
+
+        doc_file_line = [doc_id, doc_title, doc_name, len(words)]
+        for link in links_out:
+            doc_file_line.append(link)
+        partial['docs'].append((doc_file_line, doc_lines, [len(line) for line in line_words]))
+    return partial
+
+
+# ---------------------------------------------------------------------------------
+# index the batches of read_batches, in a pool of worker processes if there is
+# more than one worker.  The archives are read and the pages added to the doc
+# store in this process, a few batches per worker are queued ahead and the
+# results come back in the order the batches were read.
+#
+# @input: documents: DocStoreWriter the pages are added to as they are read
+#         workers: number of worker processes
+# @return: generator of (partial index from index_batch, doc store slot of
+#          each page of the batch)
+# ---------------------------------------------------------------------------------
+def index_batches(documents, workers):
+    if workers <= 1:
+        for batch in read_batches():
+            slots = [documents.add(content) for _, content in batch[1]]
+            yield index_batch(batch), slots
+        return
+
+    pending = deque()
+    with Pool(workers) as pool:
+        for batch in read_batches():
+            slots = [documents.add(content) for _, content in batch[1]]
+            pending.append((pool.apply_async(index_batch, (batch,)), slots))
+            if len(pending) >= PENDING_BATCHES * workers:
+                result, slots = pending.popleft()
+                yield result.get(), slots
+        while pending:
+            result, slots = pending.popleft()
+            yield result.get(), slots
+
+
+# ---------------------------------------------------------------------------------
+# index the collection archives and write every index file
+#
+# The pages are indexed in batches by a pool of worker processes and the
+# partial indexes merged in the order the pages were read, the files written
+# are the same whatever the number of workers.  The pool starts processes, a
+# script calling this has to do it under if __name__ == '__main__'.
+#
+# @input: workers: number of worker processes, one per core if not given, 1
+#                  indexes in this process
+# @return: None
+# ---------------------------------------------------------------------------------
+def index_collection(workers=None):
     index = {}
     anchor_text_index = {}
+    positional_index = {}
+    formula_index = {}
+    doc_texts = {}
+    doc_slots = {}
     doc_ids = {}
-    link_index = {}
     doc_file_lines = []
+    # the pages are copied to a doc store as they are read, see doc_store.py
+    documents = DocStoreWriter(os.path.join(INDEX_DIR, DOC_STORE_FILE_NAME))
     t1 = time.perf_counter()
 
-    for filename in os.listdir(COLLECTION_DIR):
-        if filename.endswith(".tar.bz2"):
-            dir_name = str(int(filename[7:-8]))
-            formatted_filename = os.path.join(COLLECTION_DIR, filename)
-            tar = tarfile.open(formatted_filename, 'r:bz2')
+    for partial, slots in index_batches(documents, workers or os.cpu_count() or 1):
+        # merge the partial index of the batch with the corpus index
+        for target, key in ((index, 'index'), (positional_index, 'positions'), (formula_index, 'formulas'),
+                            (anchor_text_index, 'anchors')):
+            for term, postings in partial[key].items():
+                if term not in target:
+                    target[term] = []
+                target[term].extend(postings)
+        for (doc_file_line, doc_lines, line_counts), slot in zip(partial['docs'], slots):
+            doc_id = doc_file_line[0]
+            doc_ids[doc_file_line[1]] = doc_id
+            doc_slots[doc_id] = slot
+            doc_texts[doc_id] = (doc_lines, line_counts)
+            doc_file_lines.append(doc_file_line)
 
-            for file in tar:
-                if not file.name.endswith('.html'):
-                    continue
-
-                html_file = tar.extractfile(file)
-                content = html_file.read()
-                soup = BeautifulSoup(content, 'html.parser')
-
-                doc_id = dir_name + '-' + soup.title['offset']
-                doc_title = file.name[14:-5].lower()
-                doc_name = clean_text(soup.title.string)
-                doc_ids[doc_title] = doc_id
-                doc_index = {}
-                doc_anchor_index = {}
-                links_out = clean_soup(soup, doc_index, doc_anchor_index)
-                for link in links_out:
-                    if link not in link_index:
-                        link_index[link] = []
-                    link_index[link].append(doc_id)
-                doc_text = soup.get_text()
-                words = format_text(doc_text)
-
-                tokenize_doc(words, doc_index)
-
-                # merge document index with the corpus index
-                for token in doc_index:
-                    index_str = doc_id + ':' + str(doc_index[token])
-                    if token not in index:
-                        index[token] = []
-                    index[token].append(index_str)
-
-                for token in doc_anchor_index:
-                    index_str = doc_id + ':' + str(doc_anchor_index[token])
-                    if token not in anchor_text_index:
-                        anchor_text_index[token] = []
-                    anchor_text_index[token].append(index_str)
-
-                doc_file_line = [doc_id, doc_title, doc_name, len(words)]
-                for link in links_out:
-                    doc_file_line.append(link)
-                doc_file_lines.append(doc_file_line)
-        else:
-            continue
+    # dense doc ids are the position of each doc in collection order
+    doc_file_lines = sorted(doc_file_lines, key=lambda doc_line: doc_sort_key(doc_line[0]))
+    doc_numbers = {}
+    for num in range(len(doc_file_lines)):
+        doc_numbers[doc_file_lines[num][0]] = num
+    index = renumber_postings(index, doc_numbers)
+    anchor_text_index = renumber_postings(anchor_text_index, doc_numbers)
+    positional_index = renumber_postings(positional_index, doc_numbers)
+    formula_index = renumber_postings(formula_index, doc_numbers)
 
+    links_to = []
     fn = os.path.join(INDEX_DIR, DOC_FILE_NAME)
     with open(fn, 'w', newline='', encoding='utf-8') as doc_file:
         writer = csv.writer(doc_file, delimiter="\t")
         for file in doc_file_lines:
-            new_line = file[:4]
+            new_line = [doc_numbers[file[0]]] + file[:4]
             linked_docs = []
             for link in file[4:]:
                 if link in doc_ids:
-                    linked_docs.append(doc_ids[link])
+                    linked_docs.append(doc_numbers[doc_ids[link]])
             new_line.append(len(linked_docs))
             for link in linked_docs:
                 new_line.append(link)
             writer.writerow(new_line)
+            links_to.append(linked_docs)
 
     doc_count = len(doc_file_lines)
     fn = os.path.join(INDEX_DIR, INDEX_FILE_NAME)
@@ -133,7 +288,7 @@ def index_collection():
             idf = math.log(doc_count/num_docs)
             line = [key, idf, num_docs]
             for doc in docs:
-                line.append(doc)
+                line.append('%d:%d' % doc)
             writer.writerow(line)
 
     fn = os.path.join(INDEX_DIR, ANCHOR_TEXT_INDEX_FILE_NAME)
@@ -145,42 +300,56 @@ def index_collection():
             idf = math.log(doc_count/num_docs)
             line = [key, idf, num_docs]
             for doc in docs:
-                line.append(doc)
+                line.append('%d:%d' % doc)
             writer.writerow(line)
 
-    fn = os.path.join(INDEX_DIR, LINKED_FROM_INDEX)
-    with open(fn, 'w', newline='', encoding='utf-8') as output_file:
-        writer = csv.writer(output_file, delimiter='\t')
-        for key in sorted(link_index.keys()):
-            if key in doc_ids:
-                docs = link_index[key]
-                line = [doc_ids[key], len(docs)]
-                for doc in docs:
-                    line.append(doc)
-                writer.writerow(line)
+    write_binary_index(os.path.join(INDEX_DIR, BINARY_INDEX_FILE_NAME), index, doc_count)
+    write_binary_index(os.path.join(INDEX_DIR, ANCHOR_TEXT_BINARY_INDEX_FILE_NAME), anchor_text_index, doc_count)
+    write_positional_index(os.path.join(INDEX_DIR, POSITIONAL_INDEX_FILE_NAME), positional_index, doc_count)
+    write_binary_index(os.path.join(INDEX_DIR, FORMULA_INDEX_FILE_NAME), formula_index, doc_count)
+
+    write_link_graph(os.path.join(INDEX_DIR, LINK_GRAPH_FILE_NAME), links_to)
+    rank_pages(LinkGraph(os.path.join(INDEX_DIR, LINK_GRAPH_FILE_NAME)), os.path.join(INDEX_DIR, PAGE_RANK_FILE_NAME))
+    documents.close([doc_slots[doc_line[0]] for doc_line in doc_file_lines])
+    doc_texts = [doc_texts[doc_line[0]] for doc_line in doc_file_lines]
+    write_text_store(os.path.join(INDEX_DIR, TEXT_STORE_FILE_NAME), [lines for lines, _ in doc_texts],
+                     [counts for _, counts in doc_texts])
     print(time.perf_counter() - t1)
 
 
+# ---------------------------------------------------------------------------------
+# write the doc store of the collection without indexing it again, for indexes
+# built before index_collection wrote one.  The pages are stored in collection
+# order, the order of the dense doc ids.
+#
+# @input: None
+# @return: None
+# ---------------------------------------------------------------------------------
+def build_doc_store():
+    documents = DocStoreWriter(os.path.join(INDEX_DIR, DOC_STORE_FILE_NAME))
+    doc_slots = {}
+    for dir_name, pages in read_batches():
+        for _, content in pages:
+            soup = BeautifulSoup(content, 'html.parser')
+            doc_slots[dir_name + '-' + soup.title['offset']] = documents.add(content)
+    documents.close([doc_slots[doc_id] for doc_id in sorted(doc_slots, key=doc_sort_key)])
+
+
 def clean_soup(soup, formula_index, anchor_text_index):
     links_out = []
     for formula in soup.find_all('math'):
         if formula.a:
             continue
 
-        try:
-            if formula and formula.semantics and formula.semantics.annotation and formula.semantics.annotation.string:
-                formula_string = formula.semantics.annotation.string
+        latex = None
+        if formula.semantics and formula.semantics.annotation and formula.semantics.annotation.string:
+            latex = formula.semantics.annotation.string
+        # formulas go to their own index, see formulas.py
+        for term in formula_terms(formula, latex):
+            if term not in formula_index:
+                formula_index[term] = 1
             else:
-                formula_string = formula.semantics.mn.string
-            formula_string = formula_string.replace('%\n', '')
-            formula_string = formula_string.translate({ord(c): None for c in string.whitespace})
-            if formula_string not in formula_index:
-                formula_index[formula_string] = 1
-            else:
-                formula_index[formula_string] += 1
-        except AttributeError:
-            continue
-
+                formula_index[term] += 1
 
         formula.decompose()
 
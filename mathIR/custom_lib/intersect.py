@@ -0,0 +1,116 @@
+"""
+Intersection and union of sorted doc id lists
+
+Posting lists are sorted NumPy int arrays.  The variants of one query word are
+merged into one sorted list without repeats: the lists are concatenated and
+stable sorted, which merges the already sorted runs, then repeats are dropped.
+The lists of the words are intersected smallest first, the running result
+only ever shrinks, and each step looks the docs of the running result up in
+the next list with one searchsorted call over the part of the list between
+the first and last doc.  searchsorted runs an independent binary search for
+each doc, batched in C, it does not gallop from where the last search ended:
+a short list against a long one costs about log(length of the long list) per
+doc instead of a walk over the long list.
+
+intersect.py
+"""
+import numpy as np
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+# ---------------------------------------------------------------------------------
+# find docs in a sorted doc id array
+#
+# @input: sorted_docs: sorted int array without repeats
+#         docs: int array of the docs to look up
+# @return: positions: int array, the position of each doc in sorted_docs
+#                     where found is True
+#          found: boolean array
+# ---------------------------------------------------------------------------------
+def locate(sorted_docs, docs):
+    positions = np.searchsorted(sorted_docs, docs)
+    if not len(sorted_docs):
+        return positions, np.zeros(len(positions), dtype=bool)
+    np.minimum(positions, len(sorted_docs) - 1, out=positions)
+    return positions, sorted_docs[positions] == docs
+
+
+# ---------------------------------------------------------------------------------
+# docs of small that are also in large
+#
+# @input: small, large: sorted int arrays
+# @return: sorted int array
+# ---------------------------------------------------------------------------------
+def intersect_two(small, large):
+    if not len(small) or not len(large):
+        return EMPTY
+    # only the part of large between the first and last doc of small can match
+    start, stop = np.searchsorted(large, (small[0], small[-1] + 1))
+    return small[locate(large[start:stop], small)[1]]
+
+
+# ---------------------------------------------------------------------------------
+# docs in every list
+#
+# @input: lists: sorted int arrays
+# @return: int array of the common docs in increasing order
+# ---------------------------------------------------------------------------------
+def intersect(lists):
+    if not lists:
+        return EMPTY
+    lists = sorted(lists, key=len)
+    matches = lists[0]
+    for postings in lists[1:]:
+        if not len(matches):
+            break
+        matches = intersect_two(matches, postings)
+    return matches
+
+
+# ---------------------------------------------------------------------------------
+# docs in any list
+#
+# @input: lists: sorted int arrays
+# @return: int array of the docs in increasing order without repeats
+# ---------------------------------------------------------------------------------
+def union(lists):
+    lists = [postings for postings in lists if len(postings)]
+    if not lists:
+        return EMPTY
+    if len(lists) == 1:
+        return lists[0]
+    merged = np.sort(np.concatenate(lists), kind='stable')
+    keep = np.empty(len(merged), dtype=bool)
+    keep[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+    return merged[keep]
+
+
+# ---------------------------------------------------------------------------------
+# doc ids as a sorted array without repeats
+#
+# @input: docs: iterable of doc ids
+# @return: int64 array
+# ---------------------------------------------------------------------------------
+def doc_set(docs):
+    if isinstance(docs, np.ndarray):
+        return np.unique(docs.astype(np.int64, copy=False))
+    return np.unique(np.fromiter(docs, dtype=np.int64))
+
+
+# ---------------------------------------------------------------------------------
+# sorted doc ids of a term from any loaded index
+#
+# @input: index: frequency index
+#         term: string
+# @return: sorted int array, empty if the term is not in the index
+# ---------------------------------------------------------------------------------
+def get_doc_ids(index, term):
+    entry = index.get(term)
+    if entry is None:
+        return EMPTY
+    if hasattr(entry, 'postings'):
+        return np.asarray(entry.postings()[0], dtype=np.int64)
+    docs = entry['docs']
+    return np.sort(np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)))
@@ -0,0 +1,135 @@
+"""
+Benchmark conjuctive_query against the skip pointer merge it replaced
+
+The old merge concatenated the posting lists of a word's variants, sorted
+them through a set and walked the lists pairwise with sqrt(n) skips.  The new
+one merges the sorted variants and intersects smallest first, looking the
+running result up in each next list with one batched binary search (see
+intersect.py).  Both run over the
+expanded sample queries, the report gives the time of each and checks they
+agree wherever the old merge is defined (two or more query words).
+
+usage:
+    python -m mathIR.custom_lib.intersect_report [<repeats>] [<mode>]
+
+intersect_report.py
+"""
+import sys
+import time
+from math import sqrt
+from .utils import load_index, get_stems, conjuctive_query, STEM_FILE_NAME
+from .query_expansion import expand_term
+
+SAMPLE_QUERIES = [['fourier', 'transform'], ['prime', 'number'], ['probability', 'distribution'],
+                  ['group', 'theory'], ['riemann', 'zeta', 'function'], ['linear', 'algebra', 'matrix'],
+                  ['differential', 'equation'], ['the', 'theorem'], ['set', 'of', 'numbers']]
+
+
+# ---------------------------------------------------------------------------------
+# the conjuctive_query this benchmark compares against, kept as it was
+# ---------------------------------------------------------------------------------
+def skip_pointer_query(queries, index):
+    lists = []
+    for terms_list in queries:
+        temp_list = []
+        for term in terms_list:
+            temp_list += index[term]['docs']
+        lists.append(sorted(set(temp_list)))
+    lists = sorted([x for x in lists], key=lambda x: len(x), reverse=True)
+    list1 = lists.pop()
+    good_skips = 0
+    bad_skips = 0
+    matches = []
+    while lists:
+        ptr1 = 0
+        ptr2 = 0
+        matches = []
+        list2 = lists.pop()
+        skip1 = int(sqrt(len(list1))) // 2
+        skip2 = int(sqrt(len(list2))) // 2
+        while True:
+            try:
+                doc1 = list1[ptr1]
+                doc2 = list2[ptr2]
+                if doc1 == doc2:
+                    matches.append(doc1)
+                    ptr1 += 1
+                    ptr2 += 1
+                else:
+                    if doc1 < doc2:
+                        if skip1 > 2 and ptr1 % skip1 == 0 and ptr1 + skip1 < len(list1):
+                            good_skips += 1
+                            ptr1 += skip1
+                            doc1 = list1[ptr1]
+
+                            if doc1 > doc2:
+                                good_skips -= 1
+                                bad_skips += 1
+                                ptr1 -= (skip1 - 1) if (doc1 - doc2) > (skip1 - 1) else (doc1 - doc2)
+                        else:
+                            ptr1 += 1
+
+                    else:
+                        if skip2 > 2 and ptr2 % skip2 == 0 and ptr2 + skip2 < len(list2):
+                            good_skips += 1
+                            ptr2 += skip2
+                            doc2 = list2[ptr2]
+                            if doc2 > doc1:
+                                good_skips -= 1
+                                bad_skips += 1
+                                ptr2 -= (skip2 - 1) if (doc2 - doc1) > (skip2 - 1) else (doc2 - doc1)
+                        else:
+                            ptr2 += 1
+            except IndexError as e:
+                break
+        list1 = matches
+    return matches
+
+
+def time_query(query, queries, index, repeats):
+    t1 = time.perf_counter()
+    for _ in range(repeats):
+        docs = query(queries, index)
+    return docs, (time.perf_counter() - t1) * 1000 / repeats
+
+
+# ---------------------------------------------------------------------------------
+# print the time of both merges on each sample query
+#
+# @input: repeats: runs of each query
+#         mode: index mode given to load_index
+# @return: list of (query, old ms, new ms, matches)
+# ---------------------------------------------------------------------------------
+def report(repeats=20, mode='binary'):
+    index = load_index(mode)
+    stem_dict = get_stems(STEM_FILE_NAME)
+    print('{:32} {:>10} {:>10} {:>10} {:>8}'.format('query', 'postings', 'old ms', 'new ms', 'matches'))
+    results = []
+    for words in SAMPLE_QUERIES:
+        queries = [expand_term([word], stem_dict) for word in words]
+        # the old merge needs every term to be in the index, views.results
+        # gave it the index filtered to the query terms
+        query_index = {term: index[term] for terms_list in queries for term in terms_list if term in index}
+        queries = [[term for term in terms_list if term in query_index] for terms_list in queries]
+        if not all(queries):
+            print('{:32} not in the index'.format(' '.join(words)))
+            continue
+        postings = sum(query_index[term]['count'] for term in query_index)
+        old_docs, old_ms = time_query(skip_pointer_query, queries, query_index, repeats)
+        new_docs, new_ms = time_query(conjuctive_query, queries, query_index, repeats)
+        if sorted(old_docs) != new_docs:
+            print('{:32} results differ: {} old, {} new'.format(' '.join(words), len(old_docs), len(new_docs)))
+        print('{:32} {:>10} {:>10.2f} {:>10.2f} {:>8}'.format(' '.join(words)[:32], postings, old_ms, new_ms,
+                                                            len(new_docs)))
+        results.append((words, old_ms, new_ms, len(new_docs)))
+    return results
+
+
+def main(args):
+    repeats = int(args[0]) if args else 20
+    mode = args[1] if len(args) > 1 else 'binary'
+    report(repeats, mode)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+"""
+Lexicon only view of a tsv frequency index
+
+Opening the index reads the term, idf and doc count at the start of each line
+and remembers where the line is in the file.  The postings on the rest of the
+line are only split when a query first touches the term, and are then kept in
+a bounded cache.
+
+lazy_index.py
+"""
+import mmap
+from array import array
+from .binary_index import LexiconIndex, TermEntry, POSTINGS_CACHE_SIZE
+
+
+# ---------------------------------------------------------------------------------
+# split the postings of one tsv line
+#
+# @input: buf: bytes of the line after the doc count
+# @return: docs: int array of doc ids
+#          freqs: int array of the term frequency in each doc
+# ---------------------------------------------------------------------------------
+def parse_postings(buf):
+    docs = array('i')
+    freqs = array('i')
+    for posting in buf.split(b'\t'):
+        posting = posting.split(b':')
+        if len(posting) == 2:
+            docs.append(int(posting[0]))
+            freqs.append(int(posting[1]))
+    return docs, freqs
+
+
+class TsvIndex(LexiconIndex):
+    """
+    Read only view of a tsv index written by index_collection, looked up the
+    same way as a BinaryIndex.
+    """
+
+    def __init__(self, filename, cache_size=POSTINGS_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._terms = {}
+        self._term_list = []
+        self._idfs = array('d')
+        self._counts = array('i')
+        self._starts = array('q')
+        self._ends = array('q')
+
+        offset = 0
+        for line in iter(self._map.readline, b''):
+            tab1 = line.find(b'\t')
+            tab2 = line.find(b'\t', tab1 + 1)
+            tab3 = line.find(b'\t', tab2 + 1)
+            end = len(line.rstrip(b'\r\n'))
+            if tab3 < 0:
+                tab3 = end
+            term = line[:tab1].decode('utf-8')
+            self._terms[term] = len(self._term_list)
+            self._term_list.append(term)
+            self._idfs.append(float(line[tab1 + 1:tab2]))
+            self._counts.append(int(line[tab2 + 1:tab3]))
+            self._starts.append(offset + min(tab3 + 1, end))
+            self._ends.append(offset + end)
+            offset += len(line)
+        self._map.seek(0)
+        self.term_count = len(self._term_list)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    # the lexicon is pickled, the file is mapped again when unpickled
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_file']
+        del state['_map']
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._file = open(self.filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def term(self, num):
+        return self._term_list[num]
+
+    def find(self, term):
+        return self._terms.get(term, -1)
+
+    def make_entry(self, num):
+        start = self._starts[num]
+        return TermEntry(self, self._idfs[num], self._counts[num], self._ends[num] - start, start)
+
+    def read_postings(self, offset, length):
+        return parse_postings(self._map[offset:offset + length])
+
+    def __contains__(self, term):
+        return term in self._terms
+
+    def __iter__(self):
+        return iter(self._term_list)
@@ -0,0 +1,77 @@
+"""
+Link graph stored as compressed sparse rows
+
+links_to(doc) and linked_from(doc) are slices of two int arrays, the forward
+and the reverse adjacency, each with a starts array one longer than the
+number of documents.  Both are written once by index_collection to an array
+store file and mapped read only, so loading the graph is only reading the
+array directory.
+
+link_graph.py
+"""
+from array import array
+import numpy as np
+from .array_store import MappedFile, ArrayStore, write_array_store
+
+
+# ---------------------------------------------------------------------------------
+# write a link graph file from the links out of each document, the reverse
+# adjacency is built here so linked_from lists are in doc id order
+#
+# @input: filename: path of the file to write
+#         links_to: list indexed by doc id of lists of the doc ids it links to
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_link_graph(filename, links_to):
+    doc_count = len(links_to)
+    forward_starts = array('q', [0])
+    forward = array('i')
+    in_degree = [0] * doc_count
+    for links in links_to:
+        forward.extend(links)
+        forward_starts.append(len(forward))
+        for link in links:
+            in_degree[link] += 1
+
+    reverse_starts = array('q', [0])
+    for degree in in_degree:
+        reverse_starts.append(reverse_starts[-1] + degree)
+    reverse = array('i', bytes(4 * len(forward)))
+    next_slot = list(reverse_starts[:-1])
+    for doc in range(doc_count):
+        for link in links_to[doc]:
+            reverse[next_slot[link]] = doc
+            next_slot[link] += 1
+
+    write_array_store(filename, {'forward_starts': forward_starts, 'forward': forward,
+                                 'reverse_starts': reverse_starts, 'reverse': reverse})
+
+
+class LinkGraph(MappedFile):
+    """
+    Read only link graph mapped from a file written by write_link_graph.
+        forward_starts, forward, reverse_starts, reverse: NumPy views of the rows
+        out_degree, in_degree: NumPy arrays indexed by doc id
+        edge_count: number of links
+        links_to(doc), linked_from(doc): NumPy slices of doc ids
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._store = ArrayStore(filename)
+        self.forward_starts = np.frombuffer(self._store['forward_starts'], dtype=np.int64)
+        self.forward = np.frombuffer(self._store['forward'], dtype=np.int32)
+        self.reverse_starts = np.frombuffer(self._store['reverse_starts'], dtype=np.int64)
+        self.reverse = np.frombuffer(self._store['reverse'], dtype=np.int32)
+        self.out_degree = np.diff(self.forward_starts)
+        self.in_degree = np.diff(self.reverse_starts)
+        self.edge_count = len(self.forward)
+
+    def __len__(self):
+        return len(self.forward_starts) - 1
+
+    def links_to(self, doc):
+        return self.forward[self.forward_starts[doc]:self.forward_starts[doc + 1]]
+
+    def linked_from(self, doc):
+        return self.reverse[self.reverse_starts[doc]:self.reverse_starts[doc + 1]]
@@ -0,0 +1,108 @@
+"""
+Background loading of the serving indexes
+
+The indexes views.py needs are loaded in a daemon thread so Django can start
+answering requests right away.  The loader keeps the state of the load
+('loading', 'ready' or 'failed'), the step it is on and how long it has taken,
+which the health and readiness views report while the indexes warm up.
+
+loader.py
+"""
+import time
+import traceback
+from threading import Thread, Event, Lock
+
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class IndexLoader:
+    """
+    Runs load(progress) in a background thread, load is given a progress
+    function to call with the name of each step it starts and returns the
+    loaded state.
+        state: LOADING, READY or FAILED
+        step: name of the current step
+        indexes: what load returned, None until READY
+        error: traceback of the failure, None unless FAILED
+        on_ready: function called with the indexes once they are loaded
+    """
+
+    def __init__(self, load, on_ready=None):
+        self._load = load
+        self._on_ready = on_ready
+        self._lock = Lock()
+        self._done = Event()
+        self._thread = None
+        self.state = LOADING
+        self.step = 'starting'
+        self.steps = []
+        self.indexes = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self.started = time.time()
+            self._thread = Thread(target=self._run, name='index-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def progress(self, step):
+        with self._lock:
+            self.step = step
+            self.steps.append((step, time.time() - self.started))
+        print('loading:', step)
+
+    def _run(self):
+        try:
+            indexes = self._load(self.progress)
+            if self._on_ready is not None:
+                self._on_ready(indexes)
+            with self._lock:
+                self.indexes = indexes
+                self.step = 'done'
+                self.state = READY
+        except Exception:
+            with self._lock:
+                self.error = traceback.format_exc()
+                self.state = FAILED
+            print(self.error)
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    def is_ready(self):
+        return self.state == READY
+
+    # -----------------------------------------------------------------------------
+    # block until the load is done
+    #
+    # @input: timeout: seconds to wait, None waits forever
+    # @return: True if the indexes are ready
+    # -----------------------------------------------------------------------------
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.is_ready()
+
+    # -----------------------------------------------------------------------------
+    # describe the load for the health and readiness views
+    #
+    # @input: None
+    # @return: dictionary of the state, current step, steps so far with the
+    #          seconds since the start they began at, and elapsed seconds
+    # -----------------------------------------------------------------------------
+    def status(self):
+        with self._lock:
+            end = self.finished if self.finished is not None else time.time()
+            status = {'state': self.state,
+                      'step': self.step,
+                      'steps': [{'step': step, 'at': round(at, 3)} for step, at in self.steps],
+                      'elapsed': round(end - self.started, 3) if self.started is not None else 0.0}
+            if self.error is not None:
+                status['error'] = self.error.strip().splitlines()[-1]
+        return status
@@ -0,0 +1,89 @@
+"""
+Frequency index held in memory
+
+The tsv is read in one pass into one flat layout: a doc id array and a term
+frequency array holding every posting list end to end, plus the idf, doc count
+and start of each term.  Lookups by doc ('docs') and doc ordered iteration
+(postings()) are both views of those two arrays, one copy of the data.
+
+memory_index.py
+"""
+from array import array
+from .binary_index import LexiconIndex, TermEntry, POSTINGS_CACHE_SIZE
+
+
+class MemoryIndex(LexiconIndex):
+    """
+    Frequency index parsed from a tsv into flat arrays, looked up the same way
+    as a BinaryIndex.
+    """
+
+    def __init__(self, filename, cache_size=POSTINGS_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.filename = filename
+        self._terms = {}
+        self._term_list = []
+        self._idfs = array('d')
+        self._counts = array('i')
+        self._starts = array('q')
+        self._docs = array('i')
+        self._freqs = array('i')
+
+        with open(filename, 'r', encoding='utf-8') as index_file:
+            for line in index_file:
+                line = line.rstrip('\r\n').split('\t')
+                start = len(self._docs)
+                prev = -1
+                ordered = True
+                for posting in line[3:]:
+                    posting = posting.split(':')
+                    doc = int(posting[0])
+                    if doc < prev:
+                        ordered = False
+                    prev = doc
+                    self._docs.append(doc)
+                    self._freqs.append(int(posting[1]))
+                if not ordered:
+                    postings = sorted(zip(self._docs[start:], self._freqs[start:]))
+                    self._docs[start:] = array('i', [doc for doc, _ in postings])
+                    self._freqs[start:] = array('i', [freq for _, freq in postings])
+
+                self._terms[line[0]] = len(self._term_list)
+                self._term_list.append(line[0])
+                self._idfs.append(float(line[1]))
+                self._counts.append(int(line[2]))
+                self._starts.append(start)
+        self._starts.append(len(self._docs))
+        self.term_count = len(self._term_list)
+        self._doc_view = memoryview(self._docs)
+        self._freq_view = memoryview(self._freqs)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_doc_view']
+        del state['_freq_view']
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._doc_view = memoryview(self._docs)
+        self._freq_view = memoryview(self._freqs)
+
+    def term(self, num):
+        return self._term_list[num]
+
+    def find(self, term):
+        return self._terms.get(term, -1)
+
+    def make_entry(self, num):
+        start = self._starts[num]
+        return TermEntry(self, self._idfs[num], self._counts[num], self._starts[num + 1] - start, start)
+
+    def read_postings(self, offset, length):
+        return self._doc_view[offset:offset + length], self._freq_view[offset:offset + length]
+
+    def __contains__(self, term):
+        return term in self._terms
+
+    def __iter__(self):
+        return iter(self._term_list)
@@ -0,0 +1,151 @@
+"""
+Report how much memory each server worker process holds on its own
+
+Unique set size (uss) is the memory only that process maps, proportional set
+size (pss) splits shared pages between the processes mapping them.  With the
+dictionaries from get_index (mode 'dict') every worker ends up with a private
+copy of the index, with 'shared' the index pages are shared and uss stays small.
+
+usage:
+    python -m mathIR.custom_lib.memory_report <pid> [<pid> ...]
+        report running processes, a server master pid reports its workers
+    python -m mathIR.custom_lib.memory_report --simulate <workers> <mode> [<mode> ...]
+        for each index mode load the indexes, fork the workers, run sample
+        queries in each and report them
+
+Reads /proc/<pid>/smaps_rollup, so it only runs on linux.
+
+memory_report.py
+"""
+import os
+import sys
+import gc
+import signal
+from .utils import get_doc_table, get_index, load_index
+from .retrieval_algorithms import query_bm25
+
+SAMPLE_QUERIES = [['fourier', 'transform'], ['prime', 'number'], ['matrix'], ['probability', 'distribution'],
+                  ['group', 'theory'], ['eigenvalue'], ['riemann', 'zeta', 'function']]
+
+
+# ---------------------------------------------------------------------------------
+# read the memory totals of a process
+#
+# @input: pid: process id
+# @return: dictionary of rss, pss and uss in kB
+# ---------------------------------------------------------------------------------
+def get_memory(pid):
+    totals = {'rss': 0, 'pss': 0, 'uss': 0}
+    try:
+        smaps = open('/proc/%d/smaps_rollup' % pid, 'r')
+    except FileNotFoundError:
+        smaps = open('/proc/%d/smaps' % pid, 'r')
+    with smaps:
+        for line in smaps:
+            line = line.split()
+            if line[0] == 'Rss:':
+                totals['rss'] += int(line[1])
+            elif line[0] == 'Pss:':
+                totals['pss'] += int(line[1])
+            elif line[0] in ('Private_Clean:', 'Private_Dirty:'):
+                totals['uss'] += int(line[1])
+    return totals
+
+
+def get_children(pid):
+    children = []
+    try:
+        for task in os.listdir('/proc/%d/task' % pid):
+            with open('/proc/%d/task/%s/children' % (pid, task), 'r') as children_file:
+                children += [int(child) for child in children_file.read().split()]
+    except FileNotFoundError:
+        pass
+    return children
+
+
+# ---------------------------------------------------------------------------------
+# print the memory of each process and the total
+#
+# @input: pids: list of process ids
+#         label: printed above the table
+# @return: dictionary of summed rss, pss and uss in kB
+# ---------------------------------------------------------------------------------
+def report(pids, label=''):
+    if label:
+        print(label)
+    print('{:>8} {:>10} {:>10} {:>10}'.format('pid', 'rss MB', 'pss MB', 'uss MB'))
+    sums = {'rss': 0, 'pss': 0, 'uss': 0}
+    for pid in pids:
+        memory = get_memory(pid)
+        for key in sums:
+            sums[key] += memory[key]
+        print('{:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(pid, memory['rss'] / 1024, memory['pss'] / 1024,
+                                                         memory['uss'] / 1024))
+    print('{:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format('total', sums['rss'] / 1024, sums['pss'] / 1024,
+                                                     sums['uss'] / 1024))
+    return sums
+
+
+def run_worker(doc_index, index, ready):
+    for terms in SAMPLE_QUERIES:
+        query_bm25(terms, index, doc_index)
+    # a full collection touches every tracked object, as a long running
+    # worker eventually does, which copies the pages those objects are on
+    gc.collect()
+    os.write(ready, b'.')
+    signal.pause()
+
+
+# ---------------------------------------------------------------------------------
+# load the indexes in one mode, fork workers that query them, and report the
+# workers.  Runs in its own process so each mode starts from a clean heap.
+#
+# @input: workers: number of worker processes
+#         mode: index mode given to load_index, or 'dict' for get_index
+# @return: None
+# ---------------------------------------------------------------------------------
+def simulate(workers, mode):
+    master = os.fork()
+    if master:
+        os.waitpid(master, 0)
+        return
+
+    doc_index = get_doc_table()
+    if mode == 'dict':
+        index = get_index()
+    else:
+        index = load_index(mode)
+    ready_read, ready_write = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            run_worker(doc_index, index, ready_write)
+            os._exit(0)
+        pids.append(pid)
+    for _ in range(workers):
+        os.read(ready_read, 1)
+    report(pids, 'index mode: %s' % mode)
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    os._exit(0)
+
+
+def main(args):
+    if args and args[0] == '--simulate':
+        workers = int(args[1])
+        for mode in args[2:]:
+            simulate(workers, mode)
+        return
+
+    pids = []
+    for pid in args:
+        children = get_children(int(pid))
+        pids += children if children else [int(pid)]
+    report(pids)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,344 @@
+"""
+Positional index and phrase / proximity matching
+
+index_collection writes the word position of every occurrence of every term
+in a binary index file (see binary_index.py) with its own posting format: for
+each doc the doc id gap, the number of positions and the gap between
+consecutive positions, all varint encoded, with a skip table over blocks of
+SKIP_DOCS docs (see encode_positions).  Posting lists are decoded with array
+operations, and when a query is limited to some docs only the blocks holding
+them are decoded, so a common word costs about its positions in those docs.
+
+Queries never read the documents.  The positions of a term are turned into
+sorted int64 keys doc << 32 | position, the variants of one query word are
+merged into one key list, and:
+    - a phrase matches where word i is at the phrase start + i: the key lists
+      shifted back by i are intersected
+    - a window matches where one occurrence of every word fits in a window
+      of that many words, the smallest such window of a doc is its span
+Both only look at docs that have every word, found by intersecting doc ids
+first.
+
+In a query "fourier transform" is a phrase and "fourier transform"~5 asks
+for both words within 5 words of each other.
+
+positions.py
+"""
+import re
+import struct
+from array import array
+from collections import namedtuple
+import numpy as np
+from .binary_index import BinaryIndex, TermEntry, TERM_INFO, write_binary_index, encode_varint
+from .intersect import intersect, intersect_two, union, locate, EMPTY
+
+MAGIC = b'MIRP'
+# version 3 added the skip table of each term
+VERSION = 3
+TERM_HEADER = struct.Struct('<III')
+SKIP_DOCS = 64
+POSITION_BITS = 32
+POSITION_MASK = (1 << POSITION_BITS) - 1
+QUOTED = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+# words: query words of the operator
+# window: None for a phrase, else the most words one occurrence of every word
+#         may span
+Operator = namedtuple('Operator', 'words window')
+# window of an operator that only asks for every word to be in the doc
+ANY_SPAN = 1 << POSITION_BITS
+
+
+# ---------------------------------------------------------------------------------
+# encode the positions of a term
+#
+# The docs are cut into blocks of SKIP_DOCS, the skip table gives the first
+# doc of each block and where its bytes start, so the positions of a few docs
+# are decoded without decoding the whole list.  Layout:
+#     - TERM_HEADER: doc count, block count, position count
+#     - uint32 first doc of each block
+#     - uint32 start of each block in the doc bytes, and their end
+#     - uint32 start of each block in the position bytes, and their end
+#     - doc bytes: for each doc the gap from the previous doc of its block
+#       (0 for the first) and its number of positions, varint encoded
+#     - position bytes: for each doc the gaps between its positions, varint
+#       encoded
+#
+# @input: postings: list of (doc id, list of positions in increasing order)
+# @return: bytearray of the encoded list
+# ---------------------------------------------------------------------------------
+def encode_positions(postings):
+    doc_bytes = bytearray()
+    position_bytes = bytearray()
+    first_docs = array('I')
+    doc_starts = array('I')
+    position_starts = array('I')
+    position_count = 0
+    prev_doc = 0
+    for num, (doc, doc_positions) in enumerate(sorted(postings)):
+        if num % SKIP_DOCS == 0:
+            first_docs.append(doc)
+            doc_starts.append(len(doc_bytes))
+            position_starts.append(len(position_bytes))
+            prev_doc = doc
+        encode_varint(doc - prev_doc, doc_bytes)
+        encode_varint(len(doc_positions), doc_bytes)
+        prev = 0
+        for position in doc_positions:
+            encode_varint(position - prev, position_bytes)
+            prev = position
+        position_count += len(doc_positions)
+        prev_doc = doc
+    doc_starts.append(len(doc_bytes))
+    position_starts.append(len(position_bytes))
+    out = bytearray(TERM_HEADER.pack(len(postings), len(first_docs), position_count))
+    for values in (first_docs, doc_starts, position_starts):
+        out.extend(values.tobytes())
+    out.extend(doc_bytes)
+    out.extend(position_bytes)
+    return out
+
+
+# ---------------------------------------------------------------------------------
+# decode varints with array operations
+#
+# @input: data: uint8 array of whole varints
+# @return: int64 array of the values
+# ---------------------------------------------------------------------------------
+def decode_varints(data):
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+# sums of each run of values, every run starting from 0
+def run_sums(values, lengths):
+    sums = np.cumsum(values)
+    firsts = np.cumsum(lengths) - lengths
+    return sums - np.repeat(sums[firsts] - values[firsts], lengths)
+
+
+# ---------------------------------------------------------------------------------
+# decode the positions of a term written by encode_positions
+#
+# @input: buf: bytes of the posting list
+#         allowed: optional sorted int array, only the docs in it are decoded
+# @return: docs: int64 array of doc ids in increasing order
+#          starts: int64 array, the positions of docs[i] are
+#                  positions[starts[i]:starts[i + 1]]
+#          positions: int64 array of word positions
+# ---------------------------------------------------------------------------------
+def decode_positions(buf, allowed=None):
+    doc_count, block_count, _ = TERM_HEADER.unpack_from(buf, 0)
+    table = np.frombuffer(buf, dtype='<u4', count=3 * block_count + 2, offset=TERM_HEADER.size).astype(np.int64)
+    first_docs = table[:block_count]
+    doc_starts = table[block_count:2 * block_count + 1]
+    position_starts = table[2 * block_count + 1:]
+    data = np.frombuffer(buf, dtype=np.uint8, offset=TERM_HEADER.size + 4 * len(table))
+    doc_data = data[:doc_starts[-1]]
+    position_data = data[doc_starts[-1]:]
+
+    blocks = np.arange(block_count)
+    if allowed is not None:
+        # the block each allowed doc would be in
+        blocks = np.unique(np.searchsorted(first_docs, allowed, side='right') - 1)
+        blocks = blocks[blocks >= 0]
+        doc_data = np.concatenate([doc_data[doc_starts[block]:doc_starts[block + 1]] for block in blocks.tolist()]
+                                  or [doc_data[:0]])
+        position_data = np.concatenate([position_data[position_starts[block]:position_starts[block + 1]]
+                                        for block in blocks.tolist()] or [position_data[:0]])
+    block_docs = np.minimum(SKIP_DOCS, doc_count - blocks * SKIP_DOCS)
+
+    values = decode_varints(doc_data).reshape(-1, 2)
+    docs = np.repeat(first_docs[blocks], block_docs) + run_sums(values[:, 0], block_docs)
+    counts = values[:, 1]
+    positions = run_sums(decode_varints(position_data), counts)
+    if allowed is not None:
+        keep = locate(allowed, docs)[1]
+        positions = positions[np.repeat(keep, counts)]
+        docs = docs[keep]
+        counts = counts[keep]
+    starts = np.zeros(len(docs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    return docs, starts, positions
+
+
+# ---------------------------------------------------------------------------------
+# write a positional index file
+#
+# @input: filename: path of the file to write
+#         index: dictionary of term -> list of (doc id, list of positions)
+#         doc_count: number of docs in the collection
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_positional_index(filename, index, doc_count):
+    write_binary_index(filename, index, doc_count, encode=encode_positions, magic=MAGIC, version=VERSION)
+
+
+class PositionalIndex(BinaryIndex):
+    """
+    Read only view of a positional index file.
+        index[term].postings(): docs, starts, positions from decode_positions
+        term_keys(term, allowed): the positions of a term as sorted keys
+    An entry weighs its number of positions in the entry cache.
+    """
+    magic = MAGIC
+    version = VERSION
+
+    def make_entry(self, num):
+        idf, count, length, offset = TERM_INFO.unpack_from(self._map, self._term_info + num * TERM_INFO.size)
+        position_count = TERM_HEADER.unpack_from(self._map, self._postings + offset)[2]
+        return TermEntry(self, idf, count, length, offset, position_count)
+
+    def read_postings(self, offset, length, allowed=None):
+        start = self._postings + offset
+        return decode_positions(self._map[start:start + length], allowed)
+
+    # -----------------------------------------------------------------------------
+    # positions of a term as sorted keys
+    #
+    # @input: term: string
+    #         allowed: optional sorted int array of the docs to look at, only
+    #                  their part of the list is decoded and it is not cached
+    # @return: int64 array of doc << POSITION_BITS | position, empty if the
+    #          term is not in the index
+    # -----------------------------------------------------------------------------
+    def term_keys(self, term, allowed=None):
+        entry = self.get(term)
+        if entry is None:
+            return EMPTY
+        if allowed is None:
+            docs, starts, positions = entry.postings()
+        else:
+            docs, starts, positions = entry.postings_in(allowed)
+        return (np.repeat(docs, np.diff(starts)) << POSITION_BITS) | positions
+
+
+# ---------------------------------------------------------------------------------
+# split the phrase and window operators out of a query
+#
+# @input: query: query string
+# @return: words: every query word, quotes removed
+#          operators: list of Operator
+# ---------------------------------------------------------------------------------
+def parse_query(query):
+    operators = []
+    for match in QUOTED.finditer(query):
+        words = match.group(1).split()
+        if words:
+            window = int(match.group(2)) if match.group(2) else None
+            operators.append(Operator(words, window))
+    words = QUOTED.sub(lambda match: ' ' + match.group(1) + ' ', query).replace('"', ' ').split()
+    return words, operators
+
+
+# ---------------------------------------------------------------------------------
+# position keys of each query word, restricted to the docs having every word
+#
+# @input: positions: PositionalIndex
+#         groups: list of the variants of each query word
+#         allowed: optional sorted int array of the docs to look at
+# @return: docs: sorted int64 array of the docs having every word
+#          keys: list of the sorted keys of each word in those docs
+# ---------------------------------------------------------------------------------
+def group_keys(positions, groups, allowed=None):
+    keys = [union([positions.term_keys(term, allowed) for term in terms]) for terms in groups]
+    docs = intersect([np.unique(word_keys >> POSITION_BITS) for word_keys in keys])
+    return docs, [word_keys[locate(docs, word_keys >> POSITION_BITS)[1]] for word_keys in keys]
+
+
+# ---------------------------------------------------------------------------------
+# docs with the query words next to each other in order
+#
+# @input: positions: PositionalIndex
+#         groups: list of the variants of each phrase word, in phrase order
+#         allowed: optional sorted int array of the docs to look at
+# @return: docs: sorted int64 array of the matching docs, empty if there
+#                are no words
+#          counts: int array of the times the phrase is in each doc
+# ---------------------------------------------------------------------------------
+def match_phrase(positions, groups, allowed=None):
+    if not groups:
+        return EMPTY, EMPTY
+    docs, keys = group_keys(positions, groups, allowed)
+    starts = None
+    for offset, word_keys in enumerate(keys):
+        # keys of phrase starts, a word at position p starts the phrase at p - offset
+        word_keys = word_keys[(word_keys & POSITION_MASK) >= offset] - offset
+        starts = word_keys if starts is None else intersect_two(starts, word_keys)
+        if not len(starts):
+            return EMPTY, EMPTY
+    return np.unique(starts >> POSITION_BITS, return_counts=True)
+
+
+# ---------------------------------------------------------------------------------
+# smallest window holding every query word in each doc
+#
+# @input: positions: PositionalIndex
+#         groups: list of the variants of each query word
+#         allowed: optional sorted int array of the docs to look at
+# @return: docs: sorted int64 array of the docs having every word, empty if
+#                there are no words
+#          spans: int64 array of the words in the smallest window of each doc
+# ---------------------------------------------------------------------------------
+def min_spans(positions, groups, allowed=None):
+    if not groups:
+        return EMPTY, EMPTY
+    docs, keys = group_keys(positions, groups, allowed)
+    if len(groups) < 2 or not len(docs):
+        return docs, np.ones(len(docs), dtype=np.int64)
+    all_keys = np.concatenate(keys)
+    labels = np.concatenate([np.full(len(word_keys), num) for num, word_keys in enumerate(keys)])
+    order = np.argsort(all_keys, kind='stable')
+    all_keys = all_keys[order]
+    labels = labels[order].tolist()
+    doc_positions = (all_keys & POSITION_MASK).tolist()
+    bounds = [0] + (np.flatnonzero(np.diff(all_keys >> POSITION_BITS)) + 1).tolist() + [len(all_keys)]
+
+    word_count = len(groups)
+    spans = np.empty(len(docs), dtype=np.int64)
+    for num in range(len(docs)):
+        counts = [0] * word_count
+        covered = 0
+        best = None
+        left = bounds[num]
+        for right in range(bounds[num], bounds[num + 1]):
+            label = labels[right]
+            if counts[label] == 0:
+                covered += 1
+            counts[label] += 1
+            while covered == word_count:
+                span = doc_positions[right] - doc_positions[left] + 1
+                if best is None or span < best:
+                    best = span
+                label = labels[left]
+                counts[label] -= 1
+                if counts[label] == 0:
+                    covered -= 1
+                left += 1
+        spans[num] = best
+    return docs, spans
+
+
+# ---------------------------------------------------------------------------------
+# docs matching a phrase or window operator
+#
+# @input: positions: PositionalIndex
+#         groups: list of the variants of each operator word
+#         window: None for a phrase, else the largest span allowed, ANY_SPAN
+#                 for the docs having every word
+#         allowed: optional sorted int array of the docs to look at
+# @return: sorted int64 array of doc ids
+# ---------------------------------------------------------------------------------
+def match_operator(positions, groups, window=None, allowed=None):
+    if window is None:
+        return match_phrase(positions, groups, allowed)[0]
+    if window >= ANY_SPAN:
+        return group_keys(positions, groups, allowed)[0] if groups else EMPTY
+    docs, spans = min_spans(positions, groups, allowed)
+    return docs[spans <= window]
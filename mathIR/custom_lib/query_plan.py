@@ -0,0 +1,188 @@
+"""
+Shared work of the rankers run for one query
+
+results() ranks the same expanded query with several models.  A QueryPlan
+reads the posting lists of the query terms once, scores BM25 over the word
+index and over the anchor index at most once each, and hands those to every
+model it runs:
+    'bm25': best k docs by BM25
+    'bm25mod': best k docs by BM25 among the docs matching every query word
+    'cascade': the best depth BM25 docs re-ranked by the svm
+    'svm': every doc in the collection ranked by the svm
+so running the models side by side costs about as much as the slowest one.
+A plan given allowed docs (the matches of a phrase or window operator) ranks
+only those, and with a positional index the svm gets the proximity of the
+query words.
+
+query_plan.py
+"""
+import time
+from .bm25 import get_engine, fetch_postings
+from .intersect import doc_set, locate, intersect_two
+from .features import get_feature_engine
+from .wand import block_max_wand
+
+MODELS = ('bm25', 'bm25mod', 'cascade', 'svm')
+CASCADE_DEPTH = 100
+
+
+class QueryPlan:
+    """
+    One query over the serving indexes.
+        term_postings: TermPostings of the query terms in the word index
+        bm25(): the docs matching a query term in the word index and their
+            BM25 scores
+        anchor_bm25(): the same over the anchor index
+        run(models, ...): dictionary of model -> list of (doc, title, score)
+        timings: dictionary of model -> ms spent in the last run, 'shared' is
+            the BM25 pass computed up front for several models
+    allowed is an optional sorted int array of the only docs to rank, groups
+    the variants of each query word and positions a PositionalIndex, both for
+    the proximity feature.
+    """
+
+    def __init__(self, terms, index, doc_index, anchor_index=None, impacts=None, allowed=None, groups=None,
+                 positions=None):
+        self.terms = terms
+        self.index = index
+        self.doc_index = doc_index
+        self.anchor_index = anchor_index
+        self.impacts = impacts
+        self.allowed = allowed
+        self.groups = groups
+        self.positions = positions
+        self.engine = get_engine(doc_index)
+        self.term_postings = fetch_postings(terms, index)
+        self.timings = {}
+        self._bm25 = None
+        self._anchor_bm25 = None
+
+    def bm25(self):
+        if self._bm25 is None:
+            self._bm25 = self.engine.score_postings(self.term_postings, self.allowed)
+        return self._bm25
+
+    def anchor_bm25(self):
+        if self._anchor_bm25 is None:
+            self._anchor_bm25 = self.engine.score(self.terms, self.anchor_index)
+        return self._anchor_bm25
+
+    # -----------------------------------------------------------------------------
+    # best BM25 docs, from Block-Max WAND when the plan has an impact index
+    # and the full BM25 scores have not been needed by another model yet
+    #
+    # @input: k: number of docs
+    # @return: list of (doc, score), highest score first
+    # -----------------------------------------------------------------------------
+    def top_bm25(self, k):
+        if self.impacts is not None and self._bm25 is None and self.allowed is None:
+            doc_scores = block_max_wand(self.engine, self.terms, self.index, k, self.impacts)
+            if doc_scores is not None:
+                return doc_scores
+        docs, scores = self.bm25()
+        best = self.engine.top_k(docs, scores, k)
+        return list(zip(docs[best].tolist(), scores[best].tolist()))
+
+    def rank_bm25(self, k):
+        return [(doc, self.doc_index.title(doc), score) for doc, score in self.top_bm25(k)]
+
+    # -----------------------------------------------------------------------------
+    # BM25 restricted to the docs with every query word, the scores of those
+    # docs are the same as over the whole collection
+    #
+    # @input: k: number of docs
+    #         doc_list: doc ids matching the query conjunctively
+    # @return: list of (doc, name, score), highest score first
+    # -----------------------------------------------------------------------------
+    def rank_bm25_mod(self, k, doc_list):
+        allowed = doc_set(doc_list)
+        if self.allowed is not None:
+            allowed = intersect_two(allowed, self.allowed)
+        if self._bm25 is not None:
+            docs, scores = self._bm25
+            keep = locate(allowed, docs)[1]
+            docs = docs[keep]
+            scores = scores[keep]
+        else:
+            docs, scores = self.engine.score_postings(self.term_postings, allowed)
+        best = self.engine.top_k(docs, scores, k)
+        return [(doc, self.doc_index.name(doc), score)
+                for doc, score in zip(docs[best].tolist(), scores[best].tolist())]
+
+    # -----------------------------------------------------------------------------
+    # svm scores of a set of docs using the plan's postings and anchor scores
+    #
+    # @input: doc_ids: list of doc ids
+    #         svm_weights: weights from get_svm_weights
+    # @return: list of (doc, title, score) in doc_ids order
+    # -----------------------------------------------------------------------------
+    def rank_svm(self, doc_ids, svm_weights):
+        feature_engine = get_feature_engine(self.doc_index)
+        features = feature_engine.features(self.terms, doc_ids, self.index, self.anchor_index,
+                                           term_postings=self.term_postings, anchor_bm25=self.anchor_bm25(),
+                                           positions=self.positions, groups=self.groups)
+        scores = feature_engine.score(features, svm_weights).tolist()
+        return [(doc, self.doc_index.title(doc), score) for doc, score in zip(doc_ids, scores)]
+
+    def run_model(self, model, k=10, doc_list=None, svm_weights=None, depth=CASCADE_DEPTH):
+        if model == 'bm25':
+            return self.rank_bm25(k)
+        elif model == 'bm25mod':
+            return self.rank_bm25_mod(k, doc_list if doc_list is not None else [])
+        elif model == 'cascade':
+            doc_ids = [doc for doc, _ in self.top_bm25(depth)]
+            return self.rank_svm(doc_ids, svm_weights) if doc_ids else []
+        elif model == 'svm':
+            if self.allowed is not None:
+                return self.rank_svm(self.allowed.tolist(), svm_weights)
+            return self.rank_svm(list(range(len(self.doc_index))), svm_weights)
+        raise ValueError('unknown model %s' % model)
+
+    # -----------------------------------------------------------------------------
+    # run the chosen models
+    #
+    # @input: models: model names from MODELS
+    #         k: number of docs the bm25 models return
+    #         doc_list: conjunctive matches, needed by 'bm25mod'
+    #         svm_weights: needed by 'cascade' and 'svm'
+    #         depth: number of BM25 candidates 'cascade' re-ranks
+    #         executor: RequestExecutor to run the shared passes and then the
+    #                   models in parallel, they run one after another without
+    # @return: dictionary of model -> list of (doc, title or name, score), the
+    #          bm25 models sorted highest score first
+    # -----------------------------------------------------------------------------
+    def run(self, models, k=10, doc_list=None, svm_weights=None, depth=CASCADE_DEPTH, executor=None):
+        for model in models:
+            if model not in MODELS:
+                raise ValueError('unknown model %s' % model)
+        self.timings = {}
+        # the full BM25 scores serve bm25mod and the cascade as well, so they are
+        # computed before any model that could use WAND instead
+        shared = []
+        if 'bm25mod' in models or ('cascade' in models and 'bm25' in models):
+            shared.append(('shared', self.bm25))
+        # the shared passes are done before the models start, so models running
+        # in parallel only ever read the plan
+        if executor is not None and ('cascade' in models or 'svm' in models):
+            shared.append(('anchor', self.anchor_bm25))
+
+        if executor is None:
+            for stage, fn in shared:
+                t1 = time.perf_counter()
+                fn()
+                self.timings[stage] = (time.perf_counter() - t1) * 1000
+            results = {}
+            for model in models:
+                t1 = time.perf_counter()
+                results[model] = self.run_model(model, k, doc_list, svm_weights, depth)
+                self.timings[model] = (time.perf_counter() - t1) * 1000
+            return results
+
+        for future in [executor.submit(stage, fn) for stage, fn in shared]:
+            future.result()
+        futures = [(model, executor.submit(model, self.run_model, model, k, doc_list, svm_weights, depth))
+                   for model in models]
+        results = {model: future.result() for model, future in futures}
+        for stage in [stage for stage, _ in shared] + list(models):
+            self.timings[stage] = executor.timings[stage]
+        return results
@@ -56,7 +56,7 @@ def get_most_similar(term, index, doc_index):
     most_similar = term
     most_similar_score = 0
     doc_count = len(doc_index)
-    for word in index:
+    for word, entry in index.items():
         if abs(len(word) - len(term)) <= MAX_DIST:
             if term == word:
                 dist = 0
@@ -67,7 +67,7 @@ def get_most_similar(term, index, doc_index):
                     similarity = 1.5
                 else:
                     similarity = 1 - dist / len(word)
-                usage = int(index[word]['count']) / doc_count
+                usage = int(entry['count']) / doc_count
                 score = similarity + usage
                 if score > most_similar_score:
                     most_similar_score = score
@@ -0,0 +1,137 @@
+"""
+Cache of query results
+
+Repeated queries are answered from three kinds of entries:
+    'terms': raw query string -> cleaned terms, expanded terms and the
+             expansion of each cleaned term
+    'ranked': model, cleaned and expanded terms and ranking options -> the
+              ranked list of that model
+    'snippet': doc id and query terms -> the snippet lines of the doc
+Each kind has its own in-process LRU bounded by entry count and a ttl.  A
+shared backend (anything with get(key) and set(key, value, timeout), such as
+a Django memcached cache) is checked on a local miss, so every server worker
+sees what the others computed.  Writes to the backend are queued and made by
+a background thread, a request never waits on them, and when the queue is
+full they are dropped.
+
+Every key includes the version of the loaded indexes, set_version is called
+when the indexes are loaded, so results of an old index are never returned.
+
+result_cache.py
+"""
+import hashlib
+from queue import Queue, Full
+from threading import Lock, Thread
+from .cache import LRUCache
+
+KINDS = ('terms', 'ranked', 'snippet')
+CACHE_SIZES = {'terms': 10000, 'ranked': 2000, 'snippet': 20000}
+CACHE_TTL = 600
+WRITE_QUEUE_SIZE = 1000
+MISSING = object()
+
+
+class ResultCache:
+    """
+    Query result cache.
+        get(kind, key) / put(kind, key, value): value or MISSING
+        set_version(version): start a new index version, clears the local
+            entries
+        stats(): hits, misses and hit rate of each kind
+        flush(): wait for the queued backend writes
+    dropped_writes counts the backend writes dropped on a full queue.
+    """
+
+    def __init__(self, backend=None, sizes=None, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.version = None
+        sizes = sizes if sizes is not None else CACHE_SIZES
+        self._local = {kind: LRUCache(sizes[kind], ttl=ttl) for kind in KINDS}
+        self._shared_hits = {kind: 0 for kind in KINDS}
+        self._lock = Lock()
+        self._writes = None
+        self.dropped_writes = 0
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            for cache in self._local.values():
+                cache.clear()
+
+    def _backend_key(self, kind, key):
+        digest = hashlib.sha1(repr((self.version, kind, key)).encode('utf-8')).hexdigest()
+        return 'mathIR:%s:%s' % (kind, digest)
+
+    def get(self, kind, key):
+        if self.version is None:
+            return MISSING
+        value = self._local[kind].get((self.version, key), MISSING)
+        if value is MISSING and self.backend is not None:
+            try:
+                value = self.backend.get(self._backend_key(kind, key), MISSING)
+            except Exception as e:
+                # a broken shared cache only costs the hit
+                print('result cache:', e)
+                value = MISSING
+            if value is not MISSING:
+                self._local[kind].put((self.version, key), value)
+                with self._lock:
+                    self._shared_hits[kind] += 1
+        return value
+
+    def put(self, kind, key, value):
+        if self.version is None:
+            return
+        self._local[kind].put((self.version, key), value)
+        if self.backend is not None:
+            self._queue_write(self._backend_key(kind, key), value)
+
+    def _queue_write(self, backend_key, value):
+        with self._lock:
+            if self._writes is None:
+                # the writer thread starts with the first write
+                self._writes = Queue(WRITE_QUEUE_SIZE)
+                Thread(target=self._write_backend, name='result-cache-writer', daemon=True).start()
+        try:
+            self._writes.put_nowait((backend_key, value))
+        except Full:
+            with self._lock:
+                self.dropped_writes += 1
+
+    def _write_backend(self):
+        while True:
+            backend_key, value = self._writes.get()
+            try:
+                self.backend.set(backend_key, value, self.ttl)
+            except Exception as e:
+                # a broken shared cache only costs the write
+                print('result cache:', e)
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        if self._writes is not None:
+            self._writes.join()
+
+    # -----------------------------------------------------------------------------
+    # hit rates of the cache
+    #
+    # @input: None
+    # @return: dictionary of kind -> {'hits', 'shared_hits', 'misses',
+    #          'hit_rate', 'entries'}, a shared hit is a local miss found in the
+    #          backend and counts as a hit
+    # -----------------------------------------------------------------------------
+    def stats(self):
+        stats = {}
+        for kind, cache in self._local.items():
+            shared_hits = self._shared_hits[kind]
+            hits = cache.hits + shared_hits
+            misses = cache.misses - shared_hits
+            lookups = hits + misses
+            stats[kind] = {'hits': hits,
+                           'shared_hits': shared_hits,
+                           'misses': misses,
+                           'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                           'entries': len(cache)}
+        return stats
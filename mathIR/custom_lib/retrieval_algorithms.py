@@ -5,30 +5,27 @@ retrieval_algorithms.py
 @author Aaron Smith, Grant Larsen
 11/26/2019
 """
-import math
 import os
 import csv
-from .utils import get_index, get_docs_index, format_text
+import numpy as np
+from .utils import get_index, get_doc_table, get_pos_index, format_text
+from .bm25 import get_engine
+from .intersect import doc_set, intersect_two
+from .wand import block_max_wand
+from .positions import match_operator
+from .features import get_feature_engine
+from .query_plan import QueryPlan, CASCADE_DEPTH
 from sklearn import svm
 
-# -----
-# BM25 parameters
-# -----
-K_1 = 1.2
-K_2 = 100.0
-B = 0.75
-R = 0
-R_i = 0
-
 TRAINING_DATA_FILE_NAME = 'training_data.tsv'
 WEIGHT_VECTOR_FILE_NAME = 'svm_weights.tsv'
 
 
 def main():
-    doc_index = get_docs_index()
+    doc_index = get_doc_table()
     index = get_index()
     anchor_index = get_index(anchor=True)
-    train_svm(doc_index, index, anchor_index)
+    train_svm(doc_index, index, anchor_index, get_pos_index())
 
 
 # ---------------------------------------------------------------------------------
@@ -36,70 +33,49 @@ def main():
 #
 # @input: terms: list of given query terms
 #         index: dictionary with document word frequencies
-#         doc_index: index with word, and line counts
-#         query_model: string to specify retrieval algorithm to use
+#         doc_index: DocTable with word counts, titles and page ranks
+#         query_model: 'bm25', 'wand', 'bm25mod', 'phrase', 'cascade' or 'svm',
+#                      ValueError for anything else
 # @return: list of documents(some variation based on algorithm)
 # ---------------------------------------------------------------------------------
 def query(terms, index, doc_index, anchor_index, svm_model, query_model, doc_index_terms=False, **kwargs):
     if query_model == 'bm25':
         return query_bm25(terms, index, doc_index, **kwargs)
+    elif query_model == 'wand':
+        return query_wand(terms, index, doc_index, **kwargs)
     elif query_model == 'bm25mod':
         return query_bm25_mod(terms, index, doc_index, doc_index_terms, **kwargs)
-    else:
+    elif query_model == 'phrase':
+        return query_phrase(terms, index, doc_index, **kwargs)
+    elif query_model == 'cascade':
+        return query_cascade(terms, index, doc_index, anchor_index, svm_model, **kwargs)
+    elif query_model == 'svm':
         return query_svm(terms, index, doc_index, anchor_index, svm_model)
+    else:
+        raise ValueError('unknown query model ' + repr(query_model))
 
 
+# ---------------------------------------------------------------------------------
+# get list of documents using BM25 to rank, only scoring the docs that match
+# the query conjunctively
+#
+# @input: terms: list of given query terms
+#         index: dictionary with document word frequencies
+#         doc_index: DocTable with word counts and names
+#         doc_lists_terms: doc ids matching every query term
+#         k: keep only the best k docs, sorted highest score first
+#         limit_to: only score these doc ids
+# @return: doc_scores: list tuples(doc, name, score)
+# ---------------------------------------------------------------------------------
 def query_bm25_mod(terms, index, doc_index, doc_lists_terms, **kwargs):
-    term_counts = {}
-    for term in terms:
-        if term in term_counts:
-            term_counts[term] += 1
-        else:
-            term_counts[term] = 1
-
-    avg_dl = 0.0
-    doc_scores = {}
-    for doc in doc_index:
-        avg_dl += float(doc_index[doc]['words'])
-
-    avg_dl /= len(doc_index)
-    n = len(doc_index)
-
-    doc_k = {}
+    engine = get_engine(doc_index)
     #SCORES Only conjunctive DOCUMENTS IN DOC INDEX
-    for doc in doc_lists_terms:
-        doc_k[doc] = K_1 * ((1 - B) + B * (float(doc_index[doc]['words']) / avg_dl))
-
-    for term in term_counts:
-        try:
-            index_entry = index[term]
-            n_i = float(index_entry['count'])
-        except KeyError:
-            continue
-        term_weight = math.log(((R_i + 0.5) / (R - R_i + 0.5)) / ((n_i - R_i + 0.5) / (n - n_i - R + R_i + 0.5)))
-        if term_weight < -0.25:
-            term_weight = -0.25
-        query_term_weight = ((K_2 + 1) * term_counts[term]) / (K_2 + term_counts[term])
-
-        try:
-            for doc, f_i in index[term]['docs'].items():
-                k = doc_k[doc]
-                doc_weight = (K_1 + 1) * f_i / (k + f_i)
-
-                if doc not in doc_scores:
-                    doc_scores[doc] = 0.0
-                doc_scores[doc] += term_weight * doc_weight * query_term_weight
-
-        except KeyError:
-            continue
-    doc_scores = [(doc, doc_index[doc]['name'], doc_scores[doc]) for doc in doc_scores]
+    allowed = doc_set(doc_lists_terms)
     if 'limit_to' in kwargs:
-        limited_scores = []
-        for doc in doc_scores:
-            if doc[0] in kwargs['limit_to']:
-                limited_scores.append(doc)
-        doc_scores = limited_scores
-    return doc_scores
+        allowed = intersect_two(allowed, doc_set(kwargs['limit_to']))
+    docs, scores = engine.score(terms, index, allowed)
+    best = engine.top_k(docs, scores, kwargs.get('k'))
+    return [(doc, doc_index.name(doc), score) for doc, score in zip(docs[best].tolist(), scores[best].tolist())]
 
 
 # ---------------------------------------------------------------------------------
@@ -107,75 +83,118 @@ def query_bm25_mod(terms, index, doc_index, doc_lists_terms, **kwargs):
 #
 # @input: terms: list of given query terms
 #         index: dictionary with document word frequencies
-#         doc_index: dictionary for word and line count
-# @return: doc_scores: list tuples(documents,score)
+#         doc_index: DocTable with word counts and titles
+#         k: keep only the best k docs, sorted highest score first
+#         limit_to: only score these doc ids
+# @return: doc_scores: list tuples(doc, title, score)
 # ---------------------------------------------------------------------------------
 def query_bm25(terms, index, doc_index, **kwargs):
-    term_counts = {}
-    for term in terms:
-        if term in term_counts:
-            term_counts[term] += 1
-        else:
-            term_counts[term] = 1
-
-    avg_dl = 0.0
-    doc_scores = {}
-    for doc in doc_index:
-        avg_dl += float(doc_index[doc]['words'])
-
-    avg_dl /= len(doc_index)
-    n = len(doc_index)
-
-    doc_k = {}
-    for doc in doc_index:
-        doc_k[doc] = K_1*((1 - B) + B * (float(doc_index[doc]['words'])/avg_dl))
-
-    for term in term_counts:
-        try:
-            index_entry = index[term]
-            n_i = float(index_entry['count'])
-        except KeyError:
-            continue
-        term_weight = math.log(((R_i + 0.5)/(R - R_i + 0.5))/((n_i - R_i + 0.5)/(n - n_i - R + R_i + 0.5)))
-        if term_weight < -0.25:
-            term_weight = -0.25
-        query_term_weight = ((K_2 + 1)*term_counts[term])/(K_2 + term_counts[term])
-
-        try:
-            for doc, f_i in index[term]['docs'].items():
-                k = doc_k[doc]
-                doc_weight = (K_1 + 1)*f_i/(k + f_i)
-
-                if doc not in doc_scores:
-                    doc_scores[doc] = 0.0
-                doc_scores[doc] += term_weight*doc_weight*query_term_weight
-
-        except KeyError:
-            continue
-    doc_scores = [(doc, doc_index[doc]['title'], doc_scores[doc]) for doc in doc_scores]
+    engine = get_engine(doc_index)
+    allowed = None
     if 'limit_to' in kwargs:
-        limited_scores = []
-        for doc in doc_scores:
-            if doc[0] in kwargs['limit_to']:
-                limited_scores.append(doc)
-        doc_scores = limited_scores
-    return doc_scores
+        allowed = doc_set(kwargs['limit_to'])
+    docs, scores = engine.score(terms, index, allowed)
+    best = engine.top_k(docs, scores, kwargs.get('k'))
+    return [(doc, doc_index.title(doc), score) for doc, score in zip(docs[best].tolist(), scores[best].tolist())]
+
+
+# ---------------------------------------------------------------------------------
+# get the best k documents by BM25 with Block-Max WAND, the same documents and
+# scores query_bm25 returns for k but only the docs whose score bounds can get
+# into the top k are scored
+#
+# @input: terms: list of given query terms
+#         index: dictionary with document word frequencies
+#         doc_index: DocTable with word counts and titles
+#         k: number of docs to return
+#         impacts: ImpactIndex of index from get_impact_index, bounds are
+#                  computed per query without it
+# @return: doc_scores: list tuples(doc, title, score), highest score first
+# ---------------------------------------------------------------------------------
+def query_wand(terms, index, doc_index, k=10, impacts=None, **kwargs):
+    if 'limit_to' in kwargs:
+        return query_bm25(terms, index, doc_index, k=k, **kwargs)
+    doc_scores = block_max_wand(get_engine(doc_index), terms, index, k, impacts)
+    if doc_scores is None:
+        # a term in most of the docs has a negative weight, the bounds only
+        # hold for terms that add to a score
+        return query_bm25(terms, index, doc_index, k=k)
+    return [(doc, doc_index.title(doc), score) for doc, score in doc_scores]
+
+
+# ---------------------------------------------------------------------------------
+# get list of documents using BM25 to rank, only scoring the docs with the
+# query terms as a phrase, or all within a window of words
+#
+# @input: terms: list of given query terms, in phrase order
+#         index: dictionary with document word frequencies
+#         doc_index: DocTable with word counts and titles
+#         positions: PositionalIndex from get_pos_index
+#         window: None for a phrase, else the most words the terms may span
+#         k: keep only the best k docs, sorted highest score first
+# @return: doc_scores: list tuples(doc, title, score)
+# ---------------------------------------------------------------------------------
+def query_phrase(terms, index, doc_index, positions, window=None, **kwargs):
+    matches = match_operator(positions, [[term] for term in terms], window)
+    return query_bm25(terms, index, doc_index, limit_to=matches, k=kwargs.get('k'))
 
 
 def query_svm(terms, index, doc_index, anchor_index, svm_weights):
-    doc_ids = list(doc_index.keys())
+    doc_ids = list(range(len(doc_index)))
     features = get_features(terms, doc_ids, doc_index, index, anchor_index)
     doc_scores = score_docs(doc_ids, doc_index, features, svm_weights)
     return doc_scores
 
 
+# ---------------------------------------------------------------------------------
+# get the top BM25 candidates for the cascade
+#
+# @input: terms: list of given query terms
+#         index: dictionary with document word frequencies
+#         doc_index: DocTable
+#         depth: number of candidates
+#         impacts: ImpactIndex, candidates come from query_wand when given
+# @return: list of doc ids, best BM25 score first
+# ---------------------------------------------------------------------------------
+def get_candidates(terms, index, doc_index, depth=CASCADE_DEPTH, impacts=None):
+    if impacts is not None:
+        candidates = query_wand(terms, index, doc_index, k=depth, impacts=impacts)
+    else:
+        candidates = query_bm25(terms, index, doc_index, k=depth)
+    return [doc for doc, _, _ in candidates]
+
+
+# ---------------------------------------------------------------------------------
+# two stage ranking: BM25 picks the best depth docs and only those get svm
+# features and scores, so the svm cost grows with depth, not the collection
+#
+# @input: terms: list of given query terms
+#         index: dictionary with document word frequencies
+#         doc_index: DocTable
+#         anchor_index: anchor text frequency index
+#         svm_weights: weights from get_svm_weights
+#         depth: number of BM25 candidates to re-rank
+#         impacts: ImpactIndex, candidates come from query_wand when given
+# @return: doc_scores: list tuples(doc, title, svm score) of the candidates
+# ---------------------------------------------------------------------------------
+def query_cascade(terms, index, doc_index, anchor_index, svm_weights, depth=CASCADE_DEPTH, impacts=None,
+                  **kwargs):
+    plan = QueryPlan(terms, index, doc_index, anchor_index, impacts)
+    return plan.run(['cascade'], svm_weights=svm_weights, depth=depth)['cascade']
+
+
+# ---------------------------------------------------------------------------------
+# svm score of each doc, one matrix-vector product of the features and weights
+#
+# @input: doc_ids: list of doc ids
+#         doc_index: DocTable
+#         features: feature matrix from get_features, one row per doc id
+#         svm_weights: weights from get_svm_weights
+# @return: doc_scores: list tuples(doc, title, score)
+# ---------------------------------------------------------------------------------
 def score_docs(doc_ids, doc_index, features, svm_weights):
-    scores = []
-    for doc in range(0, len(doc_ids)):
-        doc_id = doc_ids[doc]
-        scores.append((doc_id, doc_index[doc_id]['title'], sum(x_i*y_i for x_i, y_i in zip(features[doc],
-                                                                                           svm_weights))))
-    return scores
+    scores = get_feature_engine(doc_index).score(features, svm_weights).tolist()
+    return [(doc_id, doc_index.title(doc_id), score) for doc_id, score in zip(doc_ids, scores)]
 
 
 def make_training_data_file():
@@ -202,7 +221,7 @@ def make_training_data_file():
         writer.writerows(training_data_lines)
 
 
-def train_svm(doc_index, index, anchor_index):
+def train_svm(doc_index, index, anchor_index, positions=None):
     features = []
     rels = []
     with open(TRAINING_DATA_FILE_NAME, 'r', encoding='utf-8') as data_file:
@@ -210,7 +229,7 @@ def train_svm(doc_index, index, anchor_index):
         line = line.split('\t')
         while line:
             query_text = line[0]
-            doc_ids = [line[1]]
+            doc_ids = [doc_index.doc_number(line[1])]
             rels.append(int(line[2].strip()))
             next_line = data_file.readline()
             while next_line:
@@ -218,16 +237,14 @@ def train_svm(doc_index, index, anchor_index):
                 if next_line[0] != query_text:
 
                     break
-                doc_ids.append(next_line[1])
+                doc_ids.append(doc_index.doc_number(next_line[1]))
                 rels.append(int(line[2].strip()))
                 next_line = data_file.readline()
 
-            query_features = get_features(format_text(query_text), doc_ids, doc_index, index, anchor_index)
-            for feature in query_features:
-                features.append(feature)
+            features.append(get_features(format_text(query_text), doc_ids, doc_index, index, anchor_index, positions))
             line = next_line
     svm_model = svm.LinearSVC(max_iter=2000)
-    svm_model.fit(features, rels)
+    svm_model.fit(np.vstack(features), rels)
     relevant_weights = list(svm_model.coef_[2])
     with open(WEIGHT_VECTOR_FILE_NAME, 'w') as weight_file:
         csv.writer(weight_file, delimiter='\t').writerow(relevant_weights)
@@ -235,47 +252,19 @@ def train_svm(doc_index, index, anchor_index):
     return relevant_weights
 
 
-def get_features(query_words, doc_ids, doc_index, index, anchor_index):
-    features = [[0 for x in range(0, 5)] for i in range(0, len(doc_ids))]
-    if len(doc_ids) < len(doc_index):
-        bm25_results = query(query_words, anchor_index, doc_index, None, None, 'bm25', limit_to=doc_ids)
-    else:
-        bm25_results =query(query_words, anchor_index, doc_index, None, None, 'bm25')
-    results_dict = {}
-    for result in bm25_results:
-        results_dict[result[0]] = result
-    num_query_terms = len(query_words)
-    for doc in range(0, len(doc_ids)):
-        doc_id = doc_ids[doc]
-        if doc_id in results_dict:
-            result = results_dict[doc_id]
-            features[doc][0] = result[2]
-            features[doc][1] = similarity(query_words, result[1])
-        features[doc][2] = doc_index[doc_id]['page_rank']
-        for term in query_words:
-            if term in index:
-                features[doc][3] += get_term_frequency(term, index, doc_id)
-                features[doc][4] += index[term]['idf']
-        features[doc][3] /= num_query_terms
-        features[doc][4] /= num_query_terms
-    return features
-
-
-def get_term_frequency(term, index, doc_id):
-    try:
-        term_count = index[term]['docs'][doc_id]
-        return math.log(term_count+1)
-    except KeyError:
-        return 0.0
-
-
-def similarity(query_words, doc_title):
-    num_in_title = 0
-    doc_title_words = doc_title.split()
-    for word in query_words:
-        if word in doc_title_words:
-            num_in_title += 1
-    return num_in_title/len(query_words)
+# ---------------------------------------------------------------------------------
+# svm features of a query for a set of docs
+#
+# @input: query_words: list of query terms
+#         doc_ids: list of doc ids
+#         doc_index: DocTable
+#         index: frequency index
+#         anchor_index: anchor text frequency index
+#         positions: PositionalIndex for the proximity feature
+# @return: NumPy matrix with one row of features per doc id
+# ---------------------------------------------------------------------------------
+def get_features(query_words, doc_ids, doc_index, index, anchor_index, positions=None):
+    return get_feature_engine(doc_index).features(query_words, doc_ids, index, anchor_index, positions=positions)
 
 
 if __name__ == '__main__':
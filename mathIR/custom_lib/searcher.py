@@ -0,0 +1,279 @@
+"""
+Query service over the serving indexes
+
+A Searcher owns the loaded indexes and answers a query end to end: the query
+words are cleaned and expanded, the rankers share one QueryPlan and the
+snippets of the results are extracted, with the result cache in front of each
+step.  Every step reads the posting lists of the query terms and the rows of
+the docs it returns, nothing is built over the whole vocabulary or collection
+per query, so a query on rare terms stays fast however large the index is.
+The one exception is the spelling correction of a word that is not in the
+index, which compares it to the vocabulary, its result is cached by query.
+
+Phrase and window operators ("a b", "a b"~5, see positions.py) and formulas
+($x^2 + y^2$, see formulas.py) restrict the ranked docs to their matches,
+found in the positional and formula indexes.  A query of formulas only is
+ranked by how well the docs match them.
+
+Snippets are cut from the lines of the text store (see text_store.py and
+snippets.py), the html pages are only parsed if the collection was indexed
+without one.  Pages come from the doc store (see doc_store.py), or the
+extracted collection if there is none.
+
+searcher.py
+"""
+import os
+import time
+from collections import namedtuple
+from .utils import conjuctive_query, get_html_lines, get_html_page, get_html_path, open_html_page
+from .result_cache import ResultCache, MISSING
+from .query_plan import QueryPlan, CASCADE_DEPTH
+from .positions import parse_query, match_operator, ANY_SPAN
+from .formulas import split_formulas, match_formula
+from .intersect import locate
+from .bm25 import get_engine
+from .snippets import SnippetMatcher, WINDOW
+from .query_expansion import expand_term
+from .query_suggestion import clean_terms
+
+# query: the query string as searched
+# words: the query words before cleaning, quotes removed
+# terms: the cleaned query words
+# expanded_terms: the words after stem expansion
+# ranked: dictionary of model -> list of (doc, title or name, score)
+# cached: models answered from the result cache
+# timings: dictionary of step -> ms
+SearchResults = namedtuple('SearchResults', 'query words terms expanded_terms ranked cached timings')
+
+
+class Searcher:
+    """
+    Queries over one set of loaded indexes.
+        search(query, models, k): SearchResults
+        snippets(terms, ranked): (collection doc id, snippet lines) of each
+            ranked doc
+        page(doc, doc_name): html of a page
+        page_version(doc, doc_name), open_page(doc, doc_name): to send a page
+    """
+
+    def __init__(self, indexes, cache=None, bm25_model='bm25', depth=CASCADE_DEPTH):
+        self.doc_index = indexes['doc_index']
+        self.index = indexes['freq_index']
+        self.impact_index = indexes['impact_index']
+        self.anchor_index = indexes['anchor_index']
+        self.svm_weights = indexes['svm_model']
+        self.stem_dict = indexes['stem_dict']
+        self.positions = indexes.get('positions')
+        self.formulas = indexes.get('formulas')
+        self.texts = indexes.get('texts')
+        self.documents = indexes.get('documents')
+        self.version = indexes.get('version')
+        self.bm25_model = bm25_model
+        self.depth = depth
+        self.cache = cache if cache is not None else ResultCache()
+        self.cache.set_version(indexes.get('version'))
+
+    # -----------------------------------------------------------------------------
+    # clean and expand the words of a query
+    #
+    # @input: query: query string
+    # @return: words: query words before cleaning
+    #          terms: cleaned query words
+    #          expanded_terms: all the expanded words
+    #          expanded_terms_list: the expansion of each cleaned word
+    #          operators: tuple of (expansion of each operator word, window)
+    #          formulas: tuple of formula strings, as typed
+    # -----------------------------------------------------------------------------
+    def parse(self, query):
+        parsed = self.cache.get('terms', query)
+        if parsed is MISSING:
+            text, formulas = split_formulas(query)
+            words, operators = parse_query(text.lower())
+            terms = clean_terms(words, self.index, self.doc_index)
+            expanded_terms = expand_term(terms, self.stem_dict)
+            expanded_terms_list = [expand_term([term], self.stem_dict) for term in terms]
+            operator_groups = []
+            for operator in operators:
+                # each word cleaned on its own, so a word dropped or split by the
+                # spelling correction is known
+                cleaned = [clean_terms([word], self.index, self.doc_index) for word in operator.words]
+                groups = tuple(tuple(expand_term([term], self.stem_dict)) for words in cleaned for term in words)
+                window = operator.window
+                if window is None and any(len(words) != 1 for words in cleaned):
+                    # the words no longer line up with the phrase, so it only
+                    # asks for every word in the doc
+                    window = ANY_SPAN
+                # an operator none of whose words are in the index restricts nothing
+                if groups:
+                    operator_groups.append((groups, window))
+            parsed = (words, terms, expanded_terms, expanded_terms_list, tuple(operator_groups), tuple(formulas))
+            self.cache.put('terms', query, parsed)
+        return parsed
+
+    def _ranked_key(self, model, terms, expanded_terms, operators, formulas, k):
+        return model, tuple(terms), tuple(expanded_terms), operators, formulas, k, self.depth, self.bm25_model
+
+    # -----------------------------------------------------------------------------
+    # docs matching every phrase and window operator of a query
+    #
+    # @input: operators: from parse
+    # @return: sorted int array of doc ids, None if there is nothing to match
+    # -----------------------------------------------------------------------------
+    def match_operators(self, operators):
+        if not operators or self.positions is None:
+            return None
+        allowed = None
+        for groups, window in operators:
+            allowed = match_operator(self.positions, groups, window, allowed)
+        return allowed
+
+    # -----------------------------------------------------------------------------
+    # docs holding every formula of a query
+    #
+    # @input: formulas: from parse
+    #         allowed: optional sorted int array of the docs to look at
+    # @return: docs: sorted int array of the matching docs, None if there is
+    #                no formula index, formulas then restrict nothing
+    #          scores: float64 array, the summed formula scores of each doc
+    # -----------------------------------------------------------------------------
+    def match_formulas(self, formulas, allowed=None):
+        if self.formulas is None:
+            return None, None
+        docs = allowed
+        scores = None
+        for formula in formulas:
+            formula_docs, formula_scores = match_formula(self.formulas, formula, docs)
+            if scores is not None:
+                # formula_docs are a subset of docs
+                formula_scores += scores[locate(docs, formula_docs)[0]]
+            docs = formula_docs
+            scores = formula_scores
+        return docs, scores
+
+    def rank_formulas(self, docs, scores, k):
+        best = get_engine(self.doc_index).top_k(docs, scores, k)
+        return [(doc, self.doc_index.title(doc), score)
+                for doc, score in zip(docs[best].tolist(), scores[best].tolist())]
+
+    # -----------------------------------------------------------------------------
+    # rank a query with several models
+    #
+    # @input: query: query string
+    #         models: model names from query_plan.MODELS
+    #         k: number of docs the bm25 models return
+    #         executor: RequestExecutor to run the models in parallel
+    # @return: SearchResults
+    # -----------------------------------------------------------------------------
+    def search(self, query, models, k=10, executor=None):
+        query = query.strip()
+        t1 = time.perf_counter()
+        words, terms, expanded_terms, expanded_terms_list, operators, formulas = self.parse(query)
+        timings = {'terms': (time.perf_counter() - t1) * 1000}
+
+        keys = {model: self._ranked_key(model, terms, expanded_terms, operators, formulas, k) for model in models}
+        ranked = {}
+        missing = []
+        for model in models:
+            ranked[model] = self.cache.get('ranked', keys[model])
+            if ranked[model] is MISSING:
+                missing.append(model)
+        if missing:
+            doc_list = None
+            if 'bm25mod' in missing:
+                t1 = time.perf_counter()
+                doc_list = conjuctive_query(expanded_terms_list, self.index)
+                timings['conjunctive'] = (time.perf_counter() - t1) * 1000
+            t1 = time.perf_counter()
+            allowed = self.match_operators(operators)
+            if operators:
+                timings['operators'] = (time.perf_counter() - t1) * 1000
+            formula_scores = None
+            if formulas and self.formulas is not None:
+                t1 = time.perf_counter()
+                allowed, formula_scores = self.match_formulas(formulas, allowed)
+                timings['formulas'] = (time.perf_counter() - t1) * 1000
+            if formula_scores is not None and not terms:
+                for model in missing:
+                    ranked[model] = self.rank_formulas(allowed, formula_scores, k)
+            else:
+                impacts = self.impact_index if self.bm25_model == 'wand' else None
+                plan = QueryPlan(expanded_terms, self.index, self.doc_index, self.anchor_index, impacts, allowed,
+                                 expanded_terms_list, self.positions)
+                ranked.update(plan.run(missing, k=k, doc_list=doc_list, svm_weights=self.svm_weights,
+                                       depth=self.depth, executor=executor))
+                timings.update(plan.timings)
+            for model in missing:
+                self.cache.put('ranked', keys[model], ranked[model])
+        cached = [model for model in models if model not in missing]
+        return SearchResults(query, words, terms, expanded_terms, ranked, cached, timings)
+
+    # -----------------------------------------------------------------------------
+    # snippets of ranked docs
+    #
+    # @input: terms: query words to match
+    #         ranked: list of (doc, title, score)
+    #         executor: RequestExecutor to extract the snippets in parallel
+    # @return: list of (collection doc id, list of snippet lines) in ranked order
+    # -----------------------------------------------------------------------------
+    def snippets(self, terms, ranked, executor=None):
+        doc_ids = [self.doc_index.doc_id(doc) for doc, _, _ in ranked]
+        keys = [(doc_id, tuple(terms), WINDOW) for doc_id in doc_ids]
+        snippets = [self.cache.get('snippet', key) for key in keys]
+        missing = [i for i in range(len(ranked)) if snippets[i] is MISSING]
+        if not missing:
+            return list(zip(doc_ids, snippets))
+        # the query words are compiled once for every doc of the request
+        matcher = SnippetMatcher(terms, self.index, self.positions, [ranked[i][0] for i in missing])
+
+        def extract(i):
+            doc = ranked[i][0]
+            if self.texts is not None:
+                return matcher.lines(doc, self.texts.lines(doc), self.texts.line_starts(doc))
+            return matcher.lines(doc, get_html_lines(self.page(doc, ranked[i][1])))
+        if executor is not None:
+            lines = executor.map('snippet', extract, missing)
+        else:
+            lines = [extract(i) for i in missing]
+        for i, doc_lines in zip(missing, lines):
+            snippets[i] = doc_lines
+            self.cache.put('snippet', keys[i], doc_lines)
+        return list(zip(doc_ids, snippets))
+
+    # -----------------------------------------------------------------------------
+    # html of a collection page
+    #
+    # @input: doc: doc id
+    #         doc_name: name of the page, to find it when there is no doc store
+    # @return: bytes of the page
+    # -----------------------------------------------------------------------------
+    def page(self, doc, doc_name):
+        if self.documents is not None:
+            return self.documents[doc]
+        return get_html_page(doc_name)
+
+    # -----------------------------------------------------------------------------
+    # validators of a collection page for conditional requests
+    #
+    # @input: doc: doc id
+    #         doc_name: name of the page, to find it when there is no doc store
+    # @return: etag: weak ETag, the same for the plain and gzip page
+    #          last_modified: timestamp of the last change, in seconds
+    # -----------------------------------------------------------------------------
+    def page_version(self, doc, doc_name):
+        if self.documents is not None:
+            return 'W/"%s-%d"' % (self.version, doc), int(os.path.getmtime(self.documents.filename))
+        stat = os.stat(get_html_path(doc_name))
+        return 'W/"%x-%x"' % (stat.st_mtime_ns, stat.st_size), int(stat.st_mtime)
+
+    # -----------------------------------------------------------------------------
+    # file object to send a collection page from
+    #
+    # @input: doc: doc id
+    #         doc_name: name of the page, to find it when there is no doc store
+    #         compressed: True if the client accepts gzip
+    # @return: file, length, is_compressed, see DocStore.open_page
+    # -----------------------------------------------------------------------------
+    def open_page(self, doc, doc_name, compressed=False):
+        if self.documents is not None:
+            return self.documents.open_page(doc, compressed)
+        return open_html_page(doc_name, compressed)
@@ -0,0 +1,85 @@
+"""
+Frequency index stored as flat arrays in an array store file
+
+The layout is the one MemoryIndex builds in memory (every posting list end to
+end in one doc id array and one frequency array) plus the sorted lexicon, but
+it lives in a mapped file.  Looking up a term or a posting list only reads
+the mapped pages, so worker processes serving from the same file share one
+copy of the index.
+
+shared_index.py
+"""
+from array import array
+from .array_store import MappedFile, ArrayStore, write_array_store
+from .binary_index import LexiconIndex, TermEntry, POSTINGS_CACHE_SIZE
+
+
+# ---------------------------------------------------------------------------------
+# write any loaded index (dictionary from get_index or a LexiconIndex) as a
+# flat index file
+#
+# @input: filename: path of the file to write
+#         index: index to copy
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_flat_index(filename, index):
+    terms = sorted(index.keys(), key=lambda t: t.encode('utf-8'))
+    term_offsets = array('I', [0])
+    term_blob = bytearray()
+    idfs = array('d')
+    counts = array('i')
+    starts = array('q', [0])
+    docs = array('i')
+    freqs = array('i')
+    for term in terms:
+        entry = index[term]
+        term_blob.extend(term.encode('utf-8'))
+        term_offsets.append(len(term_blob))
+        idfs.append(entry['idf'])
+        counts.append(int(entry['count']))
+        for doc, freq in sorted(entry['docs'].items()):
+            docs.append(doc)
+            freqs.append(freq)
+        starts.append(len(docs))
+    write_array_store(filename, {'term_offsets': term_offsets, 'term_blob': term_blob, 'idfs': idfs,
+                                 'counts': counts, 'starts': starts, 'docs': docs, 'freqs': freqs})
+
+
+class FlatIndex(MappedFile, LexiconIndex):
+    """
+    Read only view of a flat index file, looked up the same way as a
+    BinaryIndex.  Posting lists are memoryviews into the mapped file.
+    """
+
+    def __init__(self, filename, cache_size=POSTINGS_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.filename = filename
+        self._store = ArrayStore(filename)
+        self._term_offsets = self._store['term_offsets']
+        self._term_blob = self._store['term_blob']
+        self._idfs = self._store['idfs']
+        self._counts = self._store['counts']
+        self._starts = self._store['starts']
+        self._docs = self._store['docs']
+        self._freqs = self._store['freqs']
+        self.term_count = len(self._idfs)
+
+    def close(self):
+        self._store.close()
+
+    # the entry cache is not pickled, only its size
+    def init_args(self):
+        return self.filename, self._entries.max_weight
+
+    def _term_bytes(self, num):
+        return self._term_blob[self._term_offsets[num]:self._term_offsets[num + 1]].tobytes()
+
+    def term(self, num):
+        return self._term_bytes(num).decode('utf-8')
+
+    def make_entry(self, num):
+        start = self._starts[num]
+        return TermEntry(self, self._idfs[num], self._counts[num], self._starts[num + 1] - start, start)
+
+    def read_postings(self, offset, length):
+        return self._docs[offset:offset + length], self._freqs[offset:offset + length]
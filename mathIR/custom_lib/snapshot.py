@@ -0,0 +1,177 @@
+"""
+Startup snapshot of the serving indexes
+
+The structures views.py needs (doc index, frequency and anchor indexes, stems
+and svm weights) are pickled into one file after they are built.  The file
+starts with a manifest of the size, mtime and hash of every tsv they were
+built from, the next startup checks the manifest and loads the rest of the
+file with one read, or rebuilds everything if any source has changed.
+
+File layout:
+    - magic, snapshot version, manifest length
+    - pickled manifest: {'version', 'key', 'sources': {filename: (size, mtime, sha1)}}
+    - pickled state
+
+snapshot.py
+"""
+import os
+import pickle
+import struct
+import hashlib
+
+MAGIC = b'MIRSNAP\0'
+# bump when the layout of anything stored in a snapshot changes
+SNAPSHOT_VERSION = 8
+HEADER = struct.Struct('<8sIQ')
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as in_file:
+        block = in_file.read(HASH_BLOCK_SIZE)
+        while block:
+            sha.update(block)
+            block = in_file.read(HASH_BLOCK_SIZE)
+    return sha.hexdigest()
+
+
+# ---------------------------------------------------------------------------------
+# describe the current version of each source file
+#
+# @input: filenames: list of paths
+# @return: dictionary of path -> (size, mtime in ns, sha1), None for missing files
+# ---------------------------------------------------------------------------------
+def get_manifest(filenames):
+    manifest = {}
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            manifest[filename] = None
+            continue
+        manifest[filename] = (stat.st_size, stat.st_mtime_ns, file_hash(filename))
+    return manifest
+
+
+# ---------------------------------------------------------------------------------
+# short id of the current version of the source files, from their size and
+# mtime only so it is cheap enough to compute on every load
+#
+# @input: filenames: list of paths
+#         key: anything else the state depends on (e.g. the index mode)
+# @return: hex string, changes when any source or the key changes
+# ---------------------------------------------------------------------------------
+def sources_version(filenames, key=None):
+    sha = hashlib.sha1(repr(key).encode('utf-8'))
+    for filename in sorted(filenames):
+        try:
+            stat = os.stat(filename)
+            sha.update(('%s:%d:%d;' % (filename, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        except FileNotFoundError:
+            sha.update(('%s:missing;' % filename).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------------
+# check the source files against a stored manifest, files are only hashed
+# when their size matches but their mtime does not.  A file whose mtime
+# changed but whose hash did not gets its new mtime in the manifest, so it is
+# not hashed again once the manifest is written back.
+#
+# @input: manifest: dictionary from get_manifest, updated in place
+#         filenames: list of paths the snapshot should have been built from
+# @return: True if every source is unchanged
+# ---------------------------------------------------------------------------------
+def manifest_matches(manifest, filenames):
+    if sorted(manifest.keys()) != sorted(filenames):
+        return False
+    for filename, stored in manifest.items():
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            if stored is not None:
+                return False
+            continue
+        if stored is None or stat.st_size != stored[0]:
+            return False
+        if stat.st_mtime_ns != stored[1]:
+            if file_hash(filename) != stored[2]:
+                return False
+            manifest[filename] = (stored[0], stat.st_mtime_ns, stored[2])
+    return True
+
+
+def read_manifest(snapshot_file):
+    header = snapshot_file.read(HEADER.size)
+    if len(header) != HEADER.size:
+        return None
+    magic, version, manifest_length = HEADER.unpack(header)
+    if magic != MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    return pickle.loads(snapshot_file.read(manifest_length))
+
+
+# ---------------------------------------------------------------------------------
+# write a snapshot file
+#
+# @input: filename: path of the snapshot
+#         manifest: manifest dictionary
+#         state: the state to pickle, or the bytes of the already pickled
+#                state if pickled is True
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_snapshot(filename, manifest, state, pickled=False):
+    manifest_bytes = pickle.dumps(manifest, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_name = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_name, 'wb') as out_file:
+        out_file.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(manifest_bytes)))
+        out_file.write(manifest_bytes)
+        if pickled:
+            out_file.write(state)
+        else:
+            pickle.dump(state, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_name, filename)
+
+
+# ---------------------------------------------------------------------------------
+# load the serving state from a snapshot, or build it and write a new snapshot
+# if the snapshot is missing, from another version, or any source changed
+#
+# @input: filename: path of the snapshot
+#         sources: list of paths the state is built from
+#         build: function with no arguments that builds the state
+#         key: anything else the state depends on (e.g. the index mode)
+# @return: the state
+# ---------------------------------------------------------------------------------
+def load_snapshot(filename, sources, build, key=None):
+    state_bytes = None
+    try:
+        with open(filename, 'rb') as snapshot_file:
+            manifest = read_manifest(snapshot_file)
+            stored = dict(manifest['sources']) if manifest is not None else None
+            if manifest is not None and manifest['key'] == key and \
+                    manifest_matches(manifest['sources'], sources):
+                state_bytes = snapshot_file.read()
+                state = pickle.loads(state_bytes)
+        if state_bytes is not None:
+            if manifest['sources'] != stored:
+                # only mtimes changed, store them so the next start does not hash
+                try:
+                    write_snapshot(filename, manifest, state_bytes, pickled=True)
+                except OSError as e:
+                    print(e)
+            return state
+    except Exception as e:
+        # a missing, truncated or incompatible snapshot is rebuilt
+        if not isinstance(e, FileNotFoundError):
+            print(filename, e)
+
+    print(filename, 'out of date creating...')
+    state = build()
+    manifest = {'version': SNAPSHOT_VERSION, 'key': key, 'sources': get_manifest(sources)}
+    try:
+        write_snapshot(filename, manifest, state)
+    except OSError as e:
+        print(e)
+    return state
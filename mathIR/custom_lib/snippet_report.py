@@ -0,0 +1,122 @@
+"""
+Benchmark the snippet engine against the get_lines it replaced
+
+The old get_lines built the replacement dictionary and the alternation regex
+again for every line of every result and counted each query word in each
+line with str.count.  The new one compiles the query once per request and
+matches each line once (see snippets.py), reading only the lines the
+positional index points to when there is one.  Both are given the lines of
+the longest pages in the text store, the time to read them is left out, and
+the report gives the ms of a request of that many pages for each sample
+query.
+
+usage:
+    python -m mathIR.custom_lib.snippet_report [<pages>] [<repeats>] [<mode>]
+
+snippet_report.py
+"""
+import re
+import sys
+import time
+from .utils import load_index, get_text_store, get_pos_index
+from .snippets import SnippetMatcher
+from .intersect_report import SAMPLE_QUERIES
+
+
+# ---------------------------------------------------------------------------------
+# the get_lines this benchmark compares against, kept as it was except for the
+# line[:4] test that skipped every line with text, so it does the work it was
+# written to do
+# ---------------------------------------------------------------------------------
+def get_lines(terms, index, doc_text):
+    terms_dict = {}
+    for x in terms:
+        terms_dict[x] = "<b>" + x + "</b>"
+    matched_lines = []
+    try:
+        for line in doc_text:
+            if line:
+                size = len(line.split())
+                if size <= 2:
+                    continue
+            else:
+                continue
+
+            score = 0
+            for t in terms:
+                score += line.count(t) * int(index[t]['idf']) / size
+            rep = dict((re.escape(k), v) for k, v in terms_dict.items())
+            pattern = re.compile("|".join(rep.keys()))
+            temp_line = pattern.sub(lambda m: rep[re.escape(m.group(0))], line)
+
+            if line != temp_line:
+                matched_lines.append((temp_line, score))
+    except KeyError as e:
+        print(e)
+    except Exception as e2:
+        print(e2)
+    if len(matched_lines) == 0:
+        return doc_text[:5]
+
+    return [y[0] for y in sorted(matched_lines[0:5],  key=lambda z: z[1], reverse=True)][0:5]
+
+
+def time_old(terms, index, pages, repeats):
+    t1 = time.perf_counter()
+    for _ in range(repeats):
+        for _, doc_lines, _ in pages:
+            get_lines(terms, index, doc_lines)
+    return (time.perf_counter() - t1) * 1000 / repeats
+
+
+def time_new(terms, index, positions, pages, repeats):
+    t1 = time.perf_counter()
+    for _ in range(repeats):
+        matcher = SnippetMatcher(terms, index, positions, [doc for doc, _, _ in pages])
+        for doc, doc_lines, line_starts in pages:
+            matcher.lines(doc, doc_lines, line_starts if positions is not None else None)
+    return (time.perf_counter() - t1) * 1000 / repeats
+
+
+# ---------------------------------------------------------------------------------
+# print the snippet time of the old and new engine on each sample query
+#
+# @input: page_count: number of pages in a request, the longest in the store
+#         repeats: runs of each query
+#         mode: index mode given to load_index
+# @return: list of (query, old ms, new ms, new ms with positions)
+# ---------------------------------------------------------------------------------
+def report(page_count=10, repeats=5, mode='binary'):
+    index = load_index(mode)
+    texts = get_text_store()
+    if texts is None:
+        return []
+    positions = get_pos_index()
+    longest = texts.sizes().argsort()[::-1][:page_count].tolist()
+    pages = [(doc, texts.lines(doc), texts.line_starts(doc)) for doc in longest]
+    print('{} pages, {} lines, {:.0f} KB'.format(len(pages), sum(len(lines) for _, lines, _ in pages),
+                                                 sum(texts.sizes()[longest]) / 1024))
+    print('{:32} {:>10} {:>10} {:>12}'.format('query', 'old ms', 'new ms', 'positions ms'))
+    results = []
+    for words in SAMPLE_QUERIES:
+        terms = [word for word in words if word in index]
+        if not terms:
+            print('{:32} not in the index'.format(' '.join(words)))
+            continue
+        old_ms = time_old(terms, index, pages, repeats)
+        new_ms = time_new(terms, index, None, pages, repeats)
+        positions_ms = time_new(terms, index, positions, pages, repeats) if positions is not None else float('nan')
+        print('{:32} {:>10.2f} {:>10.2f} {:>12.2f}'.format(' '.join(terms)[:32], old_ms, new_ms, positions_ms))
+        results.append((terms, old_ms, new_ms, positions_ms))
+    return results
+
+
+def main(args):
+    page_count = int(args[0]) if args else 10
+    repeats = int(args[1]) if len(args) > 1 else 5
+    mode = args[2] if len(args) > 2 else 'binary'
+    report(page_count, repeats, mode)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,205 @@
+"""
+Snippets of the ranked docs
+
+A SnippetMatcher is built once per request: the query words become one
+compiled regex, an alternation of the words ending at a word boundary, and
+each word gets its idf as weight.  The regex is matched against lower cased
+text and the word boundary before a match is checked on the matches found,
+so re can skip ahead to the first letters of the words instead of trying
+every position.  For each doc:
+    - the lines to look at come from the positional index where there is one,
+      the positions of the query words in the doc are looked up in the line
+      starts of the text store (see text_store.py) and only the lines holding
+      a query word are matched, otherwise the whole text is matched in one
+      pass and the matches are shared out to their lines
+    - a line longer than WINDOW words is cut to the window of WINDOW words
+      with the most weight, found by sliding over the matches of the line once
+    - a window scores the idf of every distinct query word in it, then the
+      number of matches
+The SNIPPET_LINES best windows are the snippet, in score order, escaped
+for html with the query words in bold.
+
+snippets.py
+"""
+import re
+import html
+from bisect import bisect_right
+import numpy as np
+from .positions import POSITION_BITS, POSITION_MASK
+from .intersect import union
+
+SNIPPET_LINES = 5
+WINDOW = 30
+MIN_WORDS = 3
+WORD = re.compile(r'\S+')
+
+
+class SnippetMatcher:
+    """
+    Query words of one request compiled once, matched against any number of
+    docs, only the positions of docs are read if they are given.
+        lines(doc, doc_lines, line_starts): snippet lines of one doc
+    """
+
+    def __init__(self, terms, index, positions=None, docs=None):
+        self.weights = {}
+        for term in terms:
+            entry = index.get(term)
+            self.weights[term] = float(entry['idf']) if entry is not None else 0.0
+        self.pattern = None
+        self.any_case = None
+        if self.weights:
+            # longest first so a word is not cut short by one it starts with
+            words = '|'.join(re.escape(word) for word in sorted(self.weights, key=len, reverse=True))
+            self.pattern = re.compile(r'(?:' + words + r')\b')
+            self.any_case = re.compile(r'\b(?:' + words + r')\b', re.IGNORECASE)
+        self.keys = None
+        if positions is not None and self.weights:
+            allowed = np.unique(np.asarray(docs, dtype=np.int64)) if docs is not None else None
+            self.keys = union([positions.term_keys(term, allowed) for term in self.weights])
+
+    # -----------------------------------------------------------------------------
+    # query words in a text
+    #
+    # @input: text: string
+    # @return: list of (start char, lower cased word) of each match
+    # -----------------------------------------------------------------------------
+    def find(self, text):
+        lower = text.lower()
+        if len(lower) != len(text):
+            # a few characters change length when lower cased
+            return [(match.start(), match.group(0).lower()) for match in self.any_case.finditer(text)]
+        matches = []
+        for match in self.pattern.finditer(lower):
+            start = match.start()
+            if start and (lower[start - 1].isalnum() or lower[start - 1] == '_'):
+                continue
+            matches.append((start, match.group(0)))
+        return matches
+
+    # -----------------------------------------------------------------------------
+    # matches of the query words on each line of a doc
+    #
+    # @input: doc: doc id
+    #         doc_lines: list of the lines of the doc
+    #         line_starts: word position each line starts at, or None
+    # @return: list of (line number, matches of the line from find), lines
+    #          without matches left out
+    # -----------------------------------------------------------------------------
+    def line_matches(self, doc, doc_lines, line_starts=None):
+        if self.keys is not None and line_starts is not None:
+            start, stop = np.searchsorted(self.keys, (doc << POSITION_BITS, (doc + 1) << POSITION_BITS))
+            doc_positions = self.keys[start:stop] & POSITION_MASK
+            nums = np.unique(np.searchsorted(line_starts, doc_positions, side='right') - 1).tolist()
+            return [(num, self.find(doc_lines[num])) for num in nums]
+
+        found = []
+        num = -1
+        line_start = 0
+        next_start = 0
+        for start, word in self.find('\n'.join(doc_lines)):
+            while start >= next_start:
+                num += 1
+                line_start = next_start
+                next_start += len(doc_lines[num]) + 1
+                line = None
+            if line is None:
+                line = []
+                found.append((num, line))
+            line.append((start - line_start, word))
+        return found
+
+    # -----------------------------------------------------------------------------
+    # best window of a line
+    #
+    # @input: line: string
+    #         matches: the matches of the line from find
+    # @return: (score, matches, start char, end char) of the window, None if
+    #          the line holds no query word or is too short
+    # -----------------------------------------------------------------------------
+    def best_window(self, line, matches):
+        if not matches:
+            return None
+        word_starts = [match.start() for match in WORD.finditer(line)]
+        if len(word_starts) < MIN_WORDS:
+            return None
+        if len(word_starts) <= WINDOW:
+            score = sum(self.weights[word] for word in set(word for _, word in matches))
+            return score, len(matches), 0, len(line)
+
+        # word number of each match, then the window of WINDOW words from the
+        # match at left with the most weight
+        match_words = [bisect_right(word_starts, start) - 1 for start, _ in matches]
+        counts = {}
+        score = 0.0
+        best = None
+        left = 0
+        for right in range(len(matches)):
+            word = matches[right][1]
+            if counts.get(word, 0) == 0:
+                score += self.weights[word]
+            counts[word] = counts.get(word, 0) + 1
+            while match_words[right] - match_words[left] >= WINDOW:
+                word = matches[left][1]
+                counts[word] -= 1
+                if counts[word] == 0:
+                    score -= self.weights[word]
+                left += 1
+            # rounded so the adds and takes leave no error between equal windows
+            if best is None or (round(score, 9), right - left + 1) > best[:2]:
+                best = (round(score, 9), right - left + 1, left, right)
+
+        # center the matches of the best window in WINDOW words
+        score, count, left, right = best
+        span = match_words[right] - match_words[left] + 1
+        first = max(0, min(match_words[left] - (WINDOW - span) // 2, len(word_starts) - WINDOW))
+        end = word_starts[first + WINDOW] if first + WINDOW < len(word_starts) else len(line)
+        return score, count, word_starts[first], end
+
+    # -----------------------------------------------------------------------------
+    # html of part of a line with the query words in bold
+    # -----------------------------------------------------------------------------
+    def highlight(self, text):
+        if self.any_case is None:
+            return html.escape(text)
+        out = []
+        last = 0
+        for match in self.any_case.finditer(text):
+            out.append(html.escape(text[last:match.start()]))
+            out.append('<b>' + html.escape(match.group(0)) + '</b>')
+            last = match.end()
+        out.append(html.escape(text[last:]))
+        return ''.join(out)
+
+    # -----------------------------------------------------------------------------
+    # snippet of one doc
+    #
+    # @input: doc: doc id
+    #         doc_lines: list of the lines of the doc
+    #         line_starts: word position each line starts at, None to read
+    #                      every line
+    # @return: list of at most SNIPPET_LINES html strings, the first lines of
+    #          the doc if no line holds a query word
+    # -----------------------------------------------------------------------------
+    def lines(self, doc, doc_lines, line_starts=None):
+        windows = []
+        if self.pattern is not None:
+            for num, matches in self.line_matches(doc, doc_lines, line_starts):
+                window = self.best_window(doc_lines[num], matches)
+                if window is not None:
+                    windows.append((window[0], window[1], -num, window[2], window[3]))
+        if not windows:
+            snippet = []
+            for line in doc_lines:
+                words = line.split()
+                if len(words) >= MIN_WORDS:
+                    snippet.append(html.escape(' '.join(words[:WINDOW])) + (' ...' if len(words) > WINDOW else ''))
+                    if len(snippet) == SNIPPET_LINES:
+                        break
+            return snippet
+        snippet = []
+        for _, _, num, start, end in sorted(windows, reverse=True)[:SNIPPET_LINES]:
+            line = doc_lines[-num]
+            snippet.append(('... ' if start > 0 else '') + self.highlight(line[start:end].strip()) +
+                           (' ...' if end < len(line) else ''))
+        return snippet
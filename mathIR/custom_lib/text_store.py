@@ -0,0 +1,90 @@
+"""
+Plain text of the documents for snippets
+
+index_collection already has the text of every document when it indexes it,
+so it keeps the lines of that text and writes them to an array store file
+(see array_store.py): the text of every doc as utf-8, one line per line of
+the page, blank lines dropped, and an offset table giving where the text of
+each doc starts.  The file is mapped read only, getting the lines of a result
+is a slice of the map and a decode, no page is opened or parsed per query.
+
+The store also has the word position of the first word of every line, in
+the numbering of the positional index, so the positions of the query words
+in a doc give the lines they are on without reading the text.
+
+text_store.py
+"""
+from array import array
+from itertools import accumulate
+import numpy as np
+from .array_store import MappedFile, ArrayStore, StringTable, write_array_store, pack_strings
+
+
+# ---------------------------------------------------------------------------------
+# the lines of a document text as stored
+#
+# @input: text: text of the page, from get_text()
+# @return: list of the stripped non blank lines
+# ---------------------------------------------------------------------------------
+def text_lines(text):
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+
+# ---------------------------------------------------------------------------------
+# write a text store file
+#
+# @input: filename: path of the file to write
+#         texts: list of the text_lines of each doc indexed by doc id
+#         line_words: optional list of the number of indexed words on each
+#                     line of each doc
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_text_store(filename, texts, line_words=None):
+    offsets, blob = pack_strings(['\n'.join(lines) for lines in texts], 'Q')
+    arrays = {'offsets': offsets, 'blob': blob}
+    if line_words is not None:
+        line_offsets = array('Q', [0])
+        line_starts = array('I')
+        for counts in line_words:
+            # a doc without lines has no line starts
+            if counts:
+                line_starts.extend(accumulate([0] + counts[:-1]))
+            line_offsets.append(len(line_starts))
+        arrays['line_offsets'] = line_offsets
+        arrays['line_starts'] = line_starts
+    write_array_store(filename, arrays)
+
+
+class TextStore(MappedFile):
+    """
+    Read only text store mapped from a file written by write_text_store.
+        lines(doc): list of the lines of a doc
+        line_starts(doc): int array of the word position each line of a doc
+            starts at, None if the store was written without them
+        sizes(): int array of the text bytes of every doc
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._store = ArrayStore(filename)
+        self._texts = StringTable(self._store['offsets'], self._store['blob'])
+        self._line_offsets = None
+        self._line_starts = None
+        if 'line_starts' in self._store:
+            self._line_offsets = self._store['line_offsets']
+            self._line_starts = np.frombuffer(self._store['line_starts'], dtype=np.uint32)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def lines(self, doc):
+        text = self._texts[doc]
+        return text.split('\n') if text else []
+
+    def line_starts(self, doc):
+        if self._line_starts is None:
+            return None
+        return self._line_starts[self._line_offsets[doc]:self._line_offsets[doc + 1]]
+
+    def sizes(self):
+        return np.diff(np.frombuffer(self._store['offsets'], dtype=np.uint64))
@@ -4,7 +4,7 @@ Utility files used to run Pony Poratal app
     - create indexes from tsv
     - clean raw html text
     - helper functions fo query suggestion and expansion
-    - document summary and query term highlighting
+    - page text for the document summaries, see snippets.py
 utils.py
 @author Aaron Smith, Grant Larsen
 11/26/2019
@@ -22,15 +22,38 @@ from nltk.tokenize import word_tokenize
 INDEX_DIR = 'E:\_Projects\IR_P3\mysite\mathIR\static\idexTSV'
 from unidecode import unidecode
 from nltk.tokenize import word_tokenize
-from math import sqrt
 import tarfile
+from .binary_index import BinaryIndex, convert_tsv_index, old_doc_ids
+from .lazy_index import TsvIndex
+from .memory_index import MemoryIndex
+from .shared_index import FlatIndex, write_flat_index
+from .doc_table import DocTable, write_doc_table
+from .link_graph import LinkGraph, write_link_graph
+from .bm25 import get_engine
+from .wand import ImpactIndex, write_impact_index
+from .intersect import intersect, union, get_doc_ids
+from .positions import PositionalIndex
+from .text_store import TextStore, text_lines
+from .doc_store import DocStore
+import numpy as np
 INDEX_FILENAME = 'wiki_index.tsv'
+BINARY_INDEX_FILENAME = 'wiki_index.bin'
+FLAT_INDEX_FILENAME = 'wiki_index.flat'
 DOC_INDEX_FILENAME = 'doc_index.tsv'
-LINKED_FROM_INDEX_FILENAME = 'linked_from_index.tsv'
 PAGE_RANK_INDEX_FILENAME = 'page_rank_index.tsv'
 ANCHOR_TEXT_INDEX_FILENAME = 'anchor_text_index.tsv'
+ANCHOR_TEXT_BINARY_INDEX_FILENAME = 'anchor_text_index.bin'
+ANCHOR_TEXT_FLAT_INDEX_FILENAME = 'anchor_text_index.flat'
 STEM_FILE_NAME = "wiki_stems.tsv"
 SVM_RESULTS_FILE_NAME = 'svm_weights.tsv'
+SNAPSHOT_FILE_NAME = 'serving.snapshot'
+DOC_TABLE_FILENAME = 'doc_table.arrays'
+LINK_GRAPH_FILENAME = 'link_graph.arrays'
+IMPACT_INDEX_FILENAME = 'wiki_index.impacts'
+POSITIONAL_INDEX_FILENAME = 'wiki_positions.bin'
+FORMULA_INDEX_FILENAME = 'formula_index.bin'
+TEXT_STORE_FILENAME = 'doc_text.arrays'
+DOC_STORE_FILENAME = 'doc_store.bin'
 COLLECTION_DIR = "mathIR\static\mathIR\MathTagArticles"
 HTML_DIR = "mathIR\static\collectionDocs\html"
 HTML_DIR = "mathIR\static\collectionDocs\html"
@@ -47,186 +70,102 @@ def get_translation_dict():
 TRANSLATION_DICT = get_translation_dict()
 
 
-def intof(x):
-    x = x.split('-')
-    return int(x[0].zfill(2) + x[1].zfill(4))
+# ---------------------------------------------------------------------------------
+# lines of the text of an html page, only used when the collection was
+# indexed without a text store
+#
+# @input: page: html of the page
+# @return: list of the lines of the page text
+# ---------------------------------------------------------------------------------
+def get_html_lines(page):
+    return text_lines(BeautifulSoup(page, 'html.parser').get_text())
+
 
 # ---------------------------------------------------------------------------------
-# Creates document summaries for each related document and highlights
-# any terms that match the query.  Summaries are top 5 lines after scoring each line
-# from its normalized tf*idf
+# html of a page from the extracted collection, only used when there is no
+# doc store
 #
-# @input: term: the list of query terms used by the retrieval algorithm
-#         idf_list: list of idfs calculated by the retrieval algorithm
-#         episode: number of the episode used to get the raw html
-# @return: matched_lines: top 5 of line of the doc sum
-# ---------------------------------------------------------------------------------
-def get_lines(terms, index, doc_id, doc_name):
-    '''
-    doc_split = doc_id.split('-')
-    tar_num = doc_split[0]
-    f_num = int(doc_split[1])
-    tpath = "wpmath"+tar_num.zfill(7)
-    tar = tarfile.open(os.path.join(COLLECTION_DIR, tpath + ".tar.bz2"), 'r:bz2')
-    html_file = ''
+# @input: doc_name: name of the page in HTML_DIR
+# @return: bytes of the page
+# ---------------------------------------------------------------------------------
+def get_html_page(doc_name):
+    with open(get_html_path(doc_name), 'rb') as html_page:
+        return html_page.read()
 
-    try:
-        html_file = tar.getmember(tpath + "/" + doc_name + ".html")
-        f = tar.extractfile(html_file)
-    except KeyError as e:
-        print(e, doc_name)
-    soup = BeautifulSoup(f.read(), 'html.parser')
-
-    '''
-    html = open(os.path.join(HTML_DIR, doc_name + ".html"))
-    print(html)
-    soup = BeautifulSoup(html, 'html.parser')
-    doc_text = soup.get_text().split('\n')
-
-    terms_dict = {}
-    for x in terms:
-        terms_dict[x] = "<b>" + x + "</b>"
-    matched_lines = []
-    try:
-        for line in doc_text:
-            if line:
-                size = len(line.split())
-                if size <= 2 or line[:4]:
-                    continue
-            else:
-                continue
 
-            score = 0
-            for t in terms:
-                score += line.count(t) * int(index[t]['idf']) / size
-            rep = dict((re.escape(k), v) for k, v in terms_dict.items())
-            pattern = re.compile("|".join(rep.keys()))
-            temp_line = pattern.sub(lambda m: rep[re.escape(m.group(0))], line)
+def get_html_path(doc_name):
+    return os.path.join(HTML_DIR, doc_name + ".html")
 
-            if line != temp_line:
-                matched_lines.append((temp_line, score))
-    except KeyError as e:
-        print(e)
-    except Exception as e2:
-        print(e2)
-    if len(matched_lines) == 0:
-        return doc_text[:5]
-    html.close()
 
-    return [y[0] for y in sorted(matched_lines[0:5],  key=lambda z: z[1], reverse=True)][0:5]
+# ---------------------------------------------------------------------------------
+# file object to send a page of the extracted collection from, a page with a
+# .gz next to it is sent compressed to clients that accept gzip
+#
+# @input: doc_name: name of the page in HTML_DIR
+#         compressed: True if the client accepts gzip
+# @return: file: file object of the page
+#          length: bytes to read from it
+#          is_compressed: True if file gives the gzip compressed page
+# ---------------------------------------------------------------------------------
+def open_html_page(doc_name, compressed=False):
+    path = get_html_path(doc_name)
+    if compressed and os.path.exists(path + '.gz'):
+        return open(path + '.gz', 'rb'), os.path.getsize(path + '.gz'), True
+    return open(path, 'rb'), os.path.getsize(path), False
 
 
+# ---------------------------------------------------------------------------------
+# docs containing every query word, a doc matches a word if it contains any of
+# the word's expanded variants
+#
+# @input: queries: list of the expanded variants of each query word
+#         index: frequency index
+# @return: list of doc ids in increasing order
+# ---------------------------------------------------------------------------------
 def conjuctive_query(queries, index):
-    lists = []
-    for terms_list in queries:
-        temp_list = []
-        for term in terms_list:
-            temp_list += index[term]['docs']
-        lists.append(sorted([y for y in set(temp_list)], key=lambda y: intof(y)))
-    lists = sorted([x for x in lists], key=lambda x: len(x), reverse=True)
-    list1 = lists.pop()
-    good_skips = 0
-    bad_skips = 0
-    matches = []
-    while lists:
-        ptr1 = 0
-        ptr2 = 0
-        matches = []
-        list2 = lists.pop()
-        skip1 = int(sqrt(len(list1))) // 2
-        skip2 = int(sqrt(len(list2))) // 2
-        while True:
-            try:
-                doc1 = intof(list1[ptr1])
-                doc2 = intof(list2[ptr2])
-                if doc1 == doc2:
-                    matches.append(list1[ptr1])
-                    ptr1 += 1
-                    ptr2 += 1
-                else:
-                    if doc1 < doc2:
-                        if skip1 > 2 and ptr1 % skip1 == 0 and ptr1 + skip1 < len(list1):
-                            good_skips += 1
-                            ptr1 += skip1
-                            doc1 = intof(list1[ptr1])
-
-                            if doc1 > doc2:
-                                good_skips -= 1
-                                bad_skips += 1
-                                ptr1 -= (skip1 - 1) if (doc1 - doc2) > (skip1 - 1) else (doc1 - doc2)
-                        else:
-                            ptr1 += 1
-
-                    else:
-                        if skip2 > 2 and ptr2 % skip2 == 0 and ptr2 + skip2 < len(list2):
-                            good_skips += 1
-                            ptr2 += skip2
-                            doc2 = intof(list2[ptr2])
-                            if doc2 > doc1:
-                                good_skips -= 1
-                                bad_skips += 1
-                                ptr2 -= (skip2 - 1) if (doc2 - doc1) > (skip2 - 1) else (doc2 - doc1)
-                        else:
-                            ptr2 += 1
-            except IndexError as e:
-                break
-        list1 = matches
-    return matches
-
-
-def rank_pages(doc_index):
-    page_count = len(doc_index)
-    link_total = 0
-    docs_to_index = {}
-    ind = 0
-    for doc in doc_index:
-        link_total += doc_index[doc]['links']
-        docs_to_index[doc] = ind
-        ind += 1
-    prev_ranks = [len(doc_index[doc]['linked_from'])/link_total for doc in doc_index]
+    if not queries:
+        return []
+    return intersect([union([get_doc_ids(index, term) for term in terms_list]) for terms_list in queries]).tolist()
+
+
+# ---------------------------------------------------------------------------------
+# compute the page rank of every document from the link graph, each iteration
+# spreads a document's rank over the documents linking to it in one pass over
+# the reverse adjacency, documents without links spread it over every document
+#
+# @input: graph: LinkGraph
+#         filename: tsv to write the ranks to, the page rank tsv of INDEX_DIR
+#                   if None
+# @return: new_ranks: list of page ranks indexed by doc id
+# ---------------------------------------------------------------------------------
+def rank_pages(graph, filename=None):
+    page_count = len(graph)
+    in_degree = graph.in_degree
+    has_links = in_degree > 0
+    prev_ranks = in_degree / graph.edge_count
     default_value = PAGE_RANK_PARAM / page_count
 
     err = 1
-    new_ranks = []
+    new_ranks = prev_ranks
     while err > 0.001:
-        new_ranks = [default_value]*page_count
-
-        for doc in doc_index:
-            current_ind = docs_to_index[doc]
-            linked_from = doc_index[doc]['linked_from']
-            num_from = len(linked_from)
-            if num_from > 0:
-                to_add= (1 - PAGE_RANK_PARAM) * prev_ranks[current_ind] / num_from
-                for link in linked_from:
-                    from_ind = docs_to_index[link]
-                    new_ranks[from_ind] += to_add
-            else:
-                to_add = (1 - PAGE_RANK_PARAM) * prev_ranks[current_ind] / page_count
-                for page in doc_index:
-                    from_ind = docs_to_index[page]
-                    new_ranks[from_ind] += to_add
-        err = vector_diff(new_ranks, prev_ranks)
+        shares = np.zeros(page_count)
+        shares[has_links] = (1 - PAGE_RANK_PARAM) * prev_ranks[has_links] / in_degree[has_links]
+        new_ranks = np.bincount(graph.reverse, weights=np.repeat(shares, in_degree), minlength=page_count)
+        new_ranks += default_value + (1 - PAGE_RANK_PARAM) * prev_ranks[~has_links].sum() / page_count
+        err = np.abs(new_ranks - prev_ranks).sum()
         print(err)
         prev_ranks = new_ranks
+    new_ranks = new_ranks.tolist()
 
-    fn = PAGE_RANK_INDEX_FILENAME
+    fn = filename if filename is not None else os.path.join(INDEX_DIR, PAGE_RANK_INDEX_FILENAME)
     with open(fn, 'w', newline='', encoding='utf-8') as output_file:
         writer = csv.writer(output_file, delimiter='\t')
-        for key in docs_to_index:
-            line = [key, new_ranks[docs_to_index[key]]]
+        for key in range(page_count):
+            line = [key, new_ranks[key]]
             writer.writerow(line)
     return new_ranks
 
 
-def vector_diff(v1, v2):
-    if len(v1) != len(v2):
-        return 'this shouldnt happen'
-    diff = 0
-    for ind in range(0, len(v1)):
-        diff += abs(v1[ind] - v2[ind])
-    return diff
-
-
 def get_svm_weights():
     weights = []
     fn = os.path.join(INDEX_DIR, SVM_RESULTS_FILE_NAME)
@@ -238,29 +177,69 @@ def get_svm_weights():
 
 
 # ---------------------------------------------------------------------------------
-# create an index from a tsv with the position of words in the document
+# open the positional index written by index_collection
 #
-# @input: filename: tsv of positions
-# @output: index: dictionary
+# @input: filename: name of the positional index in INDEX_DIR
+# @output: index: PositionalIndex, None if the collection was indexed without
+#          positions or with an older format, phrase and window operators
+#          are then ignored
 # ---------------------------------------------------------------------------------
-def get_pos_index(filename):
-    index = {}
-    with open('ponyportal\static\ponyportal\\' + filename, 'r') as index_file:
-        line = index_file.readline()
-        while line:
-            line = line.split('\t')
-            posting_list = line[1:-1]
-            posting_dict = {}
-            for posting in posting_list:
-                posting = posting.split(':')
-                try:
-                    posting_dict[int(posting[0])].append(int(posting[1]))
-                except KeyError:
-                    posting_dict[int(posting[0])] = [int(posting[1])]
-            index[line[0]] = posting_dict
+def get_pos_index(filename=POSITIONAL_INDEX_FILENAME):
+    filename = os.path.join(INDEX_DIR, filename)
+    if not os.path.exists(filename):
+        print(filename, 'not found, phrase queries are off')
+        return None
+    try:
+        return PositionalIndex(filename)
+    except ValueError as e:
+        print(e, '- re-run index_collection, phrase queries are off')
+        return None
+
+
+# ---------------------------------------------------------------------------------
+# open the formula index written by index_collection
+#
+# @input: None
+# @output: index: BinaryIndex of formula terms, see formulas.py, None if the
+#          collection was indexed without it, formula queries then match
+#          nothing
+# ---------------------------------------------------------------------------------
+def get_formula_index():
+    filename = os.path.join(INDEX_DIR, FORMULA_INDEX_FILENAME)
+    if not os.path.exists(filename):
+        print(filename, 'not found, formula queries are off')
+        return None
+    return BinaryIndex(filename)
 
-            line = index_file.readline()
-    return index
+
+# ---------------------------------------------------------------------------------
+# open the document text store written by index_collection
+#
+# @input: None
+# @output: store: TextStore, None if the collection was indexed without it,
+#          snippets are then read from the html pages
+# ---------------------------------------------------------------------------------
+def get_text_store():
+    filename = os.path.join(INDEX_DIR, TEXT_STORE_FILENAME)
+    if not os.path.exists(filename):
+        print(filename, 'not found, snippets read the html pages')
+        return None
+    return TextStore(filename)
+
+
+# ---------------------------------------------------------------------------------
+# open the doc store written by index_collection or build_doc_store
+#
+# @input: None
+# @output: store: DocStore, None if there is none, pages are then read from
+#          HTML_DIR
+# ---------------------------------------------------------------------------------
+def get_doc_store():
+    filename = os.path.join(INDEX_DIR, DOC_STORE_FILENAME)
+    if not os.path.exists(filename):
+        print(filename, 'not found, pages are read from', HTML_DIR)
+        return None
+    return DocStore(filename)
 
 
 # ---------------------------------------------------------------------------------
@@ -306,7 +285,7 @@ def get_index(anchor=False):
             posting_dict = {'docs': {}}
             for posting in posting_list:
                 posting = posting.split(':')
-                posting_dict['docs'][posting[0]] = int(posting[1])
+                posting_dict['docs'][int(posting[0])] = int(posting[1])
             posting_dict['count'] = int(line[2])
             posting_dict['idf'] = float(line[1])
             index[line[0]] = posting_dict
@@ -315,27 +294,159 @@ def get_index(anchor=False):
     return index
 
 
-def get_index2():
-    index = {}
-    filename = os.path.join(INDEX_DIR, INDEX_FILENAME)
+# ---------------------------------------------------------------------------------
+# open the binary version of the frequency index, the binary file is built from
+# the tsv if it is missing or older than the tsv
+#
+# @input: anchor: open the anchor text index instead of the word index
+# @output: index: BinaryIndex, looked up the same way as the get_index dictionary
+# ---------------------------------------------------------------------------------
+def get_binary_index(anchor=False):
+    if anchor:
+        tsv_filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_INDEX_FILENAME)
+        filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_BINARY_INDEX_FILENAME)
+    else:
+        tsv_filename = os.path.join(INDEX_DIR, INDEX_FILENAME)
+        filename = os.path.join(INDEX_DIR, BINARY_INDEX_FILENAME)
 
-    with open(filename, 'r', encoding='utf-8') as index_file:
+    if not os.path.exists(filename) or \
+            (os.path.exists(tsv_filename) and os.path.getmtime(tsv_filename) > os.path.getmtime(filename)):
+        print(filename, 'out of date creating...')
+        convert_tsv_index(tsv_filename, filename)
+    return BinaryIndex(filename)
+
+
+# ---------------------------------------------------------------------------------
+# open the tsv frequency index without reading the postings, only the term,
+# idf and doc count of each line are loaded
+#
+# @input: anchor: open the anchor text index instead of the word index
+# @output: index: TsvIndex, looked up the same way as the get_index dictionary
+# ---------------------------------------------------------------------------------
+def get_lazy_index(anchor=False):
+    if anchor:
+        filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_INDEX_FILENAME)
+    else:
+        filename = os.path.join(INDEX_DIR, INDEX_FILENAME)
+    return TsvIndex(filename)
+
+
+# ---------------------------------------------------------------------------------
+# read the whole tsv frequency index in one pass, the result answers the
+# get_index lookups ('docs', 'idf', 'count') and doc ordered postings() from
+# one copy of the postings
+#
+# @input: anchor: load the anchor text index instead of the word index
+# @output: index: MemoryIndex
+# ---------------------------------------------------------------------------------
+def get_memory_index(anchor=False):
+    if anchor:
+        filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_INDEX_FILENAME)
+    else:
+        filename = os.path.join(INDEX_DIR, INDEX_FILENAME)
+    return MemoryIndex(filename)
+
+
+# ---------------------------------------------------------------------------------
+# open the flat array version of the frequency index, built from the tsv if it
+# is missing or older than the tsv.  The file is mapped read only so every
+# worker process that opens it shares the same pages.
+#
+# @input: anchor: open the anchor text index instead of the word index
+# @output: index: FlatIndex
+# ---------------------------------------------------------------------------------
+def get_flat_index(anchor=False):
+    if anchor:
+        tsv_filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_INDEX_FILENAME)
+        filename = os.path.join(INDEX_DIR, ANCHOR_TEXT_FLAT_INDEX_FILENAME)
+    else:
+        tsv_filename = os.path.join(INDEX_DIR, INDEX_FILENAME)
+        filename = os.path.join(INDEX_DIR, FLAT_INDEX_FILENAME)
+
+    if not os.path.exists(filename) or \
+            (os.path.exists(tsv_filename) and os.path.getmtime(tsv_filename) > os.path.getmtime(filename)):
+        print(filename, 'out of date creating...')
+        write_flat_index(filename, MemoryIndex(tsv_filename))
+    return FlatIndex(filename)
+
+
+# ---------------------------------------------------------------------------------
+# open the BM25 score bounds of the frequency index used by query_wand, built
+# if they are missing or older than the tsv index or the doc table
+#
+# @input: index: the loaded frequency index
+#         doc_index: DocTable
+# @output: impacts: ImpactIndex
+# ---------------------------------------------------------------------------------
+def get_impact_index(index, doc_index):
+    filename = os.path.join(INDEX_DIR, IMPACT_INDEX_FILENAME)
+    sources = [os.path.join(INDEX_DIR, source) for source in (INDEX_FILENAME, DOC_TABLE_FILENAME)]
+    if not os.path.exists(filename) or \
+            any(os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(filename)
+                for source in sources):
+        print(filename, 'out of date creating...')
+        write_impact_index(filename, index, get_engine(doc_index).doc_k)
+    return ImpactIndex(filename)
+
+
+# ---------------------------------------------------------------------------------
+# check the index directory was written with doc numbers, an older
+# index_collection wrote the collection ids ('10-1234') in the tsvs and the
+# indexes can not be read until it is run again
+#
+# @input: None
+# @output: None, raises IndexFormatError for an old index directory
+# ---------------------------------------------------------------------------------
+def check_doc_ids():
+    filename = os.path.join(INDEX_DIR, DOC_INDEX_FILENAME)
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'r', encoding='utf-8') as doc_file:
+        line = doc_file.readline().split('\t', 1)
+    try:
+        int(line[0])
+    except ValueError as error:
+        if line[0]:
+            raise old_doc_ids(filename) from error
+
+
+# ---------------------------------------------------------------------------------
+# load a frequency index
+#
+# @input: mode: 'binary' mmap the binary index, 'shared' mmap the flat array
+#               index, 'tsv' load only the lexicon of the tsv, 'memory' parse
+#               the whole tsv into memory
+#         anchor: load the anchor text index instead of the word index
+# @output: index
+# ---------------------------------------------------------------------------------
+def load_index(mode, anchor=False):
+    check_doc_ids()
+    if mode == 'memory':
+        return get_memory_index(anchor)
+    elif mode == 'shared':
+        return get_flat_index(anchor)
+    elif mode == 'tsv':
+        return get_lazy_index(anchor)
+    return get_binary_index(anchor)
+
+
+# ---------------------------------------------------------------------------------
+# list the files the serving indexes are built from
+#
+# @input: mode: index mode given to load_index
+# @output: list of paths
+# ---------------------------------------------------------------------------------
+def get_source_files(mode):
+    filenames = [DOC_INDEX_FILENAME, LINK_GRAPH_FILENAME, PAGE_RANK_INDEX_FILENAME, DOC_TABLE_FILENAME,
+                 IMPACT_INDEX_FILENAME, INDEX_FILENAME, ANCHOR_TEXT_INDEX_FILENAME, STEM_FILE_NAME, SVM_RESULTS_FILE_NAME,
+                 POSITIONAL_INDEX_FILENAME, FORMULA_INDEX_FILENAME, TEXT_STORE_FILENAME,
+                 DOC_STORE_FILENAME]
+    if mode == 'binary':
+        filenames += [BINARY_INDEX_FILENAME, ANCHOR_TEXT_BINARY_INDEX_FILENAME]
+    elif mode == 'shared':
+        filenames += [FLAT_INDEX_FILENAME, ANCHOR_TEXT_FLAT_INDEX_FILENAME]
+    return [os.path.join(INDEX_DIR, filename) for filename in filenames]
 
-        for line in index_file:
-            line = line.split('\t')
-            posting_list = line[3:]
-            index_list = []
-            posting_dict = {}
-            for posting in posting_list:
-                posting = posting.split(':')
-                docid = posting[0].split('-')
-                docid = docid[0].zfill(2) + docid[1].zfill(4)
-                index_list.append([docid, int(posting[1])])
-            posting_dict["doc_list"] = sorted(index_list)
-            posting_dict["tfidf"] = line[1]
-            posting_dict["doc_count"] = line[2]
-            index[line[0]] = posting_dict
-    return index
 
 # ---------------------------------------------------------------------------------
 # create an index from a tsv with the frequcency of words in  document windows
@@ -363,54 +474,96 @@ def get_index2():
 
 
 # ---------------------------------------------------------------------------------
-# create an index from a tsv mapping episdoe number to title, word count
-# and line count
+# create an index from a tsv mapping doc id to collection id, title, word count
+# and link count, the links themselves are in the link graph
 #
 # @input: None
-# @output: doc_index: dictionary
+# @output: doc_index: list of dictionaries, indexed by doc id
 # ---------------------------------------------------------------------------------
 def get_docs_index():
-    doc_index = {}
+    doc_index = []
     filename = os.path.join(INDEX_DIR, DOC_INDEX_FILENAME)
     with open(filename, 'r', encoding='utf-8') as doc_file:
         line = doc_file.readline()[:-1]
         while line:
-            line = line.split('\t')
-            if line[0] in doc_index:
-                print(line)
+            line = line.split('\t', 6)
             try:
-                doc_index[line[0]] = {
-                    'title': line[1],
-                    'name': line[2],
-                    'words': int(line[3]),
-                    'links': int(line[4]),
-                    'links_to': [],
-                    'linked_from': []
-                }
-                if int(line[4]) > 0:
-                    doc_index[line[0]]['links_to'] = line[5:]
+                if int(line[0]) != len(doc_index):
+                    print(line)
+            except ValueError as error:
+                raise old_doc_ids(filename) from error
+            try:
+                doc_index.append({
+                    'id': line[1],
+                    'title': line[2],
+                    'name': line[3],
+                    'words': int(line[4]),
+                    'links': int(line[5]),
+                    'page_rank': 0.0
+                })
             except IndexError:
                 print(line)
             line = doc_file.readline()[:-1]
 
-    filename = os.path.join(INDEX_DIR, LINKED_FROM_INDEX_FILENAME)
-    with open(filename, 'r', encoding='utf-8') as link_file:
-        line = link_file.readline()[:-1]
-        while line:
-            line = line.split('\t')
-            for doc in line[2:]:
-                doc_index[line[0]]['linked_from'].append(doc)
-            line = link_file.readline()[:-1]
-
+    # page ranks are computed from the link graph, so they may not exist yet
     filename = os.path.join(INDEX_DIR, PAGE_RANK_INDEX_FILENAME)
-    with open(filename, 'r', encoding='utf-8') as rank_file:
-        for line in rank_file:
-            line = line.split('\t')
-            doc_index[line[0]]['page_rank'] = float(line[1])
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as rank_file:
+            ranks = [line.split('\t') for line in rank_file]
+        # ranks of another collection would land on the wrong docs
+        if [int(line[0]) for line in ranks] != list(range(len(doc_index))):
+            print(filename, 'does not match', DOC_INDEX_FILENAME, 'page ranks skipped')
+        else:
+            for line in ranks:
+                doc_index[int(line[0])]['page_rank'] = float(line[1])
 
     return doc_index
 
 
+# ---------------------------------------------------------------------------------
+# open the link graph written by index_collection, built from the links in the
+# doc index tsv if it is missing or older than the tsv
+#
+# @input: None
+# @output: graph: LinkGraph
+# ---------------------------------------------------------------------------------
+def get_link_graph():
+    filename = os.path.join(INDEX_DIR, LINK_GRAPH_FILENAME)
+    source = os.path.join(INDEX_DIR, DOC_INDEX_FILENAME)
+    if not os.path.exists(filename) or \
+            (os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(filename)):
+        print(filename, 'out of date creating...')
+        links_to = []
+        with open(source, 'r', encoding='utf-8') as doc_file:
+            for line in doc_file:
+                line = line[:-1].split('\t')
+                try:
+                    links_to.append([int(doc) for doc in line[6:]])
+                except ValueError as error:
+                    raise old_doc_ids(source) from error
+        write_link_graph(filename, links_to)
+    return LinkGraph(filename)
+
+
+# ---------------------------------------------------------------------------------
+# open the columnar doc table, built from the doc and page rank tsvs if it is
+# missing or older than either of them
+#
+# @input: None
+# @output: doc_table: DocTable
+# ---------------------------------------------------------------------------------
+def get_doc_table():
+    graph = get_link_graph()
+    filename = os.path.join(INDEX_DIR, DOC_TABLE_FILENAME)
+    sources = [os.path.join(INDEX_DIR, source) for source in (DOC_INDEX_FILENAME, PAGE_RANK_INDEX_FILENAME)]
+    if not os.path.exists(filename) or \
+            any(os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(filename)
+                for source in sources):
+        print(filename, 'out of date creating...')
+        write_doc_table(filename, get_docs_index())
+    return DocTable(filename, graph)
+
+
 # ---------------------------------------------------------------------------------
 # create an index from a tsv with the stems and their associated words
 #
@@ -0,0 +1,289 @@
+"""
+Top k BM25 retrieval with Block-Max WAND
+
+Documents are scored one at a time in doc id order with a cursor on the
+posting list of each query term.  Every term has an upper bound on what it
+can add to a score, the largest (K_1 + 1) * f / (doc_k + f) over its postings,
+and so does every block of BLOCK_SIZE postings.  Once k documents have been
+scored, only a document whose bound is over the k-th best score is scored:
+WAND picks the first document whose term bounds can beat it and Block-Max
+WAND skips whole blocks whose block bounds cannot.  Scores are added in the
+same order query_bm25 adds them, so the top k are the same documents with the
+same scores.
+
+The bounds are written to an impact file next to the frequency index:
+    - term_offsets, term_blob: terms sorted by their utf-8 bytes
+    - max_impact: bound of each term
+    - block_starts: first block of each term (term count + 1)
+    - block_last: last doc id in each block
+    - block_max: bound of each block
+    - block_size: postings per block
+
+wand.py
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+import numpy as np
+from .array_store import MappedFile, ArrayStore, write_array_store, pack_strings
+from .bm25 import K_1, count_terms, term_weight, query_term_weight
+
+BLOCK_SIZE = 64
+# bounds are computed with a different order of float operations than the
+# scores, the slack keeps rounding from pruning a document that ties
+BOUND_SLACK = 1 + 1e-9
+
+
+# ---------------------------------------------------------------------------------
+# read a posting list in doc id order as sequences of ints
+#
+# @input: entry: index[term]
+# @return: docs, freqs: int sequences, docs increasing
+# ---------------------------------------------------------------------------------
+def ordered_postings(entry):
+    if hasattr(entry, 'postings'):
+        return entry.postings()
+    postings = sorted(entry['docs'].items())
+    return array('i', [doc for doc, _ in postings]), array('i', [freq for _, freq in postings])
+
+
+# ---------------------------------------------------------------------------------
+# bounds of one posting list
+#
+# @input: docs, freqs: posting list in doc id order
+#         doc_k: NumPy array of the length normalization of each doc
+#         block_size: postings per block
+# @return: max_impact: bound of the list
+#          block_last: int array of the last doc id of each block
+#          block_max: float array of the bound of each block
+# ---------------------------------------------------------------------------------
+def term_impacts(docs, freqs, doc_k, block_size=BLOCK_SIZE):
+    docs = np.asarray(docs, dtype=np.int64)
+    if len(docs) == 0:
+        return 0.0, np.zeros(0, dtype=np.int32), np.zeros(0)
+    freqs = np.asarray(freqs, dtype=np.float64)
+    impacts = (K_1 + 1) * freqs / (doc_k[docs] + freqs)
+    block_first = np.arange(0, len(docs), block_size)
+    block_last = docs[np.minimum(block_first + block_size, len(docs)) - 1].astype(np.int32)
+    block_max = np.maximum.reduceat(impacts, block_first)
+    return float(impacts.max()), block_last, block_max
+
+
+# ---------------------------------------------------------------------------------
+# write the impact file of a frequency index
+#
+# The entries come from index.items(), which skips the entry cache of a lazily
+# loaded index, so a scan of the vocabulary does not push out the entries
+# queries are using.
+#
+# @input: filename: path of the file to write
+#         index: any loaded frequency index
+#         doc_k: NumPy array of the length normalization of each doc
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_impact_index(filename, index, doc_k):
+    impacts = {}
+    for term, entry in index.items():
+        impacts[term] = term_impacts(*ordered_postings(entry), doc_k)
+    terms = sorted(impacts, key=lambda t: t.encode('utf-8'))
+    term_offsets, term_blob = pack_strings(terms)
+    max_impacts = array('d')
+    block_starts = array('q', [0])
+    block_last = array('i')
+    block_max = array('d')
+    for term in terms:
+        max_impact, last, maxes = impacts[term]
+        max_impacts.append(max_impact)
+        block_last.frombytes(last.tobytes())
+        block_max.frombytes(maxes.tobytes())
+        block_starts.append(len(block_last))
+    write_array_store(filename, {'term_offsets': term_offsets, 'term_blob': term_blob,
+                                 'max_impact': max_impacts, 'block_starts': block_starts,
+                                 'block_last': block_last, 'block_max': block_max,
+                                 'block_size': array('i', [BLOCK_SIZE])})
+
+
+class ImpactIndex(MappedFile):
+    """
+    Read only view of an impact file.
+        get(term): (max_impact, block_last, block_max) or None
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._store = ArrayStore(filename)
+        self._term_offsets = self._store['term_offsets']
+        self._term_blob = self._store['term_blob']
+        self._max_impact = self._store['max_impact']
+        self._block_starts = self._store['block_starts']
+        self._block_last = self._store['block_last']
+        self._block_max = self._store['block_max']
+        self.block_size = self._store['block_size'][0]
+        self.term_count = len(self._max_impact)
+
+    def find(self, term):
+        key = term.encode('utf-8')
+        offsets = self._term_offsets
+        blob = self._term_blob
+        low = 0
+        high = self.term_count - 1
+        while low <= high:
+            mid = (low + high) // 2
+            mid_term = blob[offsets[mid]:offsets[mid + 1]].tobytes()
+            if mid_term < key:
+                low = mid + 1
+            elif mid_term > key:
+                high = mid - 1
+            else:
+                return mid
+        return -1
+
+    def get(self, term):
+        num = self.find(term)
+        if num < 0:
+            return None
+        start = self._block_starts[num]
+        end = self._block_starts[num + 1]
+        return self._max_impact[num], self._block_last[start:end], self._block_max[start:end]
+
+
+class TermCursor:
+    """
+    Position in the posting list of one query term.
+        doc: current doc id, END once the list is used up
+        bound: upper bound of the term's score
+        block: block the last shallow move landed on
+    """
+    __slots__ = ('docs', 'freqs', 'weight', 'bound', 'block_last', 'block_max', 'block_size',
+                 'pos', 'doc', 'block')
+
+    def __init__(self, docs, freqs, weight, max_impact, block_last, block_max, block_size):
+        self.docs = docs
+        self.freqs = freqs
+        self.weight = weight
+        self.bound = weight * max_impact * BOUND_SLACK
+        self.block_last = block_last
+        self.block_max = block_max
+        self.block_size = block_size
+        self.pos = 0
+        self.doc = docs[0] if len(docs) else END
+        self.block = 0
+
+    # move to the first posting with doc id >= target
+    def next_geq(self, target):
+        if self.doc >= target:
+            return
+        self.pos = bisect_left(self.docs, target, self.pos + 1)
+        self.doc = self.docs[self.pos] if self.pos < len(self.docs) else END
+
+    def next(self):
+        self.pos += 1
+        self.doc = self.docs[self.pos] if self.pos < len(self.docs) else END
+
+    # move to the block that would hold target without moving the cursor,
+    # returns the bound of that block
+    def shallow_bound(self, target):
+        self.block = bisect_left(self.block_last, target, max(self.block, self.pos // self.block_size))
+        if self.block >= len(self.block_last):
+            return 0.0
+        return self.weight * self.block_max[self.block] * BOUND_SLACK
+
+    def current_block_last(self):
+        if self.block >= len(self.block_last):
+            return END - 1
+        return self.block_last[self.block]
+
+
+END = 2 ** 62
+
+
+# ---------------------------------------------------------------------------------
+# the best k docs for a query by Block-Max WAND
+#
+# @input: engine: BM25Engine of the doc table
+#         terms: list of query terms, repeated terms count more
+#         index: frequency index
+#         k: number of docs to return, none if k <= 0
+#         impacts: ImpactIndex of the index, bounds are computed from the
+#                  postings of terms it does not have
+# @return: list of (doc, score), highest score first, ties by doc id, or None
+#          if a term can lower a score and the query has to be run exhaustively
+# ---------------------------------------------------------------------------------
+def block_max_wand(engine, terms, index, k, impacts=None):
+    if k <= 0:
+        return []
+    cursors = []
+    for term, count in count_terms(terms).items():
+        try:
+            entry = index[term]
+            n_i = float(entry['count'])
+        except KeyError:
+            continue
+        weight = term_weight(n_i, engine.doc_count)
+        if weight < 0:
+            return None
+        weight *= query_term_weight(count)
+        docs, freqs = ordered_postings(entry)
+        bounds = impacts.get(term) if impacts is not None else None
+        if bounds is None:
+            max_impact, block_last, block_max = term_impacts(docs, freqs, engine.doc_k)
+            bounds = (max_impact, block_last.tolist(), block_max.tolist())
+            block_size = BLOCK_SIZE
+        else:
+            block_size = impacts.block_size
+        cursors.append(TermCursor(docs, freqs, weight, *bounds, block_size))
+    by_order = list(cursors)
+    doc_k = engine.doc_k_list()
+
+    heap = []
+    threshold = float('-inf')
+    cursors = [cursor for cursor in cursors if cursor.doc != END]
+    while cursors:
+        cursors.sort(key=lambda c: c.doc)
+        # pivot: first cursor where the bounds so far can beat the threshold
+        bound = 0.0
+        pivot = -1
+        for num, cursor in enumerate(cursors):
+            bound += cursor.bound
+            if bound > threshold:
+                pivot = num
+                break
+        if pivot < 0:
+            break
+        pivot_doc = cursors[pivot].doc
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+            pivot += 1
+
+        block_bound = 0.0
+        for cursor in cursors[:pivot + 1]:
+            block_bound += cursor.shallow_bound(pivot_doc)
+        if block_bound <= threshold:
+            # no doc before the end of these blocks can get into the top k
+            target = min(cursor.current_block_last() for cursor in cursors[:pivot + 1]) + 1
+            if pivot + 1 < len(cursors):
+                target = min(target, cursors[pivot + 1].doc)
+            target = max(target, pivot_doc + 1)
+            for cursor in cursors[:pivot + 1]:
+                cursor.next_geq(target)
+        elif cursors[0].doc == pivot_doc:
+            dk = doc_k[pivot_doc]
+            score = 0.0
+            for cursor in by_order:
+                if cursor.doc == pivot_doc:
+                    f = cursor.freqs[cursor.pos]
+                    score += cursor.weight * (K_1 + 1) * f / (dk + f)
+                    cursor.next()
+            # docs come in increasing id order, so a tie keeps the earlier doc
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -pivot_doc))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -pivot_doc))
+                threshold = heap[0][0]
+        else:
+            for cursor in cursors[:pivot]:
+                cursor.next_geq(pivot_doc)
+        cursors = [cursor for cursor in cursors if cursor.doc != END]
+
+    return [(-doc, score) for score, doc in sorted(heap, key=lambda x: (-x[0], -x[1]))]
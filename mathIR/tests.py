@@ -1,3 +1,881 @@
-from django.test import TestCase
+import io
+import math
+import os
+import pickle
+import gzip
+import html
+import random
+import tarfile
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+from django.test import TestCase, RequestFactory
+from django.utils.http import http_date
+from . import views
+from .custom_lib import indexer
+from .custom_lib.doc_table import DocTable, write_doc_table
+from .custom_lib.bm25 import BM25Engine
+from .custom_lib.features import FeatureEngine
+from .custom_lib.wand import block_max_wand, write_impact_index, ImpactIndex
+from .custom_lib.binary_index import BinaryIndex, write_binary_index, convert_tsv_index, IndexFormatError
+from .custom_lib.positions import PositionalIndex, write_positional_index, ANY_SPAN
+from .custom_lib.formulas import formula_ngrams, formula_tokens
+from .custom_lib import cache
+from .custom_lib.result_cache import ResultCache, MISSING
+from .custom_lib.intersect import intersect, intersect_two, union, locate, EMPTY
+from .custom_lib import searcher
+from .custom_lib import utils
+from .custom_lib.doc_store import DocStore, DocStoreWriter
+from .custom_lib.text_store import TextStore, write_text_store
 
-# Create your tests here.
+
+# ---------------------------------------------------------------------------------
+# a random collection: the doc table rows and a get_index style dictionary
+#
+# @input: rand: random.Random
+#         doc_count: number of docs
+#         term_count: number of terms
+# @return: doc_index: list of document dictionaries indexed by doc id
+#          index: dictionary of term -> {'count', 'idf', 'docs'}
+# ---------------------------------------------------------------------------------
+def random_collection(rand, doc_count=1500, term_count=12):
+    doc_index = [{'id': str(doc), 'title': 'doc %d' % doc, 'name': '%d.html' % doc,
+                  'words': rand.randint(20, 2000), 'links': 0, 'page_rank': 0.0}
+                 for doc in range(doc_count)]
+    index = {}
+    for num in range(term_count):
+        # under half of the docs, so no term weight is negative
+        docs = sorted(rand.sample(range(doc_count), rand.randint(1, doc_count * 2 // 5)))
+        index['term%d' % num] = {'count': len(docs), 'idf': 1.0,
+                                 'docs': {doc: rand.randint(1, 12) for doc in docs}}
+    return doc_index, index
+
+
+class BlockMaxWandTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.rand = random.Random(2019)
+        doc_index, self.index = random_collection(self.rand)
+        filename = os.path.join(self.dir.name, 'doc_table.arrays')
+        write_doc_table(filename, doc_index)
+        self.engine = BM25Engine(DocTable(filename, None))
+        filename = os.path.join(self.dir.name, 'impacts.arrays')
+        write_impact_index(filename, self.index, self.engine.doc_k)
+        self.impacts = ImpactIndex(filename)
+
+    def tearDown(self):
+        self.impacts = None
+        self.engine = None
+        self.dir.cleanup()
+
+    def assert_top_k(self, terms, k, impacts):
+        docs, scores = self.engine.score(terms, self.index)
+        expected = [(int(docs[pos]), float(scores[pos])) for pos in self.engine.top_k(docs, scores, k)]
+        found = block_max_wand(self.engine, terms, self.index, k, impacts)
+        self.assertEqual([doc for doc, _ in found], [doc for doc, _ in expected], (terms, k))
+        for (_, score), (_, expected_score) in zip(found, expected):
+            self.assertAlmostEqual(score, expected_score, places=9)
+
+    def test_same_as_exhaustive(self):
+        terms = sorted(self.index)
+        for _ in range(40):
+            query = [self.rand.choice(terms) for _ in range(self.rand.randint(1, 5))]
+            k = self.rand.choice([1, 3, 10, 50, 5000])
+            self.assert_top_k(query, k, None)
+            self.assert_top_k(query, k, self.impacts)
+
+    def test_missing_terms(self):
+        self.assert_top_k(['term0', 'missing'], 10, self.impacts)
+        self.assertEqual(block_max_wand(self.engine, ['missing'], self.index, 10), [])
+
+    def test_no_docs_asked_for(self):
+        for k in (0, -1):
+            self.assertEqual(block_max_wand(self.engine, ['term0', 'term1'], self.index, k), [])
+            self.assertEqual(block_max_wand(self.engine, ['term0'], self.index, k, self.impacts), [])
+
+
+# ---------------------------------------------------------------------------------
+# query_bm25 as it was before the NumPy engine, one posting at a time over a
+# doc index dictionary
+#
+# @input: terms: list of query terms
+#         index: get_index style dictionary
+#         doc_index: dictionary of doc id -> document dictionary
+#         limit_to: optional doc ids to keep
+# @return: dictionary of doc id -> score
+# ---------------------------------------------------------------------------------
+def original_bm25(terms, index, doc_index, limit_to=None):
+    k_1, k_2, b = 1.2, 100.0, 0.75
+    term_counts = {}
+    for term in terms:
+        term_counts[term] = term_counts.get(term, 0) + 1
+    n = len(doc_index)
+    avg_dl = sum(float(doc['words']) for doc in doc_index.values()) / n
+    doc_k = {doc: k_1 * ((1 - b) + b * (float(doc_index[doc]['words']) / avg_dl)) for doc in doc_index}
+    doc_scores = {}
+    for term in term_counts:
+        if term not in index:
+            continue
+        n_i = float(index[term]['count'])
+        term_weight = math.log((0.5 / 0.5) / ((n_i + 0.5) / (n - n_i + 0.5)))
+        if term_weight < -0.25:
+            term_weight = -0.25
+        query_term_weight = ((k_2 + 1) * term_counts[term]) / (k_2 + term_counts[term])
+        for doc, f_i in index[term]['docs'].items():
+            doc_weight = (k_1 + 1) * f_i / (doc_k[doc] + f_i)
+            doc_scores[doc] = doc_scores.get(doc, 0.0) + term_weight * doc_weight * query_term_weight
+    if limit_to is not None:
+        doc_scores = {doc: score for doc, score in doc_scores.items() if doc in limit_to}
+    return doc_scores
+
+
+# ---------------------------------------------------------------------------------
+# get_features as it was before the feature matrix, one doc and term at a time
+#
+# @input: query_words: list of query terms
+#         doc_ids: list of doc ids
+#         doc_index: dictionary of doc id -> document dictionary
+#         index, anchor_index: get_index style dictionaries
+# @return: list of the 5 features of each doc
+# ---------------------------------------------------------------------------------
+def original_features(query_words, doc_ids, doc_index, index, anchor_index):
+    features = [[0 for x in range(0, 5)] for i in range(0, len(doc_ids))]
+    limit_to = doc_ids if len(doc_ids) < len(doc_index) else None
+    bm25_results = original_bm25(query_words, anchor_index, doc_index, limit_to)
+    for doc in range(0, len(doc_ids)):
+        doc_id = doc_ids[doc]
+        if doc_id in bm25_results:
+            features[doc][0] = bm25_results[doc_id]
+            title_words = doc_index[doc_id]['title'].split()
+            features[doc][1] = sum(1 for word in query_words if word in title_words) / len(query_words)
+        features[doc][2] = doc_index[doc_id]['page_rank']
+        for term in query_words:
+            if term in index:
+                if doc_id in index[term]['docs']:
+                    features[doc][3] += math.log(index[term]['docs'][doc_id] + 1)
+                features[doc][4] += index[term]['idf']
+        features[doc][3] /= len(query_words)
+        features[doc][4] /= len(query_words)
+    return features
+
+
+class OriginalScoringTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.rand = random.Random(10)
+        doc_index, self.index = random_collection(self.rand, doc_count=400, term_count=8)
+        _, self.anchor_index = random_collection(self.rand, doc_count=400, term_count=8)
+        terms = sorted(self.index)
+        for doc in doc_index:
+            doc['title'] = ' '.join(self.rand.sample(terms, 2))
+            doc['page_rank'] = self.rand.random()
+        for index in (self.index, self.anchor_index):
+            for entry in index.values():
+                entry['idf'] = self.rand.uniform(0.5, 4.0)
+        self.doc_dict = dict(enumerate(doc_index))
+        filename = os.path.join(self.dir.name, 'doc_table.arrays')
+        write_doc_table(filename, doc_index)
+        self.doc_table = DocTable(filename, None)
+        self.queries = [['term0'], ['term1', 'term2'], ['term3', 'term3', 'term4'], ['term5', 'missing'],
+                        ['missing'], terms]
+
+    def tearDown(self):
+        self.doc_table = None
+        self.dir.cleanup()
+
+    def test_bm25(self):
+        engine = BM25Engine(self.doc_table)
+        for terms in self.queries:
+            expected = original_bm25(terms, self.index, self.doc_dict)
+            docs, scores = engine.score(terms, self.index)
+            self.assertEqual(docs.tolist(), sorted(expected), terms)
+            for doc, score in zip(docs.tolist(), scores.tolist()):
+                self.assertAlmostEqual(score, expected[doc], places=9)
+            ranked = sorted(expected, key=lambda doc: (-expected[doc], doc))
+            for k in (1, 10, None):
+                self.assertEqual(docs[engine.top_k(docs, scores, k)].tolist(), ranked[:k], (terms, k))
+
+            allowed = sorted(self.rand.sample(range(len(self.doc_dict)), 50))
+            expected = original_bm25(terms, self.index, self.doc_dict, set(allowed))
+            docs, scores = engine.score(terms, self.index, np.array(allowed, dtype=np.int64))
+            self.assertEqual(docs.tolist(), sorted(expected), terms)
+            for doc, score in zip(docs.tolist(), scores.tolist()):
+                self.assertAlmostEqual(score, expected[doc], places=9)
+
+    def test_features(self):
+        engine = FeatureEngine(self.doc_table)
+        all_docs = list(range(len(self.doc_dict)))
+        # unsorted, with a repeat, and every doc
+        some_docs = self.rand.sample(all_docs, 60) + [5, 5]
+        for terms in self.queries:
+            for doc_ids in (some_docs, all_docs):
+                expected = original_features(terms, doc_ids, self.doc_dict, self.index, self.anchor_index)
+                found = engine.features(terms, doc_ids, self.index, self.anchor_index)
+                self.assertEqual(found.shape, (len(doc_ids), 6))
+                np.testing.assert_allclose(found[:, :5], np.array(expected), rtol=1e-9, atol=1e-12)
+                # no positional index, no proximity
+                self.assertFalse(found[:, 5].any())
+
+
+WORDS = ['fourier', 'transform', 'prime', 'number', 'group', 'theory', 'matrix', 'the', 'of', 'set', 'zeta']
+
+
+# ---------------------------------------------------------------------------------
+# write a collection archive like the wpmath ones
+#
+# @input: rand: random.Random
+#         filename: path of the .tar.bz2 to write
+#         first: number of the first page
+#         page_count: number of pages
+# @return: None
+# ---------------------------------------------------------------------------------
+def write_archive(rand, filename, first, page_count):
+    dir_name = os.path.basename(filename)[:-8]
+    with tarfile.open(filename, 'w:bz2') as tar:
+        for num in range(first, first + page_count):
+            body = '\n'.join(' '.join(rand.choice(WORDS) for _ in range(rand.randint(0, 20)))
+                             for _ in range(rand.randint(1, 12)))
+            links = ' '.join('<a href="Page%d" title="t">%s</a>' % (rand.randint(0, first + page_count),
+                                                                     rand.choice(WORDS)) for _ in range(3))
+            formula = '<math><semantics><mrow><mi>x</mi><mo>+</mo><mn>%d</mn></mrow>' \
+                      '<annotation encoding="application/x-tex">x+%d</annotation></semantics></math>' % (num % 3, num % 3)
+            page = ('<html><head><title offset="%d">Page %d</title></head><body><p>%s</p>%s %s</body></html>'
+                    % (num, num, body, links, formula)).encode('utf-8')
+            info = tarfile.TarInfo('%s/Page%d.html' % (dir_name, num))
+            info.size = len(page)
+            tar.addfile(info, io.BytesIO(page))
+
+
+class IndexCollectionTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        rand = random.Random(11)
+        self.collection = os.path.join(self.dir.name, 'collection')
+        os.makedirs(self.collection)
+        # more pages than a batch, so the workers get several batches
+        write_archive(rand, os.path.join(self.collection, 'wpmath0000001.tar.bz2'), 1, indexer.BATCH_SIZE + 20)
+        write_archive(rand, os.path.join(self.collection, 'wpmath0000002.tar.bz2'), indexer.BATCH_SIZE + 21, 15)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def index(self, workers):
+        out = os.path.join(self.dir.name, 'index%d' % workers)
+        os.makedirs(os.path.join(out, 'indices'))
+        with mock.patch.object(indexer, 'COLLECTION_DIR', self.collection), \
+                mock.patch.object(indexer, 'INDEX_DIR', out):
+            indexer.index_collection(workers)
+        files = {}
+        for root, _, names in os.walk(out):
+            for name in names:
+                with open(os.path.join(root, name), 'rb') as file:
+                    files[os.path.relpath(os.path.join(root, name), out)] = file.read()
+        return files
+
+    def test_same_files_for_any_workers(self):
+        one = self.index(1)
+        two = self.index(2)
+        self.assertIn(indexer.BINARY_INDEX_FILE_NAME, one)
+        self.assertIn(indexer.DOC_STORE_FILE_NAME, one)
+        self.assertEqual(sorted(one), sorted(two))
+        for name in one:
+            self.assertEqual(one[name], two[name], name)
+
+
+# an index directory written before the docs were numbered, ids are archive-offset
+class OldIndexTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.write(utils.DOC_INDEX_FILENAME, '10-0\t10-0\tAlgebra\talgebra\t120\t1\t10-512\n'
+                                             '10-512\t10-512\tRing\tring\t80\t0\n')
+        self.write(utils.INDEX_FILENAME, 'ring\t0.3\t2\t10-0:2\t10-512:5\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir.name, name), 'w', encoding='utf-8') as out:
+            out.write(text)
+
+    def assert_rerun(self, call, *args):
+        with mock.patch.object(utils, 'INDEX_DIR', self.dir.name):
+            with self.assertRaisesRegex(IndexFormatError, 're-run index_collection'):
+                call(*args)
+
+    def test_convert_tsv_index(self):
+        self.assert_rerun(convert_tsv_index, os.path.join(self.dir.name, utils.INDEX_FILENAME),
+                          os.path.join(self.dir.name, 'index.bin'))
+
+    def test_load_index(self):
+        for mode in ('binary', 'shared', 'tsv', 'memory'):
+            self.assert_rerun(utils.load_index, mode)
+
+    def test_doc_index(self):
+        self.assert_rerun(utils.get_docs_index)
+        self.assert_rerun(utils.get_link_graph)
+
+
+class IntersectTest(TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(5)
+
+    def sorted_docs(self, count, top=2000):
+        return np.array(sorted(self.rand.sample(range(top), count)), dtype=np.int64)
+
+    def assert_docs(self, docs, expected):
+        self.assertEqual(list(docs), sorted(expected))
+
+    def test_intersect(self):
+        for _ in range(50):
+            lists = [self.sorted_docs(self.rand.choice((0, 1, 5, 50, 800)))
+                     for _ in range(self.rand.randint(1, 4))]
+            expected = set(lists[0]).intersection(*lists[1:])
+            self.assert_docs(intersect(lists), expected)
+        self.assert_docs(intersect([]), [])
+        single = self.sorted_docs(30)
+        self.assert_docs(intersect([single]), single)
+
+    def test_intersect_two(self):
+        for small, large in ((5, 800), (50, 50), (0, 10), (10, 0), (1, 1)):
+            small, large = self.sorted_docs(small), self.sorted_docs(large)
+            self.assert_docs(intersect_two(small, large), set(small) & set(large))
+        # docs of small past either end of large
+        large = np.array([10, 20, 30], dtype=np.int64)
+        self.assert_docs(intersect_two(np.array([1, 20, 40], dtype=np.int64), large), [20])
+
+    def test_union(self):
+        for _ in range(50):
+            # variants of one word share many docs
+            lists = [self.sorted_docs(self.rand.choice((0, 1, 5, 50)), top=100)
+                     for _ in range(self.rand.randint(1, 4))]
+            self.assert_docs(union(lists), set().union(*lists))
+        self.assert_docs(union([]), [])
+        self.assert_docs(union([EMPTY, EMPTY]), [])
+        single = self.sorted_docs(30)
+        self.assert_docs(union([EMPTY, single]), single)
+
+    def test_locate(self):
+        sorted_docs = self.sorted_docs(100, top=300)
+        docs = np.array(self.rand.sample(range(-5, 310), 80), dtype=np.int64)
+        positions, found = locate(sorted_docs, docs)
+        members = set(sorted_docs)
+        self.assertEqual(list(found), [doc in members for doc in docs])
+        self.assertEqual(list(sorted_docs[positions[found]]), list(docs[found]))
+        positions, found = locate(EMPTY, docs)
+        self.assertEqual(len(positions), len(docs))
+        self.assertFalse(found.any())
+
+
+class StoreRoundTripTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.rand = random.Random(7)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    # a mapped file pickles as the arguments it was opened with, not its data
+    def pickled(self, mapped):
+        data = pickle.dumps(mapped)
+        self.assertLess(len(data), 1000)
+        return pickle.loads(data)
+
+    def test_binary_index(self):
+        index = {}
+        for term in WORDS + ['\u03b6eta']:
+            docs = sorted(self.rand.sample(range(5000), self.rand.randint(1, 300)))
+            index[term] = [(doc, self.rand.randint(1, 1000)) for doc in docs]
+        filename = os.path.join(self.dir.name, 'index.bin')
+        write_binary_index(filename, index, 5000)
+        read = BinaryIndex(filename)
+        self.assertEqual(len(read), len(index))
+        self.assertEqual(read.doc_count, 5000)
+        self.assertEqual(sorted(read.keys()), sorted(index))
+        for term, postings in index.items():
+            docs, freqs = read[term].postings()
+            self.assertEqual(list(zip(docs, freqs)), postings)
+            self.assertEqual(read[term]['count'], len(postings))
+        self.assertIsNone(read.get('missing'))
+        unpickled = self.pickled(read)
+        self.assertEqual(unpickled.init_args(), read.init_args())
+        self.assertEqual(unpickled['zeta'].postings(), read['zeta'].postings())
+        read.close()
+
+    def test_positional_index(self):
+        index = {}
+        for term in WORDS:
+            docs = sorted(self.rand.sample(range(2000), self.rand.randint(1, 300)))
+            index[term] = [(doc, sorted(self.rand.sample(range(100000), self.rand.randint(1, 20)))) for doc in docs]
+        filename = os.path.join(self.dir.name, 'positions.bin')
+        write_positional_index(filename, index, 2000)
+        read = PositionalIndex(filename)
+        for term, postings in index.items():
+            docs, starts, positions = read[term].postings()
+            self.assertEqual([(doc, list(positions[starts[num]:starts[num + 1]])) for num, doc in enumerate(docs)],
+                             postings)
+            self.assertEqual(read.term_keys(term).tolist(),
+                             [doc << 32 | position for doc, doc_positions in postings for position in doc_positions])
+            # decoding only some docs gives the same keys as filtering the whole list
+            for allowed in ([], [postings[0][0]], sorted(self.rand.sample(range(2000), 50)), list(range(2000))):
+                allowed = np.asarray(allowed, dtype=np.int64)
+                self.assertEqual(read.term_keys(term, allowed).tolist(),
+                                 [doc << 32 | position for doc, doc_positions in postings if doc in allowed
+                                  for position in doc_positions])
+            self.assertEqual(read[term].weight, sum(len(doc_positions) for _, doc_positions in postings))
+        self.assertEqual(len(read.term_keys('missing')), 0)
+        self.assertEqual(self.pickled(read).term_keys('zeta').tolist(), read.term_keys('zeta').tolist())
+        read.close()
+
+    def test_doc_store(self):
+        pages = [bytes(self.rand.getrandbits(8) for _ in range(self.rand.choice([0, 10, 3000, 70000])))
+                 for _ in range(40)]
+        filename = os.path.join(self.dir.name, 'doc_store.bin')
+        writer = DocStoreWriter(filename, block_size=8192)
+        # pages added out of doc order, as the workers return them
+        order = list(range(len(pages)))
+        self.rand.shuffle(order)
+        slots = {}
+        for doc in order:
+            slots[doc] = writer.add(pages[doc])
+        writer.close([slots[doc] for doc in range(len(pages))])
+
+        store = DocStore(filename, cache_size=100000)
+        self.assertEqual(len(store), len(pages))
+        for doc, page in enumerate(pages):
+            self.assertEqual(store[doc], page)
+            file, length, compressed = store.open_page(doc, compressed=True)
+            data = file.read(length)
+            file.close()
+            self.assertEqual(gzip.decompress(data) if compressed else data, page)
+        unpickled = self.pickled(store)
+        self.assertEqual(unpickled.init_args(), (filename, 100000))
+        self.assertEqual(unpickled[len(pages) - 1], pages[-1])
+        unpickled.close()
+        store.close()
+
+    def test_text_store(self):
+        texts = []
+        line_words = []
+        for _ in range(30):
+            lines = [' '.join(self.rand.choice(WORDS + ['\u03b6\u03b7']) for _ in range(self.rand.randint(1, 9)))
+                     for _ in range(self.rand.randint(0, 6))]
+            texts.append(lines)
+            line_words.append([len(line.split()) for line in lines])
+        filename = os.path.join(self.dir.name, 'text.arrays')
+        write_text_store(filename, texts, line_words)
+        store = TextStore(filename)
+        self.assertEqual(len(store), len(texts))
+        for doc, lines in enumerate(texts):
+            self.assertEqual(store.lines(doc), lines)
+            starts = [sum(line_words[doc][:num]) for num in range(len(lines))]
+            self.assertEqual(store.line_starts(doc).tolist(), starts)
+        self.assertEqual(store.sizes().tolist(), [len('\n'.join(lines).encode('utf-8')) for lines in texts])
+        self.assertEqual(self.pickled(store).lines(len(texts) - 1), texts[-1])
+
+        filename = os.path.join(self.dir.name, 'text_only.arrays')
+        write_text_store(filename, texts)
+        self.assertIsNone(TextStore(filename).line_starts(0))
+
+
+# spelling correction of the parse test: 'xyzzy' is dropped and
+# 'fourierseries' split in two
+def fake_clean_terms(terms, index, doc_index):
+    fixed = {'xyzzy': [], 'fourierseries': ['fourier', 'series']}
+    return [term for word in terms for term in fixed.get(word, [word])]
+
+
+class ReadyLoader:
+
+    def start(self):
+        return self
+
+    def is_ready(self):
+        return True
+
+
+class PageDocs:
+
+    def __init__(self, ids):
+        self.numbers = {doc_id: doc for doc, doc_id in enumerate(ids)}
+
+    # a KeyError for an unknown id, like DocTable
+    def doc_number(self, collection_id):
+        return self.numbers[collection_id]
+
+
+class HtmlViewTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # the long page fills a block of its own and is kept gzipped as stored
+        self.pages = [b'<p>short</p>', b'<p>' + b'long page ' * 3000 + b'</p>']
+        filename = os.path.join(self.dir.name, 'doc_store.bin')
+        writer = DocStoreWriter(filename, block_size=8192)
+        writer.close([writer.add(page) for page in self.pages])
+        self.store = DocStore(filename)
+        search = searcher.Searcher.__new__(searcher.Searcher)
+        search.doc_index = PageDocs(['10-0', '10-1'])
+        search.documents = self.store
+        search.version = 'v1'
+        self.etag, self.modified = search.page_version(1, 'Long')
+        patches = [mock.patch.object(views, 'LOADER', ReadyLoader()), mock.patch.object(views, 'SEARCHER', search)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def get(self, page_id, **headers):
+        return views.html(self.factory.get('/html', {'id': page_id}, **headers))
+
+    def body(self, response):
+        body = b''.join(response.streaming_content)
+        response.close()
+        return body
+
+    def assert_page_headers(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Last-Modified'], http_date(self.modified))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip_when_accepted(self):
+        response = self.get('10-1 Long', HTTP_ACCEPT_ENCODING='deflate, gzip')
+        self.assert_page_headers(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(gzip.decompress(body), self.pages[1])
+
+    def test_plain_otherwise(self):
+        for headers in ({}, {'HTTP_ACCEPT_ENCODING': 'identity'}):
+            response = self.get('10-1 Long', **headers)
+            self.assert_page_headers(response)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            body = self.body(response)
+            self.assertEqual(int(response['Content-Length']), len(body))
+            self.assertEqual(body, self.pages[1])
+
+    def test_not_modified(self):
+        for headers in ({'HTTP_IF_NONE_MATCH': self.etag},
+                        {'HTTP_IF_MODIFIED_SINCE': http_date(self.modified)}):
+            response = self.get('10-1 Long', HTTP_ACCEPT_ENCODING='gzip', **headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], self.etag)
+            self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.get('10-1 Long', HTTP_IF_NONE_MATCH='W/"other"')
+        self.assertEqual(response.status_code, 200)
+        self.body(response)
+
+    def test_missing_page(self):
+        for page_id in ('10-7 Missing', '10-1', ''):
+            with self.assertRaises(views.Http404):
+                self.get(page_id)
+
+
+class FakeBackend:
+    """dictionary with the get / set of a Django cache, it counts the calls"""
+
+    def __init__(self):
+        self.values = {}
+        self.timeouts = {}
+        self.gets = 0
+
+    def get(self, key, default=None):
+        self.gets += 1
+        return self.values.get(key, default)
+
+    def set(self, key, value, timeout):
+        self.values[key] = value
+        self.timeouts[key] = timeout
+
+
+class BrokenBackend:
+
+    def get(self, key, default=None):
+        raise ConnectionError('down')
+
+    def set(self, key, value, timeout):
+        raise ConnectionError('down')
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ResultCacheTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patch = mock.patch.object(cache, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def worker(self, backend=None):
+        results = ResultCache(backend, ttl=60)
+        results.set_version('v1')
+        return results
+
+    def test_no_version_no_entries(self):
+        results = ResultCache()
+        results.put('terms', 'q', 1)
+        self.assertIs(results.get('terms', 'q'), MISSING)
+
+    def test_ttl(self):
+        results = self.worker()
+        results.put('ranked', 'q', [1, 2])
+        self.clock.now += 59
+        self.assertEqual(results.get('ranked', 'q'), [1, 2])
+        self.clock.now += 2
+        self.assertIs(results.get('ranked', 'q'), MISSING)
+
+    def test_set_version(self):
+        backend = FakeBackend()
+        results = self.worker(backend)
+        results.put('snippet', 'q', ['line'])
+        results.flush()
+        results.set_version('v1')
+        self.assertEqual(results.get('snippet', 'q'), ['line'])
+        results.set_version('v2')
+        self.assertEqual(results.stats()['snippet']['entries'], 0)
+        # the backend entry of v1 is under another key
+        self.assertIs(results.get('snippet', 'q'), MISSING)
+        self.assertEqual(backend.gets, 1)
+
+    def test_shared_backend(self):
+        backend = FakeBackend()
+        one = self.worker(backend)
+        two = self.worker(backend)
+        one.put('terms', 'q', ('a', 'b'))
+        one.flush()
+        self.assertEqual(list(backend.timeouts.values()), [60])
+        self.assertEqual(two.get('terms', 'q'), ('a', 'b'))
+        # now in the local cache of two as well
+        self.assertEqual(two.get('terms', 'q'), ('a', 'b'))
+        self.assertEqual(backend.gets, 1)
+        self.assertIs(two.get('ranked', 'q'), MISSING)
+
+    def test_stats(self):
+        backend = FakeBackend()
+        one = self.worker(backend)
+        two = self.worker(backend)
+        one.put('ranked', 'q', 1)
+        one.flush()
+        two.get('ranked', 'q')
+        two.get('ranked', 'q')
+        two.get('ranked', 'q')
+        two.get('ranked', 'other')
+        stats = two.stats()['ranked']
+        self.assertEqual(stats, {'hits': 3, 'shared_hits': 1, 'misses': 1, 'hit_rate': 0.75, 'entries': 1})
+        self.assertEqual(two.stats()['terms'], {'hits': 0, 'shared_hits': 0, 'misses': 0, 'hit_rate': 0.0,
+                                                'entries': 0})
+
+    def test_broken_backend(self):
+        results = self.worker(BrokenBackend())
+        with mock.patch('builtins.print'):
+            results.put('terms', 'q', 1)
+            results.flush()
+            self.assertEqual(results.get('terms', 'q'), 1)
+            self.assertIs(results.get('terms', 'other'), MISSING)
+
+    def test_full_write_queue(self):
+        backend = FakeBackend()
+        results = self.worker(backend)
+        with mock.patch('mathIR.custom_lib.result_cache.WRITE_QUEUE_SIZE', 2), \
+                mock.patch.object(backend, 'set', side_effect=lambda *args: time.sleep(0.2)):
+            for key in range(10):
+                results.put('terms', key, key)
+            results.flush()
+        self.assertGreater(results.dropped_writes, 0)
+        self.assertEqual(results.get('terms', 9), 9)
+
+
+class SearcherParseTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.dir.name, 'positions.bin')
+        # doc 0: "fourier series", doc 1: "series of fourier", doc 2: "fourier"
+        write_positional_index(filename, {'fourier': [(0, [0]), (1, [2]), (2, [0])],
+                                          'series': [(0, [1]), (1, [0])],
+                                          'of': [(1, [1])]}, 3)
+        self.searcher = searcher.Searcher.__new__(searcher.Searcher)
+        self.searcher.index = {}
+        self.searcher.doc_index = []
+        self.searcher.stem_dict = {}
+        self.searcher.positions = PositionalIndex(filename)
+        self.searcher.cache = ResultCache()
+        self.searcher.cache.set_version('test')
+
+    def tearDown(self):
+        self.searcher.positions.close()
+        self.dir.cleanup()
+
+    def operators(self, query):
+        with mock.patch.object(searcher, 'clean_terms', fake_clean_terms):
+            return self.searcher.parse(query)[4]
+
+    def test_phrase_kept_when_words_line_up(self):
+        operators = self.operators('"fourier series"')
+        self.assertEqual(operators, (((('fourier',), ('series',)), None),))
+        self.assertEqual(self.searcher.match_operators(operators).tolist(), [0])
+
+    def test_phrase_with_changed_words_is_a_conjunction(self):
+        for query in ('"xyzzy fourier series"', '"fourierseries of"'):
+            operators = self.operators(query)
+            self.assertEqual(operators[0][1], ANY_SPAN, query)
+        self.assertEqual(self.searcher.match_operators(self.operators('"xyzzy fourier series"')).tolist(), [0, 1])
+        self.assertEqual(self.searcher.match_operators(self.operators('"fourierseries of"')).tolist(), [1])
+
+    def test_window_keeps_its_words(self):
+        operators = self.operators('"xyzzy series fourier"~2')
+        self.assertEqual(operators, (((('series',), ('fourier',)), 2),))
+        self.assertEqual(self.searcher.match_operators(operators).tolist(), [0])
+
+    def test_unknown_words_restrict_nothing(self):
+        self.assertEqual(self.operators('"xyzzy"'), ())
+
+
+# one line lists of words, the last word of each doc is followed by the first
+# of the next in the position keys
+BEHAVIOUR_TEXTS = [['notes on fourier'],
+                   ['series expansions and more'],
+                   ['a fourier series is a sum', 'of sines'],
+                   ['series fourier'],
+                   ['fourier one two three series'],
+                   ['Fourier & <Laplace> transforms compared', 'too short',
+                    'the x<y fourier series of ' + ' '.join(['word'] * 40) + ' and the series']]
+BEHAVIOUR_FORMULAS = [['x^2 + y^2'], ['x^{2} + y^{2}', 'x^2+y^2'], ['x^2'], [], ['\\frac{a}{b}'], []]
+
+
+class QueryBehaviourTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        doc_count = len(BEHAVIOUR_TEXTS)
+        positions = {}
+        formulas = {}
+        for doc, lines in enumerate(BEHAVIOUR_TEXTS):
+            doc_positions = {}
+            for position, word in enumerate(' '.join(lines).split()):
+                doc_positions.setdefault(word.lower().strip('&<>'), []).append(position)
+            for term, term_positions in doc_positions.items():
+                positions.setdefault(term, []).append((doc, term_positions))
+            counts = {}
+            for latex in BEHAVIOUR_FORMULAS[doc]:
+                for term in formula_ngrams(formula_tokens(latex)):
+                    counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                formulas.setdefault(term, []).append((doc, count))
+        path = self.dir.name
+        write_positional_index(os.path.join(path, 'positions.bin'), positions, doc_count)
+        write_binary_index(os.path.join(path, 'formulas.bin'), formulas, doc_count)
+        write_text_store(os.path.join(path, 'text.arrays'), BEHAVIOUR_TEXTS,
+                         [[len(line.split()) for line in lines] for lines in BEHAVIOUR_TEXTS])
+        write_doc_table(os.path.join(path, 'docs.arrays'),
+                        [{'id': '10-%d' % doc, 'title': 'Doc %d' % doc, 'name': 'Doc%d.html' % doc,
+                          'words': len(' '.join(lines).split()), 'links': 0, 'page_rank': 0.0}
+                         for doc, lines in enumerate(BEHAVIOUR_TEXTS)])
+        writer = DocStoreWriter(os.path.join(path, 'docs.bin'))
+        writer.close([writer.add(('<html><body>%s</body></html>' % ''.join(
+            '<p>%s</p>\n' % html.escape(line) for line in lines)).encode('utf-8')) for lines in BEHAVIOUR_TEXTS])
+
+        self.searcher = searcher.Searcher.__new__(searcher.Searcher)
+        self.searcher.index = {'fourier': {'idf': 1.0}, 'series': {'idf': 2.0}}
+        self.searcher.doc_index = DocTable(os.path.join(path, 'docs.arrays'), None)
+        self.searcher.positions = PositionalIndex(os.path.join(path, 'positions.bin'))
+        self.searcher.formulas = BinaryIndex(os.path.join(path, 'formulas.bin'))
+        self.searcher.texts = TextStore(os.path.join(path, 'text.arrays'))
+        self.searcher.documents = DocStore(os.path.join(path, 'docs.bin'))
+        self.searcher.cache = ResultCache()
+
+    def tearDown(self):
+        for mapped in (self.searcher.positions, self.searcher.formulas, self.searcher.documents):
+            mapped.close()
+        self.searcher = None
+        self.dir.cleanup()
+
+    def operator_docs(self, words, window=None):
+        return self.searcher.match_operators(((tuple((word,) for word in words), window),)).tolist()
+
+    def test_phrase(self):
+        self.assertEqual(self.operator_docs(['fourier', 'series']), [2, 5])
+        self.assertEqual(self.operator_docs(['series', 'fourier']), [3])
+        # doc 0 ends with fourier and doc 1 starts with series
+        self.assertEqual(self.operator_docs(['on', 'fourier', 'series']), [])
+        self.assertEqual(self.operator_docs(['fourier', 'series', 'expansions']), [])
+        self.assertEqual(self.operator_docs(['sum', 'of']), [2])
+
+    def test_window(self):
+        self.assertEqual(self.operator_docs(['fourier', 'series'], 2), [2, 3, 5])
+        self.assertEqual(self.operator_docs(['fourier', 'series'], 4), [2, 3, 5])
+        # fourier one two three series is five words
+        self.assertEqual(self.operator_docs(['fourier', 'series'], 5), [2, 3, 4, 5])
+        self.assertEqual(self.operator_docs(['fourier', 'expansions'], 100), [])
+        self.assertEqual(self.operator_docs(['fourier', 'expansions'], ANY_SPAN), [])
+        self.assertEqual(self.operator_docs(['series', 'sines'], ANY_SPAN), [2])
+
+    def test_formula_ranking(self):
+        docs, scores = self.searcher.match_formulas(['x^2 + y^2'])
+        # braces and spaces do not change the tokens, doc 2 only has x^2
+        self.assertEqual(docs.tolist(), [0, 1])
+        ranked = self.searcher.rank_formulas(docs, scores, 10)
+        self.assertEqual([(doc, title) for doc, title, _ in ranked], [(1, 'Doc 1'), (0, 'Doc 0')])
+        self.assertGreater(ranked[0][2], ranked[1][2])
+        self.assertEqual(self.searcher.match_formulas(['x^2'])[0].tolist(), [0, 1, 2])
+        docs, scores = self.searcher.match_formulas(['x^2', '\\frac{a}{b}'])
+        self.assertEqual(docs.tolist(), [])
+        docs, scores = self.searcher.match_formulas(['x^2 + y^2'], np.array([0, 2, 4]))
+        self.assertEqual(docs.tolist(), [0])
+
+    def snippets(self, terms, docs):
+        self.searcher.cache.set_version(object())
+        return self.searcher.snippets(terms, [(doc, 'Doc%d.html' % doc, 0.0) for doc in docs])
+
+    def test_snippets(self):
+        snippets = dict(self.snippets(['fourier', 'series'], [5, 3]))
+        self.assertEqual(snippets['10-3'], [])
+        lines = snippets['10-5']
+        self.assertEqual(lines[0][:60], 'the x&lt;y <b>fourier</b> <b>series</b> of word word word wo')
+        self.assertTrue(lines[0].endswith(' ...'))
+        self.assertEqual(lines[1], '<b>Fourier</b> &amp; &lt;Laplace&gt; transforms compared')
+        self.assertEqual(len(lines), 2)
+        # no query word, the first lines long enough
+        self.assertEqual(self.snippets(['zeta'], [5])[0][1][0], 'Fourier &amp; &lt;Laplace&gt; transforms compared')
+
+    def test_text_store_and_html_give_the_same_snippets(self):
+        docs = list(range(len(BEHAVIOUR_TEXTS)))
+        for terms in (['fourier', 'series'], ['series'], ['laplace', 'sum'], ['zeta']):
+            from_texts = self.snippets(terms, docs)
+            self.searcher.texts = None
+            self.assertEqual(self.snippets(terms, docs), from_texts, terms)
+            self.searcher.texts = TextStore(os.path.join(self.dir.name, 'text.arrays'))
+
+
+class LoaderStartTest(TestCase):
+
+    def test_loads_on_first_request(self):
+        # importing the views starts nothing
+        self.assertIsNone(views.LOADER.started)
+        loader = views.IndexLoader(lambda progress: {})
+        with mock.patch.object(views, 'LOADER', loader):
+            response = views.ready(RequestFactory().get('/ready'))
+            self.assertTrue(loader.wait(10))
+            self.assertIsNotNone(loader.started)
+            self.assertIn(response.status_code, (200, 503))
+            self.assertEqual(views.ready(RequestFactory().get('/ready')).status_code, 200)
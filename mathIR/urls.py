@@ -1,10 +1,12 @@
 from django.urls import path
-from .views import results, home, main, html
+from .views import results, home, main, html, health, ready
 
 
 urlpatterns = [
     path('', home, name='home'),
     path('results', results, name='results'),
     path('main', main, name='main'),
-    path('html', html, name='html')
+    path('html', html, name='html'),
+    path('health', health, name='health'),
+    path('ready', ready, name='ready')
 ]
@@ -1,80 +1,209 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from .custom_lib.indexer import index_collection, create_stems
-from .custom_lib.utils import get_docs_index, get_index, get_stems, get_svm_weights, conjuctive_query, get_index2, \
-    get_lines
-from .custom_lib.retrieval_algorithms import query
-from .custom_lib.query_expansion import expand_term
-from .custom_lib.query_suggestion import clean_terms
+from .custom_lib.utils import get_doc_table, load_index, get_stems, get_svm_weights, get_impact_index, \
+    get_pos_index, get_formula_index, get_text_store, get_doc_store, get_source_files, INDEX_DIR, SNAPSHOT_FILE_NAME, STEM_FILE_NAME
+from .custom_lib.snapshot import load_snapshot, sources_version
+from .custom_lib.result_cache import ResultCache
+from .custom_lib.loader import IndexLoader, FAILED
+from .custom_lib.searcher import Searcher
+from .custom_lib.executor import RequestExecutor
 import time
 import tarfile
 import os
+import re
+
+# 'binary' and 'tsv' only load the term dictionary at startup and read postings
+# when a query needs them, 'memory' parses every posting list up front, 'shared'
+# maps flat arrays read only so server worker processes share one copy
+INDEX_MODE = 'binary'
+# 'bm25' scores every posting of the query terms with NumPy, 'wand' gives the
+# same top 10 scoring only the docs Block-Max WAND cannot rule out, which pays
+# off once the posting lists are much longer than the top k
+BM25_MODEL = 'bm25'
+RERANK_DEPTH = 100
+# models results() runs, they share one QueryPlan, see query_plan.MODELS
+RANKERS = ('bm25', 'cascade', 'bm25mod')
+# seconds browsers keep a collection page before asking if it changed
+PAGE_MAX_AGE = 3600
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
 
-DOC_INDEX = get_docs_index()
-FREQ_INDEX = get_index()
-FREQ_INDEX2 = get_index2()
-ANCHOR_INDEX = get_index(anchor=True)
-SVM_MODEL = get_svm_weights()
 COLLECTION_DIR = "mathIR\static\mathIR\MathTagArticles"
-HTML_DIR = "mathIR\static\collectionDocs\html"
-# Stems
-try:
-    STEM_DICT = get_stems('wiki_stems.tsv')
-except FileNotFoundError:
-    print('wiki_stems.tsv not found creating...')
-    create_stems(FREQ_INDEX)
-    STEM_DICT = get_stems('wiki_stems.tsv')
 
 
+# ---------------------------------------------------------------------------------
+# build every index the views use from the tsv files
+#
+# @input: progress: function called with the name of each step
+# @return: dictionary of the serving indexes
+# ---------------------------------------------------------------------------------
+def build_indexes(progress):
+    progress('frequency index')
+    freq_index = load_index(INDEX_MODE)
+    # Stems
+    progress('stems')
+    try:
+        stem_dict = get_stems(STEM_FILE_NAME)
+    except FileNotFoundError:
+        print(STEM_FILE_NAME, 'not found creating...')
+        create_stems(freq_index)
+        stem_dict = get_stems(STEM_FILE_NAME)
+    progress('doc table')
+    doc_index = get_doc_table()
+    progress('anchor index')
+    anchor_index = load_index(INDEX_MODE, anchor=True)
+    # the score bounds are only read by Block-Max WAND
+    impact_index = None
+    if BM25_MODEL == 'wand':
+        progress('score bounds')
+        impact_index = get_impact_index(freq_index, doc_index)
+    progress('positions')
+    positions = get_pos_index()
+    progress('formulas')
+    formulas = get_formula_index()
+    progress('text store')
+    texts = get_text_store()
+    progress('doc store')
+    documents = get_doc_store()
+    progress('svm weights')
+    return {'doc_index': doc_index,
+            'freq_index': freq_index,
+            'impact_index': impact_index,
+            'positions': positions,
+            'formulas': formulas,
+            'texts': texts,
+            'documents': documents,
+            'anchor_index': anchor_index,
+            'stem_dict': stem_dict,
+            'svm_model': get_svm_weights()}
+
+
+# ---------------------------------------------------------------------------------
+# load the serving indexes from the snapshot, building them if it is out of date
+#
+# @input: progress: function called with the name of each step
+# @return: dictionary of the serving indexes
+# ---------------------------------------------------------------------------------
+def load_indexes(progress):
+    progress('snapshot')
+    key = (INDEX_MODE, BM25_MODEL)
+    indexes = dict(load_snapshot(os.path.join(INDEX_DIR, SNAPSHOT_FILE_NAME), get_source_files(INDEX_MODE),
+                                 lambda: build_indexes(progress), key=key))
+    indexes['version'] = sources_version(get_source_files(INDEX_MODE), key)
+    return indexes
+
+
+SEARCHER = None
+
+
+def set_indexes(indexes):
+    global SEARCHER
+    SEARCHER = Searcher(indexes, RESULT_CACHE, BM25_MODEL, RERANK_DEPTH)
+
+
+# results of repeated queries, shared between workers through the 'results'
+# cache in settings.CACHES if there is one
+RESULT_CACHE = ResultCache(caches['results'] if 'results' in settings.CACHES else None)
+
+# the indexes load in the background, views that need them answer 503 until
+# LOADER is ready.  mysite/wsgi.py starts it when the server starts, or the
+# first request does, so management commands importing the views load nothing
+LOADER = IndexLoader(load_indexes, on_ready=set_indexes)
+WARMING_UP_RETRY_AFTER = 5
+
+
+def indexes_ready():
+    return LOADER.start().is_ready()
+
+
+def warming_up():
+    status = LOADER.status()
+    response = HttpResponse('Warming up, loading ' + status['step'] + '... try again shortly', status=503,
+                            content_type='text/plain')
+    response['Retry-After'] = str(WARMING_UP_RETRY_AFTER)
+    return response
+
+
+# ---------------------------------------------------------------------------------
+# liveness: 200 while the process is up, 500 if the indexes failed to load
+# ---------------------------------------------------------------------------------
+def health(request):
+    status = LOADER.start().status()
+    status['cache'] = RESULT_CACHE.stats()
+    return JsonResponse(status, status=500 if status['state'] == FAILED else 200)
+
+
+# ---------------------------------------------------------------------------------
+# readiness: 200 once the indexes are loaded, 503 while they are loading
+# ---------------------------------------------------------------------------------
+def ready(request):
+    status = LOADER.start().status()
+    return JsonResponse(status, status=200 if LOADER.is_ready() else 503)
+
+
+# ---------------------------------------------------------------------------------
+# a collection page, id is "<collection doc id> <page name>"
+#
+# The page is streamed from a file object, a server with wsgi.file_wrapper
+# sends it with sendfile, gzip compressed as stored to clients that accept it.
+# If-None-Match / If-Modified-Since are answered 304 without opening it.
+# ---------------------------------------------------------------------------------
 def html(request):
+    if not indexes_ready():
+        return warming_up()
     info = request.GET['id'].split()
-    with open(os.path.join(HTML_DIR, info[1] + ".html")) as html_page:
-        return HttpResponse(html_page.read())
+    if len(info) < 2:
+        raise Http404('No document ' + request.GET['id'])
+    try:
+        doc = SEARCHER.doc_index.doc_number(info[0])
+        etag, last_modified = SEARCHER.page_version(doc, info[1])
+    except (KeyError, FileNotFoundError):
+        raise Http404('No document ' + info[0])
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        compressed = bool(ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        page, length, is_compressed = SEARCHER.open_page(doc, info[1], compressed)
+        response = FileResponse(page)
+        # FileResponse guesses these from the file object, set them after
+        response['Content-Type'] = 'text/html; charset=utf-8'
+        response['Content-Length'] = str(length)
+        if is_compressed:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, max_age=PAGE_MAX_AGE)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
 
 def results(request):
+    if not indexes_ready():
+        return warming_up()
     result_dict = {}
-    t1 = time.time_ns()
     results_header = ""
-    term_str = request.GET['query'].lower().strip()
-    terms_in = term_str.split()
-    clean_start = time.time_ns()
-    terms_clean = clean_terms(terms_in, FREQ_INDEX, DOC_INDEX)
-    clean_stop = time.time_ns()
-    if terms_in != terms_clean:
+    t2 = time.time_ns()
+    # the rankers, and then the snippets of the results, run in parallel
+    executor = RequestExecutor()
+    found = SEARCHER.search(request.GET['query'], RANKERS, k=10, executor=executor)
+    term_str = found.query
+    if found.words != found.terms:
         results_header = "No reasults found for [" + term_str
-        term_str = ' '.join(terms_clean)
+        term_str = ' '.join(found.terms)
         results_header += "] searching [" + term_str + "] instead..."
-    terms_in = terms_clean
-    expand_start = time.time_ns()
-    expanded_terms = expand_term(terms_in, STEM_DICT)
-    expand_stop = time.time_ns()
-    expanded_terms_list = []
-    for i in terms_in:
-        expanded_terms_list.append(expand_term([i], STEM_DICT))
-
-    t2 = time.time_ns()
-    mod_bm25_index = {k: v for k, v in FREQ_INDEX.items() if k in expanded_terms}
-    doc_list = conjuctive_query(expanded_terms_list, mod_bm25_index)
-    doc_index_terms = {k: v for k, v in DOC_INDEX.items() if k in doc_list}
-    res3 = sorted(query(expanded_terms, mod_bm25_index, DOC_INDEX, ANCHOR_INDEX, SVM_MODEL, "bm25mod",
-                        doc_index_terms=doc_index_terms),
-                  key=lambda x: x[2], reverse=True)[0:10]
-
+    terms_in = found.terms
+    res1 = found.ranked.get('bm25', [])
+    res2 = sorted(found.ranked.get('cascade', []), key=lambda x: x[2], reverse=True)[0:10]
+    res3 = found.ranked.get('bm25mod', [])
     t3 = time.time_ns()
-    res1 = sorted(query(expanded_terms, FREQ_INDEX, DOC_INDEX, ANCHOR_INDEX, SVM_MODEL, "bm25"),
-                  key=lambda x: x[2], reverse=True)[0:10]
-
-    t4 = time.time_ns()
-    res2 = sorted(query(expanded_terms, FREQ_INDEX, DOC_INDEX, ANCHOR_INDEX, SVM_MODEL, "svm"),
-                  key=lambda x: x[2], reverse=True)[0:10]
-
-    print("SETUP TIME ", (t2-t1)/1000, "us")
-    print("Clean Time: ", (clean_stop-clean_start)/1000000, "ms")
-    print("Expand Time: ", (expand_stop-expand_start)/1000000, "ms")
 
-    print("MOD BM 25: ", (t3-t2)/1000000, "ms")
-    print("BM 25: ", (t4-t3)/1000000, "ms")
-    print("SVM: ", (time.time_ns() - t4)/1000000, "ms")
+    for stage, ms in found.timings.items():
+        print(stage + ": ", ms, "ms")
+    if found.cached:
+        print("cached: ", ', '.join(found.cached))
 
     print("rank\t", "bm25\t", "svm\t", "mod_bm25")
     print("---------------------------")
@@ -94,10 +223,13 @@ def results(request):
             prnt_str += '\t'
         print(prnt_str)
     t5 = time.time_ns()
-    for i in res2:
-        result_dict[i[1]] = (i[0], get_lines(terms_in, FREQ_INDEX, i[0], i[1]))
+    for i, (doc_id, lines) in enumerate(SEARCHER.snippets(terms_in, res2, executor)):
+        result_dict[res2[i][1]] = (doc_id, lines)
     t6 = time.time_ns()
-    time_to_query = str((t4-t3)/1000000) + "ms"
+    for stage, ms in executor.timings.items():
+        if stage.startswith('snippet'):
+            print(stage + ": ", ms, "ms")
+    time_to_query = str((t3-t2)/1000000) + "ms"
     time_to_render = str((t6-t5)/1000000) + "ms"
     print("Render Time:", time_to_render, "Query Time: ", time_to_query)
 
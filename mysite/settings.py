@@ -80,6 +80,26 @@ DATABASES = {
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# query results are cached in each server worker, set MATHIR_RESULT_CACHE to
+# the address of a memcached server (host:port) to share them between the
+# workers as well, see mathIR/custom_lib/result_cache.py
+if os.environ.get('MATHIR_RESULT_CACHE'):
+    CACHES['results'] = {
+        'BACKEND': os.environ.get('MATHIR_RESULT_CACHE_BACKEND',
+                                  'django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': os.environ['MATHIR_RESULT_CACHE'],
+        'TIMEOUT': 600,
+    }
+
 DEFAULT_CHARSET = 'UTF-8'
 FILE_CHARSET = 'UTF-8'
 
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# load the search indexes while the server starts rather than on the first request
+from mathIR.views import LOADER  # noqa: E402
+LOADER.start()